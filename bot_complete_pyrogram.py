@@ -44,19 +44,18 @@ import logging
 import asyncio
 import time
 import random
+import re
 from typing import Optional
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 import psutil
 import traceback
 
 # Pyrogram
-from pyrogram import Client, filters, types
+from pyrogram import Client, filters, types, enums
 from pyrogram.errors import ChatAdminRequired, UserAdminInvalid, PeerIdInvalid, FloodWait
 from pyrogram.types import InlineKeyboardMarkup, InlineKeyboardButton, Message
 
-# Dependencies
-import httpx
-
 # Try g4f fallback
 try:
     import g4f
@@ -68,21 +67,45 @@ except Exception:
 from aiohttp import web
 from dotenv import load_dotenv
 
+# Before the utils.* imports below: they read their settings at import time
+load_dotenv()
+
 # Database & Economy
-from utils.firebase_db import (
+from utils.storage import (
     init_db,
+    shutdown as shutdown_storage,
+    cache_stats,
+    txn_stats,
+    write_behind_stats,
+    ledger_stats,
     ensure_user,
     get_user,
     change_balance,
     transfer,
+    settle_bet,
     claim_daily,
     set_dead,
     set_protect,
     top_users,
     set_premium,
     is_premium,
+    history,
+    history_count,
 )
 
+from utils.user_locks import StripedLocks
+from utils.http_pool import PooledHTTP, iter_sse
+from utils.key_scheduler import KeyScheduler, parse_retry_after
+from utils.reply_cache import ReplyCache
+from utils.stream_edit import ProgressiveReply
+from utils.conversation import ConversationMemory
+from utils.mention_batcher import MentionBatcher
+from utils.hedging import HedgePolicy
+from utils.send_queue import SendQueue, LANE_GAME, LANE_COMMAND, LANE_CHAT
+from utils.rate_limit import InboundLimiter
+from utils.dispatcher import CommandRegistry
+from utils.chat_executor import ChatExecutor
+
 # New games
 from games.slots_pyrogram import SlotsGame
 from games.roulette_pyrogram import RouletteGame
@@ -90,8 +113,6 @@ from games.blackjack_pyrogram import BlackjackGame
 from games.dice_pyrogram import DiceGame
 from games.lucky_draw_pyrogram import LuckyDrawGame
 
-load_dotenv()
-
 # ═══════════════════════════════════════════════════════════════════════════════
 # LOGGING
 # ═══════════════════════════════════════════════════════════════════════════════
@@ -122,7 +143,80 @@ HINATA_STICKERS = [
     "CAACAgUAAxkBAAEQgl1pj2u6CJJq6jC-kXYHM9fvpJ5ygAACXgUAAov2IVf0ZtG-JNnfFToE",
 ]
 
-_groq_index = 0
+# Picks the healthiest Groq key per request (see utils/key_scheduler.py)
+groq_keys = KeyScheduler(
+    GROQ_KEYS,
+    failure_threshold=int(os.getenv("GROQ_BREAKER_FAILURES", "3")),
+    open_seconds=float(os.getenv("GROQ_BREAKER_SECONDS", "30")),
+    default_cooldown=float(os.getenv("GROQ_COOLDOWN_SECONDS", "30")),
+)
+GROQ_MAX_ATTEMPTS = int(os.getenv("GROQ_MAX_ATTEMPTS", "2"))
+
+# Race a backup request once the primary is slower than GROQ_HEDGE_PERCENTILE
+GROQ_HEDGE = os.getenv("GROQ_HEDGE", "1") == "1"
+groq_hedge = HedgePolicy(
+    percentile=float(os.getenv("GROQ_HEDGE_PERCENTILE", "95")),
+    default_delay=float(os.getenv("GROQ_HEDGE_DELAY", "2.0")),
+    min_delay=float(os.getenv("GROQ_HEDGE_MIN_DELAY", "0.3")),
+    max_delay=float(os.getenv("GROQ_HEDGE_MAX_DELAY", "10")),
+)
+# Streamed replies hedge on time to first token, which has its own distribution
+groq_stream_hedge = HedgePolicy(
+    percentile=groq_hedge.percentile,
+    default_delay=groq_hedge.default_delay,
+    min_delay=groq_hedge.min_delay,
+    max_delay=groq_hedge.max_delay,
+)
+
+# Recent turns per chat, replayed into Hinata prompts (see utils/conversation.py)
+chat_memory = ConversationMemory(
+    max_turns=int(os.getenv("CHAT_MEMORY_TURNS", "12")),
+    max_turn_chars=int(os.getenv("CHAT_MEMORY_TURN_CHARS", "500")),
+    max_chats=int(os.getenv("CHAT_MEMORY_MAX_CHATS", "5000")),
+    max_total_chars=int(os.getenv("CHAT_MEMORY_MAX_CHARS", str(8 * 1024 * 1024))),
+    idle_seconds=float(os.getenv("CHAT_MEMORY_IDLE_SECONDS", "3600")),
+)
+CHAT_MEMORY_TOKENS = int(os.getenv("CHAT_MEMORY_TOKENS", "600"))
+
+# Group mentions arriving within HINATA_BATCH_WINDOW_MS of an answered one
+# share one upstream call (the first is never delayed);
+# HINATA_BATCH_MODE is "threaded" (a reply to each message) or "combined"
+HINATA_BATCH_WINDOW_MS = float(os.getenv("HINATA_BATCH_WINDOW_MS", "1500"))
+HINATA_BATCH_MAX = int(os.getenv("HINATA_BATCH_MAX", "8"))
+HINATA_BATCH_MODE = os.getenv("HINATA_BATCH_MODE", "threaded").lower()
+
+# Stream Hinata replies into a message edited every HINATA_STREAM_EDIT_SECONDS
+HINATA_STREAM = os.getenv("HINATA_STREAM", "1") == "1"
+HINATA_STREAM_EDIT_SECONDS = float(os.getenv("HINATA_STREAM_EDIT_SECONDS", "1.0"))
+
+# Shared replies for short repeated messages ("hi", "hello"); see utils/reply_cache.py
+reply_cache = ReplyCache(
+    max_size=int(os.getenv("REPLY_CACHE_SIZE", "1000")),
+    ttl=float(os.getenv("REPLY_CACHE_TTL", "600")),
+    max_words=int(os.getenv("REPLY_CACHE_MAX_WORDS", "4")),
+)
+
+# Long-lived pooled client for Groq; started in main(), closed on shutdown
+ai_http = PooledHTTP(
+    max_connections=int(os.getenv("GROQ_POOL_SIZE", "20")),
+    max_keepalive=int(os.getenv("GROQ_POOL_KEEPALIVE", "10")),
+    keepalive_expiry=float(os.getenv("GROQ_KEEPALIVE_EXPIRY", "60")),
+    connect_timeout=float(os.getenv("GROQ_CONNECT_TIMEOUT", "5")),
+    read_timeout=float(os.getenv("GROQ_READ_TIMEOUT", "30")),
+    http2=os.getenv("GROQ_HTTP2", "1") == "1",
+)
+
+# g4f is synchronous: it runs on its own small pool, at most G4F_WORKERS calls
+# at a time, and is abandoned after G4F_TIMEOUT seconds
+HINATA_FALLBACK = "a-ano... I-I'm not sure, Naruto-kun..."
+G4F_WORKERS = int(os.getenv("G4F_WORKERS", "4"))
+G4F_TIMEOUT = float(os.getenv("G4F_TIMEOUT", "20"))
+_g4f_executor = ThreadPoolExecutor(max_workers=G4F_WORKERS, thread_name_prefix="g4f")
+_g4f_slots = asyncio.Semaphore(G4F_WORKERS)
+g4f_stats = {"calls": 0, "ok": 0, "timeouts": 0, "rejected": 0, "errors": 0, "busy": 0}
+
+# Serialises balance-mutating commands per user (see utils/user_locks.py)
+user_locks = StripedLocks(int(os.getenv("USER_LOCK_STRIPES", "64")))
 
 if not all([API_ID, API_HASH, BOT_TOKEN, OWNER_ID]):
     print(f"❌ Missing env: API_ID={API_ID}, API_HASH={bool(API_HASH)}, BOT_TOKEN={bool(BOT_TOKEN)}, OWNER_ID={OWNER_ID}")
@@ -136,6 +230,37 @@ app = Client(
     workdir="./sessions",
 )
 
+# Every /, . and ! command is registered here and served by dispatch_command()
+commands = CommandRegistry()
+is_command = commands.filter
+
+# Commands run in order within a chat and in parallel across chats (see
+# utils/chat_executor.py); Hinata stays outside so mention batching still works
+chat_executor = ChatExecutor(
+    max_active=int(os.getenv("CHAT_EXEC_MAX_ACTIVE", "64")),
+    max_backlog=int(os.getenv("CHAT_EXEC_MAX_BACKLOG", "50")),
+    quantum=int(os.getenv("CHAT_EXEC_QUANTUM", "8")),
+)
+
+# All outgoing messages are paced through one queue (see utils/send_queue.py)
+send_queue = SendQueue(
+    workers=int(os.getenv("SEND_WORKERS", "4")),
+    global_rate=float(os.getenv("SEND_GLOBAL_RATE", "25")),
+    chat_rate=float(os.getenv("SEND_CHAT_RATE", "1")),
+    chat_burst=int(os.getenv("SEND_CHAT_BURST", "3")),
+    max_retries=int(os.getenv("SEND_MAX_RETRIES", "3")),
+    max_flood_wait=float(os.getenv("SEND_MAX_FLOOD_WAIT", "60")),
+)
+
+
+async def send_reply(message: Message, text: str, lane: int = LANE_COMMAND, **kwargs):
+    """message.reply_text through the send queue"""
+    return await send_queue.send(message.chat.id, lambda: message.reply_text(text, **kwargs), lane)
+
+
+async def reply_sticker(message: Message, sticker: str, lane: int = LANE_CHAT):
+    return await send_queue.send(message.chat.id, lambda: message.reply_sticker(sticker), lane)
+
 # ═══════════════════════════════════════════════════════════════════════════════
 # PREMIUM UI FORMATTER
 # ═══════════════════════════════════════════════════════════════════════════════
@@ -174,62 +299,351 @@ class PremiumUI:
 # ═══════════════════════════════════════════════════════════════════════════════
 
 
-async def call_groq(prompt: str) -> str:
-    """Call Groq with automatic rotation and g4f fallback"""
-    global _groq_index
+def _g4f_done(fut):
+    """Free the slot only once the worker thread has really finished"""
+    _g4f_slots.release()
+    g4f_stats["busy"] -= 1
+    if not fut.cancelled() and fut.exception() is not None:
+        logger.warning(f"g4f error: {fut.exception()}")
 
-    if not GROQ_KEYS:
-        if G4F_AVAILABLE:
-            try:
-                reply = g4f.chat_completion.create(prompt)
-                return reply if reply else "a-ano..."
-            except:
-                pass
-        return "a-ano... I-I'm not sure, Naruto-kun..."
 
-    async with httpx.AsyncClient(timeout=30.0) as client:
-        for attempt in range(len(GROQ_KEYS)):
-            key = GROQ_KEYS[_groq_index % len(GROQ_KEYS)]
-            _groq_index += 1
-            headers = {"Authorization": f"Bearer {key}", "Content-Type": "application/json"}
-            payload = {"model": "llama3-8b-8192", "input": prompt, "max_output_tokens": 512}
+async def call_g4f(prompt: str) -> str:
+    """g4f fallback off the event loop, with a hard deadline"""
+    if not G4F_AVAILABLE:
+        return HINATA_FALLBACK
 
-            try:
-                resp = await client.post("https://api.groq.ai/v1/completions", json=payload, headers=headers)
-                if resp.status_code == 200:
-                    data = resp.json()
-                    text = data.get("output") or data.get("text")
-                    if text:
-                        return text.strip()
-            except Exception as e:
-                logger.warning(f"Groq error: {e}")
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + G4F_TIMEOUT
+    g4f_stats["calls"] += 1
+    try:
+        await asyncio.wait_for(_g4f_slots.acquire(), G4F_TIMEOUT)
+    except asyncio.TimeoutError:
+        g4f_stats["rejected"] += 1
+        return HINATA_FALLBACK
+
+    g4f_stats["busy"] += 1
+    fut = loop.run_in_executor(_g4f_executor, g4f.chat_completion.create, prompt)
+    fut.add_done_callback(_g4f_done)
+    try:
+        # shield: a timed-out call keeps its slot until the thread returns, so
+        # abandoned calls cannot pile up beyond G4F_WORKERS threads
+        reply = await asyncio.wait_for(asyncio.shield(fut), max(0.0, deadline - loop.time()))
+    except asyncio.TimeoutError:
+        g4f_stats["timeouts"] += 1
+        return HINATA_FALLBACK
+    except Exception:
+        g4f_stats["errors"] += 1
+        return HINATA_FALLBACK
+
+    g4f_stats["ok"] += 1
+    return reply if reply else HINATA_FALLBACK
+
+
+async def _groq_attempt(prompt: str, key: str):
+    """One Groq request on `key`; the reply text, or None on failure"""
+    headers = {"Authorization": f"Bearer {key}", "Content-Type": "application/json"}
+    payload = {"model": "llama3-8b-8192", "input": prompt, "max_output_tokens": 512}
+
+    started = time.perf_counter()
+    try:
+        resp = await ai_http.post("https://api.groq.ai/v1/completions", json=payload, headers=headers)
+    except asyncio.CancelledError:
+        groq_keys.release(key)
+        raise
+    except Exception as e:
+        groq_keys.failure(key)
+        logger.warning(f"Groq error: {e}")
+        return None
+
+    if resp.status_code != 200:
+        groq_keys.failure(key, resp.status_code, parse_retry_after(resp.headers.get("retry-after")))
+        return None
+    elapsed = time.perf_counter() - started
+    groq_keys.success(key, elapsed)
+    groq_hedge.observe(elapsed)
+    data = resp.json()
+    text = data.get("output") or data.get("text")
+    return text.strip() if text else None
+
+
+async def _g4f_attempt(prompt: str):
+    reply = await call_g4f(prompt)
+    return None if reply == HINATA_FALLBACK else reply
+
+
+async def call_groq(prompt: str) -> str:
+    """Call Groq on the healthiest keys, hedging slow requests, with g4f fallback"""
+    if not GROQ_KEYS:
+        return await call_g4f(prompt)
+
+    tried = set()
+    running = {}  # task -> "primary" | "hedge"
+    used_g4f = False
+
+    def launch(role: str, allow_g4f: bool = False) -> bool:
+        nonlocal used_g4f
+        key = groq_keys.pick(exclude=tried)
+        if key is not None:
+            tried.add(key)
+            running[asyncio.ensure_future(_groq_attempt(prompt, key))] = role
+            return True
+        if allow_g4f and G4F_AVAILABLE and not used_g4f:
+            used_g4f = True
+            running[asyncio.ensure_future(_g4f_attempt(prompt))] = role
+            return True
+        return False
+
+    launch("primary")
+    hedged = False
+    try:
+        while running:
+            timeout = groq_hedge.delay() if GROQ_HEDGE and not hedged else None
+            done, _ = await asyncio.wait(running, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                # Primary is slower than usual: race a backup against it
+                hedged = True
+                if launch("hedge", allow_g4f=True):
+                    groq_hedge.hedged += 1
+                continue
+            for task in done:
+                role = running.pop(task)
+                text = None if task.cancelled() or task.exception() else task.result()
+                if text:
+                    if hedged:
+                        if role == "hedge":
+                            groq_hedge.hedge_wins += 1
+                        else:
+                            groq_hedge.primary_wins += 1
+                    return text
+            if not running and len(tried) < GROQ_MAX_ATTEMPTS:
+                launch("primary")
+    finally:
+        for task in running:
+            task.cancel()
 
     # Fallback
-    if G4F_AVAILABLE:
+    return HINATA_FALLBACK if used_g4f else await call_g4f(prompt)
+
+
+def _chunk_text(event: dict) -> str:
+    """Text of one streamed completion event"""
+    text = event.get("output") or event.get("text")
+    if text:
+        return text
+    choices = event.get("choices") or [{}]
+    return (choices[0].get("delta") or {}).get("content") or choices[0].get("text") or ""
+
+
+async def _groq_stream_attempt(prompt: str, key: str):
+    """Stream one Groq request on `key`; yields nothing if it fails before
+    the first token, and just stops if it is cut off later"""
+    headers = {"Authorization": f"Bearer {key}", "Content-Type": "application/json"}
+    payload = {"model": "llama3-8b-8192", "input": prompt, "max_output_tokens": 512, "stream": True}
+
+    started = time.perf_counter()
+    reported = False
+    streamed = False
+    try:
+        async with ai_http.stream("https://api.groq.ai/v1/completions", json=payload, headers=headers) as resp:
+            if resp.status_code != 200:
+                reported = True
+                groq_keys.failure(key, resp.status_code, parse_retry_after(resp.headers.get("retry-after")))
+                return
+            async for event in iter_sse(resp):
+                text = _chunk_text(event)
+                if not text:
+                    continue
+                if not reported:
+                    # Key health and hedge timing are judged on time to first token here
+                    reported = True
+                    first_token = time.perf_counter() - started
+                    groq_keys.success(key, first_token)
+                    groq_stream_hedge.observe(first_token)
+                streamed = True
+                yield text
+    except Exception as e:
+        if not streamed:
+            reported = True
+            groq_keys.failure(key)
+            logger.warning(f"Groq error: {e}")
+            return
+        logger.warning(f"Groq stream cut off: {e}")
+    finally:
+        if not reported:
+            groq_keys.release(key)
+
+
+async def _g4f_stream_attempt(prompt: str):
+    reply = await _g4f_attempt(prompt)
+    if reply:
+        yield reply
+
+
+async def stream_groq(prompt: str):
+    """Yield reply text as Groq streams it; same key handling, hedging and
+    fallback as call_groq, with the hedge timed on the first token"""
+    if not GROQ_KEYS:
+        yield await call_g4f(prompt)
+        return
+
+    tried = set()
+    opening = {}  # first-chunk task -> (stream, "primary" | "hedge")
+    used_g4f = False
+
+    def launch(role: str, allow_g4f: bool = False) -> bool:
+        nonlocal used_g4f
+        key = groq_keys.pick(exclude=tried)
+        if key is not None:
+            tried.add(key)
+            stream = _groq_stream_attempt(prompt, key)
+        elif allow_g4f and G4F_AVAILABLE and not used_g4f:
+            used_g4f = True
+            stream = _g4f_stream_attempt(prompt)
+        else:
+            return False
+        opening[asyncio.ensure_future(stream.__anext__())] = (stream, role)
+        return True
+
+    async def discard(tasks: dict):
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for stream, _ in tasks.values():
+            await stream.aclose()
+
+    winner = first = None
+    launch("primary")
+    hedged = False
+    try:
+        while opening and winner is None:
+            timeout = groq_stream_hedge.delay() if GROQ_HEDGE and not hedged else None
+            done, _ = await asyncio.wait(opening, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                # No first token yet after the usual wait: race a backup
+                hedged = True
+                if launch("hedge", allow_g4f=True):
+                    groq_stream_hedge.hedged += 1
+                continue
+            for task in done:
+                stream, role = opening.pop(task)
+                if winner is None and not task.cancelled() and task.exception() is None:
+                    winner, first = stream, task.result()
+                    if hedged:
+                        if role == "hedge":
+                            groq_stream_hedge.hedge_wins += 1
+                        else:
+                            groq_stream_hedge.primary_wins += 1
+                else:
+                    await discard({task: (stream, role)})
+            if winner is None and not opening and len(tried) < GROQ_MAX_ATTEMPTS:
+                launch("primary")
+    finally:
+        await discard(opening)
+
+    if winner is not None:
         try:
-            return g4f.chat_completion.create(prompt)
-        except:
-            pass
+            yield first
+            async for text in winner:
+                yield text
+        finally:
+            await winner.aclose()
+        return
 
-    return "a-ano... I-I'm not sure, Naruto-kun..."
+    # Fallback
+    yield HINATA_FALLBACK if used_g4f else await call_g4f(prompt)
 
 
-def make_hinata_prompt(msg: str, name: str = None) -> str:
-    """Create Hinata persona prompt"""
+def make_hinata_batch_prompt(turns: list, history: list = None) -> str:
+    """Prompt answering several (speaker, text) messages at once, one numbered line each"""
+    past = "".join(f"{speaker}: {text}\n" for speaker, text in history or ())
+    asked = "".join(f"{i}. {speaker}: {text}\n" for i, (speaker, text) in enumerate(turns, 1))
+    return (
+        "You are Hinata Hyuga from Naruto anime. Be shy, caring, kind. Use 'Naruto-kun' sometimes. "
+        "Stutter like 'a-ano...'. Never admit being AI. Keep each reply SHORT (1 sentence). "
+        "Always be supportive and gentle.\n\n"
+        + (f"Conversation so far:\n{past}\n" if past else "")
+        + "Several people talked to you at once. Answer each of them on its own line, "
+        "as '<number>: <reply>'.\n"
+        + asked
+        + "\nHinata (shy):"
+    )
+
+
+def make_hinata_prompt(msg: str, name: str = None, history: list = None) -> str:
+    """Create Hinata persona prompt, optionally replaying recent (speaker, text) turns"""
+    past = "".join(f"{speaker}: {text}\n" for speaker, text in history or ())
     return (
         "You are Hinata Hyuga from Naruto anime. Be shy, caring, kind. Use 'Naruto-kun' sometimes. "
         "Stutter like 'a-ano...'. Never admit being AI. Keep replies SHORT (1-2 sentences). "
         "Always be supportive and gentle.\n\n"
-        f"User ({name or 'friend'}): {msg}\n\nHinata (shy):"
+        + (f"Conversation so far:\n{past}\n" if past else "")
+        + f"User ({name or 'friend'}): {msg}\n\nHinata (shy):"
     )
 
 
+# ═══════════════════════════════════════════════════════════════════════════════
+# INBOUND RATE LIMIT (runs before every other handler)
+# ═══════════════════════════════════════════════════════════════════════════════
+
+RATE_GAME_COMMANDS = {"slots", "blackjack", "dice", "lucky", "roulette"}
+
+# Token costs per update class; see utils/rate_limit.py
+inbound_limiter = InboundLimiter(
+    costs={
+        "command": float(os.getenv("RATE_COST_COMMAND", "1")),
+        "game": float(os.getenv("RATE_COST_GAME", "2")),
+        "ai": float(os.getenv("RATE_COST_AI", "5")),
+    },
+    user_burst=float(os.getenv("RATE_USER_BURST", "20")),
+    user_per_minute=float(os.getenv("RATE_USER_PER_MIN", "30")),
+    chat_burst=float(os.getenv("RATE_CHAT_BURST", "60")),
+    chat_per_minute=float(os.getenv("RATE_CHAT_PER_MIN", "120")),
+)
+
+
+def _update_class(message: Message) -> Optional[str]:
+    """Rate-limit class of a message, or None if no handler would act on it"""
+    text = message.text or ""
+    parsed = CommandRegistry.parse(text, getattr(app.me, "username", None))
+    if parsed is not None:
+        return "game" if parsed[1] in RATE_GAME_COMMANDS else "command"
+    if not text:
+        return None
+    if message.chat.type == enums.ChatType.PRIVATE or message.mentioned:
+        return "ai"
+    replied = message.reply_to_message
+    if replied and replied.from_user and replied.from_user.is_bot:
+        return "ai"
+    return None
+
+
+@app.on_message(filters.incoming, group=-1)
+async def inbound_rate_limit(client: Client, message: Message):
+    """Drop updates from users or chats over their budget"""
+    user = message.from_user
+    if user is None or user.id == OWNER_ID:
+        return
+    kind = _update_class(message)
+    if kind is None:
+        return
+
+    allowed, notify, retry_after = inbound_limiter.check(user.id, message.chat.id, kind)
+    if allowed:
+        return
+    if notify:
+        try:
+            await send_reply(message, f"⏳ Slow down! Try again in {max(1, round(retry_after))}s")
+        except Exception as e:
+            logger.warning(f"Rate limit notice failed: {e}")
+    message.stop_propagation()
+
+
 # ═══════════════════════════════════════════════════════════════════════════════
 # COMMAND HANDLERS - CORE
 # ═══════════════════════════════════════════════════════════════════════════════
 
 
-@app.on_message(filters.command("start") & filters.private)
+@commands.register("start", private_only=True)
 async def start_cmd(client: Client, message: Message):
     """Welcome message"""
     try:
@@ -268,13 +682,13 @@ Hi {message.from_user.first_name}! 👋
             [InlineKeyboardButton("💰 Economy", callback_data="economy"),
              InlineKeyboardButton("✨ Premium", callback_data="premium")],
         ])
-        await message.reply_text(text, reply_markup=kb)
+        await send_reply(message, text, reply_markup=kb)
     except Exception as e:
         logger.error(f"Error in /start: {e}")
-        await message.reply_text("Welcome to GAMEBOT v4.0! Use /help for commands.")
+        await send_reply(message, "Welcome to GAMEBOT v4.0! Use /help for commands.")
 
 
-@app.on_message(filters.command("help"))
+@commands.register("help")
 async def help_cmd(client: Client, message: Message):
     """Help menu"""
     text = f"""{PremiumUI.brand()}
@@ -293,6 +707,7 @@ async def help_cmd(client: Client, message: Message):
 /steal (reply) - Rob coins
 /protect - 24h protection (200 coins)
 /revive (reply) - Revive dead (200)
+/history [page] - Your transactions
 
 💬 <b>OTHER:</b>
 /dev - Show credits
@@ -300,16 +715,16 @@ async def help_cmd(client: Client, message: Message):
 /info - Your info
 .help or !help - Prefix commands
 """
-    await message.reply_text(text)
+    await send_reply(message, text)
 
 
-@app.on_message(filters.command("dev"))
+@commands.register("dev")
 async def dev_cmd(client: Client, message: Message):
     """Developer credits"""
-    await message.reply_text("🤖 <b>CREATED BY FIGLETAXL</b>\n\n📢 JOIN: @vfriendschat\n\n💎 GAMEBOT v4.0 - Pyrogram Complete")
+    await send_reply(message, "🤖 <b>CREATED BY FIGLETAXL</b>\n\n📢 JOIN: @vfriendschat\n\n💎 GAMEBOT v4.0 - Pyrogram Complete")
 
 
-@app.on_message(filters.command("ping"))
+@commands.register("ping")
 async def ping_cmd(client: Client, message: Message):
     """Ping - show status"""
     try:
@@ -325,7 +740,7 @@ async def ping_cmd(client: Client, message: Message):
 Server: Koyeb (High-Availability)
 Uptime: Running
 """
-        await message.reply_text(text)
+        await send_reply(message, text)
     except Exception as e:
         logger.error(f"Error in /ping: {e}")
 
@@ -339,40 +754,48 @@ PROTECT_COST = 200
 REVIVE_COST = 200
 
 
-@app.on_message(filters.command("daily"))
+@commands.register("daily")
 async def daily_cmd(client: Client, message: Message):
     """Claim daily coins"""
     user = message.from_user
-    ensure_user(user.id, user.username)
+    await ensure_user(user.id, user.username)
 
     now = int(time.time())
-    if is_premium(user.id):
-        change_balance(user.id, DAILY_AMOUNT)
-        new_bal = get_user(user.id)["balance"]
-        await message.reply_text(
+    async with user_locks.hold(user.id):
+        premium = await is_premium(user.id)
+        if premium:
+            new_bal = await change_balance(user.id, DAILY_AMOUNT, reason="daily")
+        elif await claim_daily(user.id, DAILY_AMOUNT, now):
+            new_bal = (await get_user(user.id))["balance"]
+        else:
+            new_bal = None
+
+    if premium:
+        await send_reply(
+            message,
             f"💰 <b>PREMIUM DAILY!</b>\n"
             f"✨ +{DAILY_AMOUNT} ₹ (No cooldown)\n"
             f"💼 Balance: <b>{new_bal} ₹</b>"
         )
         return
 
-    if claim_daily(user.id, DAILY_AMOUNT, now):
-        new_bal = get_user(user.id)["balance"]
-        await message.reply_text(
+    if new_bal is not None:
+        await send_reply(
+            message,
             f"💰 <b>DAILY CLAIM!</b>\n"
             f"✨ +{DAILY_AMOUNT} ₹\n"
             f"💼 Balance: <b>{new_bal} ₹</b>"
         )
     else:
-        await message.reply_text("⏰ Already claimed today! Come back in 24h")
+        await send_reply(message, "⏰ Already claimed today! Come back in 24h")
 
 
-@app.on_message(filters.command("balance"))
+@commands.register("balance")
 async def balance_cmd(client: Client, message: Message):
     """Check balance"""
     user = message.from_user
-    ensure_user(user.id, user.username)
-    row = get_user(user.id)
+    await ensure_user(user.id, user.username)
+    row = await get_user(user.id)
 
     status = "💀 DEAD" if row["is_dead"] else "✅ ALIVE"
     premium = "👑 PREMIUM" if row["is_premium"] else "⭕ REGULAR"
@@ -383,15 +806,15 @@ async def balance_cmd(client: Client, message: Message):
 Status: {status} | {premium}
 🆔 ID: <code>{user.id}</code>
 """
-    await message.reply_text(text)
+    await send_reply(message, text)
 
 
-@app.on_message(filters.command("leaderboard"))
+@commands.register("leaderboard")
 async def leaderboard_cmd(client: Client, message: Message):
     """Top 15 users"""
-    rows = top_users(15)
+    rows = await top_users(15)
     if not rows:
-        await message.reply_text("No users yet! Use /daily to start.")
+        await send_reply(message, "No users yet! Use /daily to start.")
         return
 
     text = "🏆 <b>TOP 15 RICHEST</b>\n" + "─" * 30 + "\n\n"
@@ -402,37 +825,43 @@ async def leaderboard_cmd(client: Client, message: Message):
         prem = "👑" if r["is_premium"] else ""
         text += f"{medal} {username} — {r['balance']} ₹ {dead} {prem}\n"
 
-    await message.reply_text(text)
+    await send_reply(message, text)
 
 
-@app.on_message(filters.command("send"))
+@commands.register("send")
 async def send_cmd(client: Client, message: Message):
     """Send coins to user"""
     if not message.reply_to_message:
-        await message.reply_text("❌ Reply to a user! \nUsage: /send 100")
+        await send_reply(message, "❌ Reply to a user! \nUsage: /send 100")
         return
 
     try:
         amount = int(message.command[1])
     except (IndexError, ValueError):
-        await message.reply_text("❌ Usage: /send <amount>")
+        await send_reply(message, "❌ Usage: /send <amount>")
         return
 
     sender = message.from_user
     recipient = message.reply_to_message.from_user
 
-    ensure_user(sender.id, sender.username)
-    ensure_user(recipient.id, recipient.username)
+    await ensure_user(sender.id, sender.username)
+    await ensure_user(recipient.id, recipient.username)
 
-    sender_row = get_user(sender.id)
-    if sender_row["balance"] < amount:
-        await message.reply_text(f"❌ Insufficient balance! You have {sender_row['balance']} ₹")
+    async with user_locks.hold(sender.id, recipient.id):
+        sender_row = await get_user(sender.id)
+        if sender_row["balance"] < amount:
+            ok = None
+        else:
+            ok = await transfer(sender.id, recipient.id, amount)
+            new_sender = (await get_user(sender.id))["balance"]
+
+    if ok is None:
+        await send_reply(message, f"❌ Insufficient balance! You have {sender_row['balance']} ₹")
         return
 
-    if transfer(sender.id, recipient.id, amount):
-        new_sender = get_user(sender.id)["balance"]
-        new_recipient = get_user(recipient.id)["balance"]
-        await message.reply_text(
+    if ok:
+        await send_reply(
+            message,
             f"💳 <b>TRANSFER SUCCESS!</b>\n"
             f"From: {sender.first_name} ({sender.id})\n"
             f"To: {recipient.first_name}\n"
@@ -440,44 +869,47 @@ async def send_cmd(client: Client, message: Message):
             f"Your balance: {new_sender} ₹"
         )
     else:
-        await message.reply_text("❌ Transfer failed")
+        await send_reply(message, "❌ Transfer failed")
 
 
-@app.on_message(filters.command("kill"))
+@commands.register("kill")
 async def kill_cmd(client: Client, message: Message):
     """Kill someone - get 90-150 coins"""
     if not message.reply_to_message:
-        await message.reply_text("❌ Reply to a user to kill them!")
+        await send_reply(message, "❌ Reply to a user to kill them!")
         return
 
     actor = message.from_user
     target = message.reply_to_message.from_user
 
-    ensure_user(actor.id, actor.username)
-    ensure_user(target.id, target.username)
-
-    actor_row = get_user(actor.id)
-    target_row = get_user(target.id)
-
-    if actor_row["is_dead"] and not is_premium(actor.id):
-        await message.reply_text("💀 Dead players cannot kill!")
-        return
+    await ensure_user(actor.id, actor.username)
+    await ensure_user(target.id, target.username)
 
     if actor.id == target.id:
-        await message.reply_text("❌ Cannot kill yourself!")
+        await send_reply(message, "❌ Cannot kill yourself!")
         return
 
-    now = int(time.time())
-    if target_row["protect_until"] and now < target_row["protect_until"] and not is_premium(actor.id):
-        await message.reply_text("🛡️ Target is protected!")
-        return
+    async with user_locks.hold(actor.id, target.id):
+        actor_row = await get_user(actor.id)
+        target_row = await get_user(target.id)
+        now = int(time.time())
+
+        if actor_row["is_dead"] and not actor_row["is_premium"]:
+            refusal = "💀 Dead players cannot kill!"
+        elif target_row["protect_until"] and now < target_row["protect_until"] and not actor_row["is_premium"]:
+            refusal = "🛡️ Target is protected!"
+        else:
+            refusal = None
+            await set_dead(target.id, True)
+            reward = random.randint(90, 150)
+            killer_bal = await change_balance(actor.id, reward, reason="kill")
 
-    set_dead(target.id, True)
-    reward = random.randint(90, 150)
-    change_balance(actor.id, reward)
-    killer_bal = get_user(actor.id)["balance"]
+    if refusal:
+        await send_reply(message, refusal)
+        return
 
-    await message.reply_text(
+    await send_reply(
+        message,
         f"💀 <b>KILL SUCCESS!</b>\n"
         f"Killer: {actor.first_name}\n"
         f"Target: {target.first_name}\n"
@@ -486,24 +918,27 @@ async def kill_cmd(client: Client, message: Message):
     )
 
 
-@app.on_message(filters.command("protect"))
+@commands.register("protect")
 async def protect_cmd(client: Client, message: Message):
     """Buy 24h protection"""
     user = message.from_user
-    ensure_user(user.id, user.username)
-    row = get_user(user.id)
+    await ensure_user(user.id, user.username)
 
-    if not is_premium(user.id):
-        if row["balance"] < PROTECT_COST:
-            await message.reply_text(f"❌ Need {PROTECT_COST} ₹! You have {row['balance']} ₹")
-            return
-        change_balance(user.id, -PROTECT_COST)
+    async with user_locks.hold(user.id):
+        row = await get_user(user.id)
+        if not row["is_premium"] and await change_balance(user.id, -PROTECT_COST, reason="protect") is None:
+            new_bal = None
+        else:
+            until = int(time.time()) + 24 * 3600
+            await set_protect(user.id, until)
+            new_bal = (await get_user(user.id))["balance"]
 
-    until = int(time.time()) + 24 * 3600
-    set_protect(user.id, until)
-    new_bal = get_user(user.id)["balance"]
+    if new_bal is None:
+        await send_reply(message, f"❌ Need {PROTECT_COST} ₹! You have {row['balance']} ₹")
+        return
 
-    await message.reply_text(
+    await send_reply(
+        message,
         f"🛡️ <b>PROTECTED FOR 24H!</b>\n"
         f"✅ You are now protected\n"
         f"💳 Cost: -{PROTECT_COST} ₹\n"
@@ -511,135 +946,189 @@ async def protect_cmd(client: Client, message: Message):
     )
 
 
+HISTORY_PAGE_SIZE = 10
+HISTORY_LABELS = {
+    "daily": "💰 Daily",
+    "bet": "🎰 Bet",
+    "transfer_out": "💳 Sent",
+    "transfer_in": "💳 Received",
+    "kill": "💀 Kill",
+    "protect": "🛡️ Protect",
+    "adjust": "⚙️ Adjust",
+}
+
+
+@commands.register("history")
+async def history_cmd(client: Client, message: Message):
+    """Page through your coin transactions"""
+    user = message.from_user
+    try:
+        page = max(1, int(message.command[1]))
+    except (IndexError, ValueError):
+        page = 1
+
+    total = await history_count(user.id)
+    pages = max(1, (total + HISTORY_PAGE_SIZE - 1) // HISTORY_PAGE_SIZE)
+    entries = await history(user.id, HISTORY_PAGE_SIZE, (page - 1) * HISTORY_PAGE_SIZE)
+    if not entries:
+        await send_reply(message, "📜 No transactions yet! Use /daily to start.")
+        return
+
+    text = f"📜 <b>TRANSACTION HISTORY</b> ({page}/{pages})\n" + "─" * 30 + "\n\n"
+    for e in entries:
+        when = datetime.fromtimestamp(e["ts"]).strftime("%m-%d %H:%M")
+        label = HISTORY_LABELS.get(e["kind"], e["kind"])
+        bal = f" → {e['balance']} ₹" if e.get("balance") is not None else ""
+        text += f"<code>{when}</code> {label} {e['delta']:+d} ₹{bal}\n"
+    if page < pages:
+        text += f"\nMore: /history {page + 1}"
+
+    await send_reply(message, text)
+
+
 # ═══════════════════════════════════════════════════════════════════════════════
 # GAME COMMANDS (New Games)
 # ═══════════════════════════════════════════════════════════════════════════════
 
 
-@app.on_message(filters.command("slots"))
+def _payout(result: dict):
+    """Payout function for settle_bet: credit the winnings, nothing on a loss"""
+    return lambda bet: result["amount"] if result["won"] else 0
+
+
+@commands.register("slots")
 async def slots_cmd(client: Client, message: Message):
     """Play slots game"""
     user = message.from_user
-    ensure_user(user.id, user.username)
+    await ensure_user(user.id, user.username)
 
     try:
         bet = int(message.command[1])
     except (IndexError, ValueError):
-        await message.reply_text("/slots <bet>\nExample: /slots 50")
+        await send_reply(message, "/slots <bet>\nExample: /slots 50")
         return
 
-    row = get_user(user.id)
-    if row["balance"] < bet:
-        await message.reply_text(f"❌ Insufficient balance! You have {row['balance']} ₹")
+    if bet <= 0:
+        await send_reply(message, "❌ Bet must be positive!")
         return
 
-    change_balance(user.id, -bet)
     result = await SlotsGame.play(bet)
+    async with user_locks.hold(user.id):
+        settled = await settle_bet(user.id, bet, _payout(result))
+    if not settled["ok"]:
+        await send_reply(message, f"❌ Insufficient balance! You have {settled['balance']} ₹")
+        return
 
+    new_bal = settled["balance"]
     if result["won"]:
-        change_balance(user.id, result["amount"])
-        new_bal = get_user(user.id)["balance"]
-        await message.reply_text(
+        await send_reply(
+            message,
             f"🎰 {result['text']} 🎰\n\n"
             f"🎉 <b>WON {result['multiplier']}!</b>\n"
             f"💰 +{result['amount']} ₹\n"
-            f"Balance: {new_bal} ₹"
+            f"Balance: {new_bal} ₹",
+            lane=LANE_GAME,
         )
     else:
-        new_bal = get_user(user.id)["balance"]
-        await message.reply_text(
+        await send_reply(
+            message,
             f"🎰 {result['text']} 🎰\n\n"
             f"😢 <b>LOST!</b>\n"
             f"❌ -{bet} ₹\n"
-            f"Balance: {new_bal} ₹"
+            f"Balance: {new_bal} ₹",
+            lane=LANE_GAME,
         )
 
 
-@app.on_message(filters.command("blackjack"))
+@commands.register("blackjack")
 async def blackjack_cmd(client: Client, message: Message):
     """Play blackjack"""
     user = message.from_user
-    ensure_user(user.id, user.username)
+    await ensure_user(user.id, user.username)
 
     try:
         bet = int(message.command[1])
     except (IndexError, ValueError):
-        await message.reply_text("/blackjack <bet>\nExample: /blackjack 100")
+        await send_reply(message, "/blackjack <bet>\nExample: /blackjack 100")
         return
 
-    row = get_user(user.id)
-    if row["balance"] < bet:
-        await message.reply_text(f"❌ Insufficient! You have {row['balance']} ₹")
+    if bet <= 0:
+        await send_reply(message, "❌ Bet must be positive!")
         return
 
-    change_balance(user.id, -bet)
     result = await BlackjackGame.play(bet)
+    async with user_locks.hold(user.id):
+        settled = await settle_bet(user.id, bet, _payout(result))
+    if not settled["ok"]:
+        await send_reply(message, f"❌ Insufficient! You have {settled['balance']} ₹")
+        return
 
+    new_bal = settled["balance"]
     if result["won"]:
-        change_balance(user.id, result["amount"])
-        new_bal = get_user(user.id)["balance"]
         text = f"♠️ <b>BLACKJACK WIN!</b>\n{result['reason']}\n💰 +{result['amount']} ₹\nBalance: {new_bal} ₹"
     else:
-        new_bal = get_user(user.id)["balance"]
         text = f"♠️ <b>BLACKJACK LOSS</b>\n{result['reason']}\n❌ -{bet} ₹\nBalance: {new_bal} ₹"
 
-    await message.reply_text(text)
+    await send_reply(message, text, lane=LANE_GAME)
 
 
-@app.on_message(filters.command("dice"))
+@commands.register("dice")
 async def dice_cmd(client: Client, message: Message):
     """Play dice game"""
     user = message.from_user
-    ensure_user(user.id, user.username)
+    await ensure_user(user.id, user.username)
 
     try:
         bet = int(message.command[1])
     except (IndexError, ValueError):
-        await message.reply_text("/dice <bet>\nExample: /dice 50")
+        await send_reply(message, "/dice <bet>\nExample: /dice 50")
         return
 
-    row = get_user(user.id)
-    if row["balance"] < bet:
-        await message.reply_text(f"❌ Insufficient! You have {row['balance']} ₹")
+    if bet <= 0:
+        await send_reply(message, "❌ Bet must be positive!")
         return
 
-    change_balance(user.id, -bet)
     result = await DiceGame.play(bet)
+    async with user_locks.hold(user.id):
+        settled = await settle_bet(user.id, bet, _payout(result))
+    if not settled["ok"]:
+        await send_reply(message, f"❌ Insufficient! You have {settled['balance']} ₹")
+        return
 
+    new_bal = settled["balance"]
     if result["won"]:
-        change_balance(user.id, result["amount"])
-        new_bal = get_user(user.id)["balance"]
         text = f"🎲 {result['text']}\n🎉 WON! {result['reason']}\n💰 +{result['amount']} ₹\nBalance: {new_bal} ₹"
     else:
-        new_bal = get_user(user.id)["balance"]
         text = f"🎲 {result['text']}\n😢 LOST! {result['reason']}\n❌ -{bet} ₹\nBalance: {new_bal} ₹"
 
-    await message.reply_text(text)
+    await send_reply(message, text, lane=LANE_GAME)
 
 
-@app.on_message(filters.command("lucky"))
+@commands.register("lucky")
 async def lucky_cmd(client: Client, message: Message):
     """Lucky draw game"""
     user = message.from_user
-    ensure_user(user.id, user.username)
+    await ensure_user(user.id, user.username)
 
     try:
         bet = int(message.command[1])
     except (IndexError, ValueError):
-        await message.reply_text("/lucky <bet>\nExample: /lucky 50")
+        await send_reply(message, "/lucky <bet>\nExample: /lucky 50")
         return
 
-    row = get_user(user.id)
-    if row["balance"] < bet:
-        await message.reply_text(f"❌ Insufficient! You have {row['balance']} ₹")
+    if bet <= 0:
+        await send_reply(message, "❌ Bet must be positive!")
         return
 
-    change_balance(user.id, -bet)
     result = await LuckyDrawGame.play(bet)
+    async with user_locks.hold(user.id):
+        settled = await settle_bet(user.id, bet, _payout(result))
+    if not settled["ok"]:
+        await send_reply(message, f"❌ Insufficient! You have {settled['balance']} ₹")
+        return
 
+    new_bal = settled["balance"]
     if result["won"]:
-        change_balance(user.id, result["amount"])
-        new_bal = get_user(user.id)["balance"]
         text = (
             f"🎁 <b>LUCKY DRAW!</b>\n"
             f"You picked: {result['picked']}\n"
@@ -649,7 +1138,6 @@ async def lucky_cmd(client: Client, message: Message):
             f"Balance: {new_bal} ₹"
         )
     else:
-        new_bal = get_user(user.id)["balance"]
         text = (
             f"🎁 <b>LUCKY DRAW</b>\n"
             f"You picked: {result['picked']}\n"
@@ -659,32 +1147,34 @@ async def lucky_cmd(client: Client, message: Message):
             f"Balance: {new_bal} ₹"
         )
 
-    await message.reply_text(text)
+    await send_reply(message, text, lane=LANE_GAME)
 
 
-@app.on_message(filters.command("roulette"))
+@commands.register("roulette")
 async def roulette_cmd(client: Client, message: Message):
     """Roulette game"""
     user = message.from_user
-    ensure_user(user.id, user.username)
+    await ensure_user(user.id, user.username)
 
     try:
         bet = int(message.command[1])
     except (IndexError, ValueError):
-        await message.reply_text("/roulette <bet>\nExample: /roulette 100")
+        await send_reply(message, "/roulette <bet>\nExample: /roulette 100")
         return
 
-    row = get_user(user.id)
-    if row["balance"] < bet:
-        await message.reply_text(f"❌ Insufficient! You have {row['balance']} ₹")
+    if bet <= 0:
+        await send_reply(message, "❌ Bet must be positive!")
         return
 
-    change_balance(user.id, -bet)
     result = await RouletteGame.play(bet)
+    async with user_locks.hold(user.id):
+        settled = await settle_bet(user.id, bet, _payout(result))
+    if not settled["ok"]:
+        await send_reply(message, f"❌ Insufficient! You have {settled['balance']} ₹")
+        return
 
+    new_bal = settled["balance"]
     if result["won"]:
-        change_balance(user.id, result["amount"])
-        new_bal = get_user(user.id)["balance"]
         text = (
             f"🎡 <b>ROULETTE WIN!</b>\n"
             f"You: {result['picked']} → Wheel: {result['winning']}\n"
@@ -692,7 +1182,6 @@ async def roulette_cmd(client: Client, message: Message):
             f"Balance: {new_bal} ₹"
         )
     else:
-        new_bal = get_user(user.id)["balance"]
         text = (
             f"🎡 <b>ROULETTE</b>\n"
             f"You: {result['picked']} → Wheel: {result['winning']}\n"
@@ -700,7 +1189,7 @@ async def roulette_cmd(client: Client, message: Message):
             f"Balance: {new_bal} ₹"
         )
 
-    await message.reply_text(text)
+    await send_reply(message, text, lane=LANE_GAME)
 
 
 # ═══════════════════════════════════════════════════════════════════════════════
@@ -708,65 +1197,177 @@ async def roulette_cmd(client: Client, message: Message):
 # ═══════════════════════════════════════════════════════════════════════════════
 
 
-@app.on_message((filters.text & ~filters.command & filters.private) | (filters.mentioned & filters.group))
-async def hinata_reply(client: Client, message: Message):
-    """Hinata AI persona - responds in private or when mentioned"""
-    try:
-        if message.chat.type == types.ChatType.PRIVATE:
-            pass  # Always reply in private
-        elif message.chat.type in (types.ChatType.GROUP, types.ChatType.SUPERGROUP):
-            if not (message.mentioned or (message.reply_to_message and message.reply_to_message.from_user and message.reply_to_message.from_user.is_bot)):
-                return
+def hinata_persona(reply: str, stutter: bool) -> str:
+    """Enforce persona"""
+    if "AI" in reply:
+        reply = reply.replace("AI", "shy bot")
+    if stutter:
+        reply = "a-ano... " + reply
+    return reply
+
+
+async def answer_mention(message: Message):
+    """Reply to one message as Hinata"""
+    chat_id = message.chat.id
+    name = getattr(message.from_user, "first_name", None)
+    speaker = f"User ({name or 'friend'})"
+    stutter = random.random() < 0.4
+    key = reply_cache.key(message.text)
+    if key is None:
+        history = chat_memory.context(chat_id, CHAT_MEMORY_TOKENS)
+    chat_memory.add(chat_id, speaker, message.text)
+
+    if key is None and HINATA_STREAM and GROQ_KEYS:
+        prompt = make_hinata_prompt(message.text, name, history)
+        live = ProgressiveReply(
+            message,
+            interval=HINATA_STREAM_EDIT_SECONDS,
+            send=lambda factory, retry: send_queue.send(chat_id, factory, LANE_CHAT, retry),
+            render=lambda text: hinata_persona(text.strip(), stutter),
+        )
+        async for chunk in stream_groq(prompt):
+            await live.push(chunk)
+        suffix = ""
+        if "Naruto-kun" not in live.text and random.random() < 0.5:
+            suffix = "\n\n— Naruto-kun?"
+        await live.finish(suffix)
+        chat_memory.add(chat_id, "Hinata", live.text)
 
-        await app.send_chat_action(message.chat.id, types.ChatAction.TYPING)
+        if random.random() < 0.35:
+            try:
+                await reply_sticker(message, random.choice(HINATA_STICKERS))
+            except:
+                pass
+        return
 
-        prompt = make_hinata_prompt(message.text, getattr(message.from_user, "first_name", None))
+    if key is None:
+        prompt = make_hinata_prompt(message.text, name, history)
         reply = await call_groq(prompt)
+    else:
+        # Shared across users, so the cached prompt leaves out the name
+        # and the chat's history; short messages rarely need either
+        reply = await reply_cache.get_or_fetch(
+            key,
+            lambda: call_groq(make_hinata_prompt(message.text)),
+            cache_if=lambda r: r != HINATA_FALLBACK,
+        )
+
+    chat_memory.add(chat_id, "Hinata", reply)
+    reply = hinata_persona(reply, stutter)
 
-        # Enforce persona
-        if "AI" in reply:
-            reply = reply.replace("AI", "shy bot")
+    if "Naruto-kun" not in reply and random.random() < 0.5:
+        reply = reply + "\n\n— Naruto-kun?"
 
-        if random.random() < 0.4:
-            reply = "a-ano... " + reply
+    if random.random() < 0.35:
+        try:
+            await reply_sticker(message, random.choice(HINATA_STICKERS))
+        except:
+            pass
 
-        if "Naruto-kun" not in reply and random.random() < 0.5:
-            reply = reply + "\n\n— Naruto-kun?"
+    await send_reply(message, reply, lane=LANE_CHAT)
 
-        if random.random() < 0.35:
-            try:
-                await message.reply_sticker(random.choice(HINATA_STICKERS))
-            except:
-                pass
 
-        await message.reply_text(reply)
+_BATCH_LINE = re.compile(r"^\s*(\d+)\s*[:.)\-]\s*(.+)$")
+
+
+async def answer_mentions(chat_id: int, messages: list):
+    """Answer a burst of mentions in one chat with a single upstream call"""
+    if len(messages) == 1:
+        await answer_mention(messages[0])
+        return
+
+    speakers = [f"User ({getattr(m.from_user, 'first_name', None) or 'friend'})" for m in messages]
+    prompt = make_hinata_batch_prompt(
+        [(speaker, m.text) for speaker, m in zip(speakers, messages)],
+        chat_memory.context(chat_id, CHAT_MEMORY_TOKENS),
+    )
+    raw = await call_groq(prompt)
+
+    replies = {}
+    for line in raw.splitlines():
+        match = _BATCH_LINE.match(line)
+        if match and 1 <= int(match.group(1)) <= len(messages):
+            replies[int(match.group(1)) - 1] = match.group(2).strip()
+    if not replies and raw.strip():
+        # Model ignored the numbering: its answer goes to the last message
+        replies = {len(messages) - 1: raw.strip()}
+    for i in sorted(replies):
+        chat_memory.add(chat_id, speakers[i], messages[i].text)
+    if replies:
+        chat_memory.add(chat_id, "Hinata", " ".join(replies[i] for i in sorted(replies)))
+    # Messages the batch answer skipped are answered one by one afterwards
+    missed = [m for i, m in enumerate(messages) if i not in replies]
+
+    stutter = random.random() < 0.4
+    if HINATA_BATCH_MODE == "combined":
+        lines = []
+        for i in sorted(replies):
+            user = messages[i].from_user
+            who = user.mention if user else "friend"
+            lines.append(f"{who}: {hinata_persona(replies[i], False)}")
+        if lines:
+            text = "\n\n".join(lines)
+            await send_reply(messages[-1], ("a-ano... " if stutter else "") + text, lane=LANE_CHAT)
+    else:
+        for i in sorted(replies):
+            await send_reply(messages[i], hinata_persona(replies[i], stutter and i == min(replies)), lane=LANE_CHAT)
+
+    for result in await asyncio.gather(*map(answer_mention, missed), return_exceptions=True):
+        if isinstance(result, Exception):
+            logger.error(f"Hinata reply to a skipped batch message failed: {result}")
+
+
+mention_batcher = MentionBatcher(
+    answer_mentions,
+    window=HINATA_BATCH_WINDOW_MS / 1000,
+    max_batch=HINATA_BATCH_MAX,
+) if HINATA_BATCH_WINDOW_MS > 0 else None
+
+
+@app.on_message(~is_command & ((filters.text & filters.private) | (filters.mentioned & filters.group)))
+async def hinata_reply(client: Client, message: Message):
+    """Hinata AI persona - responds in private or when mentioned"""
+    try:
+        if message.chat.type == enums.ChatType.PRIVATE:
+            pass  # Always reply in private
+        elif message.chat.type in (enums.ChatType.GROUP, enums.ChatType.SUPERGROUP):
+            if not (message.mentioned or (message.reply_to_message and message.reply_to_message.from_user and message.reply_to_message.from_user.is_bot)):
+                return
+            if mention_batcher is not None:
+                # The first mention is answered at once; ones arriving right
+                # behind it are answered together
+                if mention_batcher.submit(message.chat.id, message):
+                    await app.send_chat_action(message.chat.id, enums.ChatAction.TYPING)
+                return
+
+        await app.send_chat_action(message.chat.id, enums.ChatAction.TYPING)
+        await answer_mention(message)
     except Exception as e:
         logger.error(f"Error in Hinata reply: {e}")
 
 
 # ═══════════════════════════════════════════════════════════════════════════════
-# PREFIX COMMANDS (. and !)
+# COMMAND DISPATCH (/, . and !)
 # ═══════════════════════════════════════════════════════════════════════════════
 
 
-@app.on_message(filters.regex(r"^[.!].+"))
-async def prefix_cmd(client: Client, message: Message):
-    """Handle . and ! prefix commands"""
+async def run_command(client: Client, message: Message):
+    """Route one prefixed command through the registry"""
     try:
-        text = message.text or ""
-        cmd = text[1:].split()[0].lower()
-
-        if cmd == "help":
-            kb = InlineKeyboardMarkup([[InlineKeyboardButton("Full Help", callback_data="help")]])
-            await message.reply_text("/help to see all commands", reply_markup=kb)
-        elif cmd == "dev":
-            await dev_cmd(client, message)
-        elif cmd == "ping":
-            await ping_cmd(client, message)
-        else:
-            await message.reply_text(f"❌ Unknown prefix command: {cmd}\nUse /help for list")
+        if await commands.dispatch(client, message):
+            return
+        # Unknown /commands may belong to other bots; . and ! are ours
+        if message.command_prefix != "/":
+            await send_reply(message, f"❌ Unknown command: {message.command[0]}\nUse /help for list")
     except Exception as e:
-        logger.error(f"Prefix error: {e}")
+        logger.error(f"Command error ({message.command[0]}): {e}")
+
+
+@app.on_message(is_command)
+async def dispatch_command(client: Client, message: Message):
+    """Queue the command behind the chat's earlier commands"""
+    if not chat_executor.submit(message.chat.id, lambda: run_command(client, message)):
+        logger.warning(f"Chat {message.chat.id} backlog full; dropped /{message.command[0]}")
 
 
 # ═══════════════════════════════════════════════════════════════════════════════
@@ -796,7 +1397,7 @@ async def callback(client: Client, query: types.CallbackQuery):
 💬 CHAT: Reply to me for Hinata AI
 .help or !help for prefix commands
 """
-            await query.edit_message_text(text)
+            await send_queue.send(query.message.chat.id, lambda: query.edit_message_text(text))
 
         elif data == "games":
             text = """🎮 <b>10 GAMES AVAILABLE</b>
@@ -814,7 +1415,7 @@ async def callback(client: Client, query: types.CallbackQuery):
 
 All games use coins from /daily
 """
-            await query.edit_message_text(text)
+            await send_queue.send(query.message.chat.id, lambda: query.edit_message_text(text))
 
         elif data == "economy":
             text = """💰 <b>ECONOMY SYSTEM</b>
@@ -830,7 +1431,7 @@ All games use coins from /daily
 
 👑 PREMIUM: No cooldowns, free costs
 """
-            await query.edit_message_text(text)
+            await send_queue.send(query.message.chat.id, lambda: query.edit_message_text(text))
 
         elif data == "premium":
             text = """👑 <b>PREMIUM FEATURES</b>
@@ -843,7 +1444,7 @@ All games use coins from /daily
 
 👤 Click on leaderboard user for details
 """
-            await query.edit_message_text(text)
+            await send_queue.send(query.message.chat.id, lambda: query.edit_message_text(text))
 
         await query.answer("✅ Updated!", show_alert=False)
     except Exception as e:
@@ -872,6 +1473,23 @@ async def metrics_endpoint(request):
     return web.json_response({
         "cpu_percent": psutil.cpu_percent(),
         "memory_percent": psutil.virtual_memory().percent,
+        "user_cache": cache_stats(),
+        "storage_txn": txn_stats(),
+        "write_behind": write_behind_stats(),
+        "user_locks": user_locks.stats(),
+        "ledger": ledger_stats(),
+        "ai_http": ai_http.stats(),
+        "g4f": g4f_stats,
+        "groq_keys": groq_keys.stats(),
+        "groq_hedge": groq_hedge.stats(),
+        "groq_stream_hedge": groq_stream_hedge.stats(),
+        "reply_cache": reply_cache.stats(),
+        "chat_memory": chat_memory.stats(),
+        "send_queue": send_queue.stats(),
+        "inbound_limit": inbound_limiter.stats(),
+        "commands": commands.stats(),
+        "chat_executor": chat_executor.stats(),
+        "mention_batches": mention_batcher.stats() if mention_batcher is not None else {"enabled": False},
     })
 
 
@@ -907,17 +1525,31 @@ async def main():
     await start_http_server()
 
     # Initialize database
-    init_db()
+    await init_db()
+
+    # Warm-connection HTTP pool for Groq
+    await ai_http.start()
+    await send_queue.start()
 
     # Set owner as premium
     if OWNER_ID:
-        ensure_user(OWNER_ID, None)
-        set_premium(OWNER_ID, True)
+        await ensure_user(OWNER_ID, None)
+        await set_premium(OWNER_ID, True)
 
     logger.info("✅ GAMEBOT v4.0 Ready!")
 
-    async with app:
-        await app.idle()
+    try:
+        async with app:
+            await app.idle()
+            # Let in-flight commands (bets, transfers) finish and reply while
+            # the client is still connected
+            await chat_executor.close()
+    finally:
+        await send_queue.close()
+        await ai_http.close()
+        _g4f_executor.shutdown(wait=False, cancel_futures=True)
+        # Drains pending storage calls and flushes write-behind balance deltas
+        await shutdown_storage()
 
 
 if __name__ == "__main__":
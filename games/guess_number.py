@@ -2,10 +2,12 @@ from telegram import Update
 from telegram.ext import ContextTypes
 import random
 
+from .session_store import game_sessions
+
 
 class GuessNumberGame:
     def __init__(self):
-        self.active = {}  # chat_id -> target
+        self.active = game_sessions("guess_number")  # chat_id -> target; expires when abandoned
 
     async def start_game(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         chat = update.effective_chat
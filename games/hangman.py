@@ -2,11 +2,13 @@ from telegram import Update
 from telegram.ext import ContextTypes
 import random
 
+from .session_store import game_sessions
+
 
 class HangmanGame:
     def __init__(self):
         self.words = ["python", "telegram", "hangman", "bot", "games"]
-        self.active = {}  # chat_id -> state
+        self.active = game_sessions("hangman")  # chat_id -> state; expires when abandoned
 
     async def start_game(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         chat = update.effective_chat
@@ -49,6 +51,7 @@ class HangmanGame:
                 await update.message.reply_text(f"🎉 Word solved: {state['word']}")
                 self.active.pop(cid, None)
                 return
+            self.active.mark_dirty(cid)  # guess fully applied to the state
             await update.message.reply_text(
                 f"Good! {' '.join(state['masked'])}\nAttempts left: {state['attempts']}"
             )
@@ -58,6 +61,7 @@ class HangmanGame:
                 await update.message.reply_text(f"Game over. The word was: {state['word']}")
                 self.active.pop(cid, None)
                 return
+            self.active.mark_dirty(cid)  # guess fully applied to the state
             await update.message.reply_text(
                 f"Wrong. {' '.join(state['masked'])}\nAttempts left: {state['attempts']}"
             )
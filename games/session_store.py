@@ -0,0 +1,202 @@
+"""
+Bounded session store for stateful games (trivia, hangman, guess-number).
+
+Replaces the per-game `self.active` dicts, which kept every abandoned game
+forever. Sessions are keyed by chat_id and behave like a small dict:
+
+    store[chat_id] = state       start / replace a game
+    store.get(chat_id)           current state, or None once it has expired
+    chat_id in store, store.pop(chat_id, None), len(store)
+
+Each access pushes the session's expiry GAME_SESSION_TTL seconds into the
+future. Expiry is driven by a min-heap of deadlines, so purging costs
+O(log n) per expired session instead of a scan; stale heap entries left by
+refreshed sessions are skipped lazily and compacted when they pile up. Past
+GAME_SESSION_MAX sessions the least recently used game is evicted.
+
+With GAME_SESSION_DIR set, sessions are pickled to <dir>/<name>.pkl and
+loaded back on start, so games in progress survive a restart. A change saves
+at once if the last save is GAME_SESSION_SNAPSHOT_SECONDS old, otherwise a
+save is scheduled for when it will be; there is also a save at exit. Games
+that change a session's state in place call store.mark_dirty(chat_id). The
+snapshot is only ever read from the bot's own directory.
+"""
+from collections import OrderedDict
+import asyncio
+import atexit
+import heapq
+import logging
+import os
+import pickle
+import time
+
+logger = logging.getLogger(__name__)
+
+GAME_SESSION_TTL = float(os.getenv("GAME_SESSION_TTL", "1800"))
+GAME_SESSION_MAX = int(os.getenv("GAME_SESSION_MAX", "10000"))
+GAME_SESSION_DIR = os.getenv("GAME_SESSION_DIR", "")
+GAME_SESSION_SNAPSHOT_SECONDS = float(os.getenv("GAME_SESSION_SNAPSHOT_SECONDS", "30"))
+
+_MISSING = object()
+
+
+class Session:
+    __slots__ = ("key", "data", "expires_at")
+
+    def __init__(self, key, data, expires_at: float):
+        self.key = key
+        self.data = data
+        self.expires_at = expires_at
+
+
+class SessionStore:
+    def __init__(self, ttl: float = GAME_SESSION_TTL, max_sessions: int = GAME_SESSION_MAX,
+                 snapshot_path: str = None, snapshot_interval: float = GAME_SESSION_SNAPSHOT_SECONDS):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.snapshot_path = snapshot_path
+        self.snapshot_interval = snapshot_interval
+        self._sessions = OrderedDict()  # key -> Session, least recently used first
+        self._heap = []  # (expires_at, key)
+        self._last_snapshot = 0.0
+        self._save_timer = None
+        self.expired = 0
+        self.evicted = 0
+        if snapshot_path:
+            self._load()
+            atexit.register(self.save)
+
+    # ── dict-like access ─────────────────────────────────────────
+
+    def get(self, key, default=None):
+        self._purge()
+        session = self._sessions.get(key)
+        if session is None:
+            return default
+        self._touch(session)
+        return session.data
+
+    def __getitem__(self, key):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, data):
+        self._purge()
+        session = self._sessions.get(key)
+        if session is None:
+            session = self._sessions[key] = Session(key, data, 0.0)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+                self.evicted += 1
+        else:
+            session.data = data
+        self._touch(session)
+        self._changed()
+
+    def __contains__(self, key) -> bool:
+        self._purge()
+        return key in self._sessions
+
+    def pop(self, key, default=None):
+        session = self._sessions.pop(key, None)
+        if session is None:
+            return default
+        self._changed()
+        return session.data
+
+    def __len__(self) -> int:
+        self._purge()
+        return len(self._sessions)
+
+    def mark_dirty(self, key):
+        """Record that a session's state was changed in place, so the next
+        snapshot includes it"""
+        if key in self._sessions:
+            self._changed()
+
+    # ── expiry ───────────────────────────────────────────────────
+
+    def _touch(self, session: Session):
+        session.expires_at = time.monotonic() + self.ttl
+        self._sessions.move_to_end(session.key)
+        heapq.heappush(self._heap, (session.expires_at, session.key))
+        if len(self._heap) > 2 * len(self._sessions) + 64:
+            self._heap = [(s.expires_at, s.key) for s in self._sessions.values()]
+            heapq.heapify(self._heap)
+
+    def _purge(self):
+        now = time.monotonic()
+        heap = self._heap
+        while heap and heap[0][0] <= now:
+            expires_at, key = heapq.heappop(heap)
+            session = self._sessions.get(key)
+            if session is not None and session.expires_at == expires_at:
+                del self._sessions[key]
+                self.expired += 1
+
+    # ── snapshot ─────────────────────────────────────────────────
+
+    def _changed(self):
+        if not self.snapshot_path or self._save_timer is not None:
+            return  # a save is already on its way
+        wait = self._last_snapshot + self.snapshot_interval - time.monotonic()
+        if wait <= 0:
+            self.save()
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.save()  # no loop to defer on
+            return
+        self._save_timer = loop.call_later(wait, self.save)
+
+    def save(self):
+        """Write all live sessions to the snapshot file (atomically)"""
+        if not self.snapshot_path:
+            return
+        if self._save_timer is not None:
+            self._save_timer.cancel()
+            self._save_timer = None
+        now = time.monotonic()
+        live = {s.key: (s.data, s.expires_at - now) for s in self._sessions.values() if s.expires_at > now}
+        tmp = self.snapshot_path + ".tmp"
+        try:
+            os.makedirs(os.path.dirname(self.snapshot_path) or ".", exist_ok=True)
+            with open(tmp, "wb") as fh:
+                pickle.dump(live, fh, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, self.snapshot_path)
+            self._last_snapshot = now
+        except Exception as e:
+            logger.warning(f"Could not snapshot game sessions to {self.snapshot_path}: {e}")
+
+    def _load(self):
+        if not os.path.exists(self.snapshot_path):
+            return
+        try:
+            with open(self.snapshot_path, "rb") as fh:
+                live = pickle.load(fh)
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable game session snapshot {self.snapshot_path}: {e}")
+            return
+        now = time.monotonic()
+        for key, (data, remaining) in live.items():
+            if remaining > 0 and len(self._sessions) < self.max_sessions:
+                session = self._sessions[key] = Session(key, data, now + remaining)
+                heapq.heappush(self._heap, (session.expires_at, key))
+        logger.info(f"Restored {len(self._sessions)} game sessions from {self.snapshot_path}")
+
+    def stats(self) -> dict:
+        return {
+            "sessions": len(self),
+            "max_sessions": self.max_sessions,
+            "expired": self.expired,
+            "evicted": self.evicted,
+        }
+
+
+def game_sessions(name: str) -> SessionStore:
+    """SessionStore for one game, snapshotting under GAME_SESSION_DIR if set"""
+    path = os.path.join(GAME_SESSION_DIR, f"{name}.pkl") if GAME_SESSION_DIR else None
+    return SessionStore(snapshot_path=path)
@@ -1,6 +1,8 @@
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
 from telegram.ext import ContextTypes
 
+from .session_store import game_sessions
+
 
 class TriviaGame:
     def __init__(self):
@@ -22,8 +24,7 @@ class TriviaGame:
                 "answer": 1,
             },
         ]
-        # active per-chat: chat_id -> {idx, answered}
-        self.active = {}
+        self.active = game_sessions("trivia")  # chat_id -> {idx, msg_id}; expires when abandoned
 
     async def send_question(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         chat = update.effective_chat
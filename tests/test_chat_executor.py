@@ -0,0 +1,97 @@
+"""
+ChatExecutor runs each chat's jobs in submission order, caps how many chats
+run at once, and makes a busy chat yield its slot after `quantum` jobs.
+"""
+import asyncio
+
+from utils.chat_executor import ChatExecutor
+
+
+def _run(coro):
+    return asyncio.new_event_loop().run_until_complete(coro)
+
+
+async def _drain(executor):
+    while executor.stats()["active_chats"] or executor.stats()["queued"]:
+        await asyncio.sleep(0)
+
+
+def test_jobs_in_one_chat_run_in_order():
+    log = []
+
+    def job(n, delay):
+        async def run():
+            await asyncio.sleep(delay)
+            log.append(n)
+        return run
+
+    async def main():
+        executor = ChatExecutor()
+        for n, delay in enumerate((0.03, 0.0, 0.01, 0.0)):
+            executor.submit(1, job(n, delay))
+        await _drain(executor)
+        return executor
+
+    executor = _run(main())
+    assert log == [0, 1, 2, 3]
+    assert executor.processed == 4
+
+
+def test_max_active_caps_concurrent_chats():
+    active, peak = 0, 0
+
+    async def job():
+        nonlocal active, peak
+        active += 1
+        peak = max(peak, active)
+        await asyncio.sleep(0.01)
+        active -= 1
+
+    async def main():
+        executor = ChatExecutor(max_active=2)
+        for chat_id in range(5):
+            executor.submit(chat_id, job)
+        assert executor.stats()["active_chats"] == 2
+        assert executor.stats()["waiting_chats"] == 3
+        await _drain(executor)
+        return executor
+
+    executor = _run(main())
+    assert peak == 2
+    assert executor.processed == 5
+
+
+def test_busy_chat_yields_after_quantum():
+    log = []
+
+    def job(chat_id):
+        async def run():
+            log.append(chat_id)
+            await asyncio.sleep(0)
+        return run
+
+    async def main():
+        executor = ChatExecutor(max_active=1, quantum=2)
+        for _ in range(5):
+            executor.submit("busy", job("busy"))
+        executor.submit("other", job("other"))
+        await _drain(executor)
+
+    _run(main())
+    assert log == ["busy", "busy", "other", "busy", "busy", "busy"]
+
+
+def test_full_backlog_drops_and_failures_are_counted():
+    async def boom():
+        raise ValueError("boom")
+
+    async def main():
+        executor = ChatExecutor(max_backlog=2)
+        results = [executor.submit(1, boom) for _ in range(3)]
+        await _drain(executor)
+        return executor, results
+
+    executor, results = _run(main())
+    assert results == [True, True, False]
+    assert executor.dropped == 1
+    assert executor.failed == 2
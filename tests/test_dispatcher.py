@@ -0,0 +1,46 @@
+"""
+The command filter must work when Pyrogram calls it, i.e. as
+flt(client, update), both on its own and inverted (~is_command).
+"""
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("pyrogram")
+
+from utils.dispatcher import CommandRegistry  # noqa: E402
+
+
+def _run(coro):
+    return asyncio.new_event_loop().run_until_complete(coro)
+
+
+def _client(username="gamebot"):
+    return SimpleNamespace(me=SimpleNamespace(username=username))
+
+
+def _message(text):
+    return SimpleNamespace(text=text)
+
+
+def test_filter_matches_commands_for_every_prefix():
+    commands = CommandRegistry()
+    for text in ("/slots 50", ".slots 50", "!slots 50", "/slots@gamebot 50"):
+        message = _message(text)
+        assert _run(commands.filter(_client(), message)) is True
+        assert message.command == ["slots", "50"]
+        assert message.command_prefix == text[0]
+
+
+def test_filter_rejects_chatter_and_other_bots():
+    commands = CommandRegistry()
+    for text in ("hello", "/", ". slots", "/slots@otherbot", None):
+        assert _run(commands.filter(_client(), _message(text))) is False
+
+
+def test_inverted_filter():
+    commands = CommandRegistry()
+    is_not_command = ~commands.filter
+    assert _run(is_not_command(_client(), _message("hi Hinata"))) is True
+    assert _run(is_not_command(_client(), _message("/balance"))) is False
@@ -0,0 +1,72 @@
+"""
+Ledger reopen after segment rotation, after a crash mid-append (torn last
+line), and from a snapshot.
+"""
+import os
+
+from utils.ledger import Ledger
+
+
+def _open(path, **kw):
+    ledger = Ledger(str(path), **kw)
+    ledger.open()
+    return ledger
+
+
+def _fill(ledger, n, user_id=1):
+    for i in range(1, n + 1):
+        ledger.record("bet", user_id, 10, balance=10 * i)
+
+
+def test_reopen_after_rotation_keeps_counts_and_history(tmp_path):
+    ledger = _open(tmp_path, segment_bytes=1)  # one entry per segment
+    _fill(ledger, 5)
+    ledger.record("daily", 2, 500, balance=500)
+    ledger.close()
+    assert len([n for n in os.listdir(tmp_path) if n.startswith("segment-")]) >= 6
+
+    ledger = _open(tmp_path, segment_bytes=1)
+    assert ledger.count(1) == 5
+    assert ledger.count(2) == 1
+    assert [e["seq"] for e in ledger.history(1, limit=3)] == [5, 4, 3]
+    assert ledger.record("bet", 1, 10, balance=60)["seq"] == 7
+    assert ledger.balances_at() == {1: 60, 2: 500}
+
+
+def test_reopen_after_torn_write(tmp_path):
+    ledger = _open(tmp_path)
+    _fill(ledger, 3)
+    segment = ledger._segment_path
+    ledger.close()
+    with open(segment, "ab") as fh:
+        fh.write(b'{"seq":4,"ts":0,"kind":"bet","user')  # crash mid-append
+
+    ledger = _open(tmp_path)
+    assert ledger.stats()["seq"] == 3
+    ledger.record("bet", 1, 10, balance=40)
+    ledger.record("bet", 1, 10, balance=50)
+    ledger.close()
+
+    ledger = _open(tmp_path)
+    assert ledger.count(1) == 5
+    assert [e["seq"] for e in ledger.history(1, limit=10)] == [5, 4, 3, 2, 1]
+    assert ledger.balances_at()[1] == 50
+
+
+def test_snapshot_start_and_balances_at(tmp_path):
+    ledger = _open(tmp_path, snapshot_every=4)
+    _fill(ledger, 10)
+    ledger.close()
+    assert any(n.startswith("snapshot-") for n in os.listdir(tmp_path))
+
+    ledger = _open(tmp_path, snapshot_every=4)
+    assert ledger.count(1) == 10
+    assert ledger.balances_at(6) == {1: 60}
+    assert ledger.balances_at(2) == {1: 20}
+    assert [e["balance"] for e in ledger.history(1, limit=2, offset=1)] == [90, 80]
+
+
+def test_history_past_index_depth_scans(tmp_path):
+    ledger = _open(tmp_path, index_depth=3)
+    _fill(ledger, 8)
+    assert [e["seq"] for e in ledger.history(1, limit=3, offset=4)] == [4, 3, 2]
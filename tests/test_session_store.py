@@ -0,0 +1,103 @@
+"""
+SessionStore expiry, LRU eviction and the on-disk snapshot: a restarted
+store gets back the games that were live, and in-place changes reported
+through mark_dirty() reach the snapshot.
+"""
+import asyncio
+import importlib.util
+import os
+import time
+
+# Loaded by path: games/__init__ imports the python-telegram-bot games
+_spec = importlib.util.spec_from_file_location(
+    "session_store", os.path.join(os.path.dirname(__file__), "..", "games", "session_store.py"))
+session_store = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(session_store)
+SessionStore = session_store.SessionStore
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def _clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(session_store.time, "monotonic", clock)
+    return clock
+
+
+def test_sessions_expire_after_ttl(monkeypatch):
+    clock = _clock(monkeypatch)
+    store = SessionStore(ttl=60)
+    store[1] = "a"
+    store[2] = "b"
+    clock.now += 40
+    assert store.get(1) == "a"  # access refreshes the expiry
+    clock.now += 30
+    assert 2 not in store
+    assert store.get(1) == "a"
+    assert store.expired == 1
+    clock.now += 61
+    assert len(store) == 0
+
+
+def test_least_recently_used_session_is_evicted():
+    store = SessionStore(max_sessions=2)
+    store[1] = "a"
+    store[2] = "b"
+    store.get(1)
+    store[3] = "c"
+    assert 2 not in store
+    assert store.get(1) == "a" and store.get(3) == "c"
+    assert store.evicted == 1
+
+
+def test_snapshot_round_trip(tmp_path, monkeypatch):
+    clock = _clock(monkeypatch)
+    path = str(tmp_path / "hangman.pkl")
+    store = SessionStore(ttl=60, snapshot_path=path, snapshot_interval=0)
+    store[1] = {"word": "python", "attempts": 6}
+    store[2] = {"word": "pickle", "attempts": 6}
+    clock.now += 50
+    store.get(1)
+    store.save()
+
+    clock.now += 20  # session 2 has 40s left on disk, session 1 has 50s
+    restored = SessionStore(ttl=60, snapshot_path=path)
+    assert restored.get(1) == {"word": "python", "attempts": 6}
+    assert restored.get(2) == {"word": "pickle", "attempts": 6}
+
+    clock.now += 45
+    assert 1 in restored  # refreshed by the get() above
+    restored.save()
+    assert 1 in SessionStore(ttl=60, snapshot_path=path)
+
+
+def test_expired_sessions_are_not_restored(tmp_path, monkeypatch):
+    clock = _clock(monkeypatch)
+    path = str(tmp_path / "trivia.pkl")
+    store = SessionStore(ttl=60, snapshot_path=path, snapshot_interval=0)
+    store[1] = "a"
+    clock.now += 61
+    store.save()
+    assert len(SessionStore(ttl=60, snapshot_path=path)) == 0
+
+
+def test_deferred_save_includes_in_place_changes(tmp_path):
+    path = str(tmp_path / "hangman.pkl")
+
+    async def main():
+        store = SessionStore(snapshot_path=path, snapshot_interval=0.05)
+        store[1] = {"attempts": 6}  # saved at once: no earlier snapshot
+        state = store.get(1)
+        state["attempts"] = 5
+        store.mark_dirty(1)  # too soon after the last save: deferred
+        assert SessionStore(snapshot_path=path).get(1) == {"attempts": 6}
+        await asyncio.sleep(0.1)
+
+    asyncio.new_event_loop().run_until_complete(main())
+    assert SessionStore(snapshot_path=path).get(1) == {"attempts": 5}
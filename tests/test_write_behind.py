@@ -0,0 +1,131 @@
+"""
+WriteBehindBuffer journal recovery and flush failure handling, against an
+in-memory stand-in for the database (balances plus the seq watermark).
+"""
+import pytest
+
+from utils.write_behind import WriteBehindBuffer
+
+
+class FakeStore:
+    def __init__(self, balances=None):
+        self.balances = dict(balances or {})
+        self.seq = 0
+        self.fail = None  # None | "before" (nothing applied) | "after" (applied, then error)
+
+    def flush(self, deltas, seq):
+        if self.fail == "before":
+            self.fail = None
+            raise TimeoutError("request failed")
+        for uid, d in deltas.items():
+            self.balances[uid] = self.balances.get(uid, 0) + d
+        self.seq = seq
+        if self.fail == "after":
+            self.fail = None
+            raise TimeoutError("response lost")
+
+    def read_seq(self):
+        return self.seq
+
+
+class Abort(Exception):
+    pass
+
+
+def debit(amount):
+    def delta(balance):
+        if balance < amount:
+            raise Abort()
+        return -amount
+    return delta
+
+
+def credit(amount):
+    return lambda balance: amount
+
+
+@pytest.fixture
+def store():
+    return FakeStore({7: 100})
+
+
+def make_buffer(store, tmp_path):
+    wb = WriteBehindBuffer(store.flush, str(tmp_path / "wb.journal"), fsync=False, read_seq=store.read_seq)
+    wb.recover(store.seq)
+    return wb
+
+
+def test_apply_and_flush(store, tmp_path):
+    wb = make_buffer(store, tmp_path)
+    assert wb.apply(7, credit(50), lambda: store.balances[7]) == 150
+    assert wb.apply(7, debit(30), lambda: store.balances[7]) == 120
+    assert store.balances[7] == 100  # nothing written yet
+    assert wb.flush()
+    assert store.balances[7] == 120
+    assert wb.balance(7) is None  # shadow dropped once flushed
+
+
+def test_aborted_change_is_not_journalled(store, tmp_path):
+    wb = make_buffer(store, tmp_path)
+    with pytest.raises(Abort):
+        wb.apply(7, debit(500), lambda: store.balances[7])
+    assert (tmp_path / "wb.journal").read_text() == ""
+    wb.close()
+
+    fresh = WriteBehindBuffer(store.flush, str(tmp_path / "wb.journal"), fsync=False)
+    fresh.recover(store.seq)
+    assert store.balances[7] == 100
+
+
+def test_recover_replays_only_unflushed_entries(store, tmp_path):
+    wb = make_buffer(store, tmp_path)
+    wb.apply(7, credit(10), lambda: store.balances[7])
+    assert wb.flush()
+    wb.apply(7, credit(5), lambda: store.balances[7])
+    wb.apply(8, credit(3), lambda: store.balances.get(8, 0))
+    # crash: no flush, no close
+
+    fresh = WriteBehindBuffer(store.flush, str(tmp_path / "wb.journal"), fsync=False)
+    fresh.recover(store.seq)
+    assert store.balances == {7: 115, 8: 3}
+    assert store.seq == 3
+
+
+def test_recover_skips_torn_last_line(store, tmp_path):
+    journal = tmp_path / "wb.journal"
+    journal.write_text("1 7 5\n2 7 ")
+    wb = WriteBehindBuffer(store.flush, str(journal), fsync=False)
+    wb.recover(0)
+    assert store.balances[7] == 105
+
+
+def test_failed_flush_is_retried(store, tmp_path):
+    wb = make_buffer(store, tmp_path)
+    wb.apply(7, credit(50), lambda: store.balances[7])
+    store.fail = "before"
+    assert not wb.flush()
+    assert wb.balance(7) == 150  # still buffered
+    assert wb.flush()
+    assert store.balances[7] == 150
+
+
+def test_ambiguous_flush_is_not_applied_twice(store, tmp_path):
+    wb = make_buffer(store, tmp_path)
+    wb.apply(7, credit(50), lambda: store.balances[7])
+    store.fail = "after"
+    assert not wb.flush()
+    assert store.balances[7] == 150
+    assert wb.flush()  # watermark shows the batch landed
+    assert store.balances[7] == 150
+    assert wb.stats()["unconfirmed_seq"] is None
+
+
+def test_ambiguous_flush_then_crash_recovers_once(store, tmp_path):
+    wb = make_buffer(store, tmp_path)
+    wb.apply(7, credit(50), lambda: store.balances[7])
+    store.fail = "after"
+    assert not wb.flush()
+
+    fresh = WriteBehindBuffer(store.flush, str(tmp_path / "wb.journal"), fsync=False)
+    fresh.recover(store.seq)
+    assert store.balances[7] == 150
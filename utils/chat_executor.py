@@ -0,0 +1,105 @@
+"""
+Per-chat ordered, cross-chat parallel execution of command handlers.
+
+Each chat has a FIFO backlog that one runner task drains in order, so two
+updates from the same chat (a bet and a balance check, two hangman guesses)
+never interleave, while different chats run concurrently. At most
+CHAT_EXEC_MAX_ACTIVE chats run at once; further chats wait their turn in a
+ready queue. A runner gives up its slot after CHAT_EXEC_QUANTUM jobs when
+other chats are waiting, so one busy chat cannot starve the rest.
+
+A chat's backlog is capped at CHAT_EXEC_MAX_BACKLOG; updates beyond it are
+dropped (the inbound rate limiter normally stops a chat long before that).
+
+Runs on the event loop only.
+"""
+from collections import deque
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class ChatExecutor:
+    def __init__(self, max_active: int = 64, max_backlog: int = 50, quantum: int = 8):
+        self.max_active = max_active
+        self.max_backlog = max_backlog
+        self.quantum = quantum
+        self._backlogs = {}  # chat_id -> deque of job factories
+        self._ready = deque()  # chats with work, waiting for a slot
+        self._waiting = set()  # same chats, for O(1) membership
+        self._running = {}  # chat_id -> runner task
+        self.processed = 0
+        self.dropped = 0
+        self.failed = 0
+        self.max_depth = 0
+
+    def submit(self, chat_id: int, job) -> bool:
+        """Queue job() (a coroutine function) behind the chat's earlier jobs;
+        False if the chat's backlog is full and the job was dropped"""
+        backlog = self._backlogs.get(chat_id)
+        if backlog is None:
+            backlog = self._backlogs[chat_id] = deque()
+        if len(backlog) >= self.max_backlog:
+            self.dropped += 1
+            return False
+        backlog.append(job)
+        self.max_depth = max(self.max_depth, len(backlog))
+        if chat_id not in self._running and chat_id not in self._waiting:
+            self._ready.append(chat_id)
+            self._waiting.add(chat_id)
+        self._schedule()
+        return True
+
+    def _schedule(self):
+        while self._ready and len(self._running) < self.max_active:
+            chat_id = self._ready.popleft()
+            self._waiting.discard(chat_id)
+            task = asyncio.ensure_future(self._run(chat_id))
+            self._running[chat_id] = task
+
+    async def _run(self, chat_id: int):
+        backlog = self._backlogs[chat_id]
+        done = 0
+        try:
+            while backlog:
+                if done >= self.quantum and self._ready:
+                    self._ready.append(chat_id)  # yield the slot, rejoin the line
+                    self._waiting.add(chat_id)
+                    return
+                job = backlog.popleft()
+                try:
+                    await job()
+                    self.processed += 1
+                except Exception as e:
+                    self.failed += 1
+                    logger.error(f"Chat {chat_id} job failed: {e}")
+                done += 1
+        finally:
+            self._running.pop(chat_id, None)
+            if not backlog and chat_id not in self._waiting:
+                self._backlogs.pop(chat_id, None)
+            self._schedule()
+
+    async def close(self, timeout: float = 10.0):
+        """Let running jobs finish (up to `timeout`), then cancel the rest"""
+        self._ready.clear()
+        self._waiting.clear()
+        for backlog in self._backlogs.values():
+            backlog.clear()
+        tasks = list(self._running.values())
+        if tasks:
+            done, pending = await asyncio.wait(tasks, timeout=timeout)
+            for task in pending:
+                task.cancel()
+
+    def stats(self) -> dict:
+        return {
+            "active_chats": len(self._running),
+            "waiting_chats": len(self._ready),
+            "queued": sum(len(b) for b in self._backlogs.values()),
+            "max_depth": self.max_depth,
+            "processed": self.processed,
+            "dropped": self.dropped,
+            "failed": self.failed,
+        }
@@ -0,0 +1,97 @@
+"""
+Per-chat conversation memory for the Hinata persona.
+
+Each chat keeps a ring buffer of its last CHAT_MEMORY_TURNS turns (user
+messages and Hinata's replies), each truncated to CHAT_MEMORY_TURN_CHARS.
+context() walks a chat's buffer newest-first and stops at the token budget,
+so prompt assembly costs at most one buffer's worth of work however many
+chats are active.
+
+Chats are kept in LRU order. Idle chats (no turn for CHAT_MEMORY_IDLE_SECONDS)
+are dropped, and the least recently used chats are evicted whenever the chat
+count or the total stored characters exceed their caps.
+
+Runs on the event loop only.
+"""
+from collections import OrderedDict, deque
+import time
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 characters per token) - cheap and good enough for budgeting"""
+    return len(text) // 4 + 1
+
+
+class ConversationMemory:
+    def __init__(self, max_turns: int = 12, max_turn_chars: int = 500, max_chats: int = 5000,
+                 max_total_chars: int = 8 * 1024 * 1024, idle_seconds: float = 3600.0):
+        self.max_turns = max_turns
+        self.max_turn_chars = max_turn_chars
+        self.max_chats = max_chats
+        self.max_total_chars = max_total_chars
+        self.idle_seconds = idle_seconds
+        self._chats = OrderedDict()  # chat_id -> [last_used, deque of (speaker, text)]
+        self._chars = 0
+        self.evictions = 0
+
+    def add(self, chat_id: int, speaker: str, text: str):
+        text = (text or "").strip()[:self.max_turn_chars]
+        if not text:
+            return
+        now = time.monotonic()
+        entry = self._chats.get(chat_id)
+        if entry is None:
+            entry = self._chats[chat_id] = [now, deque(maxlen=self.max_turns)]
+        turns = entry[1]
+        if len(turns) == turns.maxlen:
+            self._chars -= len(turns[0][1])
+        turns.append((speaker, text))
+        self._chars += len(text)
+        entry[0] = now
+        self._chats.move_to_end(chat_id)
+        self._evict(now)
+
+    def context(self, chat_id: int, token_budget: int = 600) -> list:
+        """Most recent (speaker, text) turns fitting in token_budget, oldest first"""
+        entry = self._chats.get(chat_id)
+        if entry is None:
+            return []
+        if entry[0] + self.idle_seconds < time.monotonic():
+            self._drop(chat_id)
+            return []
+        picked, used = [], 0
+        for speaker, text in reversed(entry[1]):
+            used += estimate_tokens(text)
+            if used > token_budget:
+                break
+            picked.append((speaker, text))
+        picked.reverse()
+        return picked
+
+    def forget(self, chat_id: int):
+        self._drop(chat_id)
+
+    def _drop(self, chat_id: int):
+        entry = self._chats.pop(chat_id, None)
+        if entry is not None:
+            self._chars -= sum(len(text) for _, text in entry[1])
+
+    def _evict(self, now: float):
+        # Oldest-used first: idle chats, then anything over the caps. The chat
+        # just written is kept; it is bounded by max_turns * max_turn_chars
+        while len(self._chats) > 1:
+            chat_id, (last_used, _) = next(iter(self._chats.items()))
+            over = len(self._chats) > self.max_chats or self._chars > self.max_total_chars
+            if not over and last_used + self.idle_seconds >= now:
+                break
+            self._drop(chat_id)
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        return {
+            "chats": len(self._chats),
+            "max_chats": self.max_chats,
+            "chars": self._chars,
+            "max_chars": self.max_total_chars,
+            "evictions": self.evictions,
+        }
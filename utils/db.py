@@ -0,0 +1,264 @@
+"""
+Embedded SQLite backend (local fallback for utils.firebase_db).
+
+Used whenever Firebase is not installed or not configured, so a single-node
+deployment runs entirely off `axlbot.db` with no cloud database. Exposes the
+same function surface as utils.firebase_db.
+
+- One connection, opened lazily and reused for the life of the process.
+  Storage worker threads share it under a lock.
+- WAL journal with synchronous=NORMAL: readers never block the writer, and
+  commits need no fsync of the main database file.
+- All SQL lives in module-level constants, so sqlite3's statement cache
+  prepares each statement once and reuses it.
+- Multi-step operations (transfer, settle_bet) run in BEGIN IMMEDIATE
+  transactions; single-step ones are conditional UPDATEs.
+
+The functions are blocking; async callers go through utils.storage, which runs
+them on its worker pool.
+"""
+import os
+import sqlite3
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+DB_PATH = os.getenv("DB_PATH", "axlbot.db")
+
+_conn = None
+_lock = threading.RLock()
+
+_SCHEMA = (
+    """CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            username TEXT,
+            balance INTEGER DEFAULT 0,
+            is_dead INTEGER DEFAULT 0,
+            protect_until INTEGER DEFAULT 0,
+            last_daily INTEGER DEFAULT 0,
+            is_premium INTEGER DEFAULT 0
+        )""",
+    """CREATE TABLE IF NOT EXISTS groups (
+            group_id INTEGER PRIMARY KEY,
+            group_name TEXT,
+            registered_at INTEGER DEFAULT 0,
+            is_active INTEGER DEFAULT 1
+        )""",
+    "CREATE INDEX IF NOT EXISTS idx_users_balance ON users(balance DESC)",
+)
+
+_SQL_INSERT_USER = "INSERT OR IGNORE INTO users (user_id, username) VALUES (?, ?)"
+_SQL_SET_USERNAME = "UPDATE users SET username = ? WHERE user_id = ? AND username IS NOT ?"
+_SQL_GET_USER = "SELECT * FROM users WHERE user_id = ?"
+_SQL_GET_BALANCE = "SELECT balance FROM users WHERE user_id = ?"
+_SQL_ADD_BALANCE = "UPDATE users SET balance = balance + ? WHERE user_id = ?"
+_SQL_DEBIT = "UPDATE users SET balance = balance - ? WHERE user_id = ? AND balance >= ?"
+_SQL_CLAIM_DAILY = (
+    "UPDATE users SET last_daily = ?, balance = balance + ? "
+    "WHERE user_id = ? AND ? - last_daily >= ?"
+)
+_SQL_SET_PREMIUM = "UPDATE users SET is_premium = ? WHERE user_id = ?"
+_SQL_SET_DEAD = "UPDATE users SET is_dead = ? WHERE user_id = ?"
+_SQL_SET_PROTECT = "UPDATE users SET protect_until = ? WHERE user_id = ?"
+_SQL_SET_LAST_DAILY = "UPDATE users SET last_daily = ? WHERE user_id = ?"
+_SQL_TOP_USERS = (
+    "SELECT user_id, username, balance, is_dead, is_premium "
+    "FROM users ORDER BY balance DESC LIMIT ?"
+)
+_SQL_REGISTER_GROUP = (
+    "INSERT INTO groups (group_id, group_name, registered_at, is_active) VALUES (?, ?, ?, 1) "
+    "ON CONFLICT(group_id) DO UPDATE SET group_name = excluded.group_name, "
+    "registered_at = excluded.registered_at, is_active = 1"
+)
+_SQL_GROUP_ACTIVE = "SELECT is_active FROM groups WHERE group_id = ?"
+_SQL_UNREGISTER_GROUP = "UPDATE groups SET is_active = 0 WHERE group_id = ?"
+_SQL_ACTIVE_GROUPS = "SELECT group_id, group_name FROM groups WHERE is_active = 1"
+
+DAY = 24 * 3600
+
+
+def _connect() -> sqlite3.Connection:
+    global _conn
+    if _conn is None:
+        with _lock:
+            if _conn is None:
+                conn = sqlite3.connect(
+                    DB_PATH,
+                    check_same_thread=False,
+                    isolation_level=None,  # autocommit; transactions are explicit
+                    cached_statements=256,
+                )
+                conn.row_factory = sqlite3.Row
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("PRAGMA synchronous=NORMAL")
+                conn.execute("PRAGMA busy_timeout=5000")
+                _conn = conn
+    return _conn
+
+
+class _Transaction:
+    """BEGIN IMMEDIATE ... COMMIT/ROLLBACK under the connection lock"""
+
+    def __enter__(self):
+        _lock.acquire()
+        try:
+            self.conn = _connect()
+            self.conn.execute("BEGIN IMMEDIATE")
+        except BaseException:
+            # __exit__ never runs when __enter__ raises (e.g. "database is
+            # locked" past busy_timeout), so the lock must be dropped here
+            _lock.release()
+            raise
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+        finally:
+            _lock.release()
+        return False
+
+
+def init_db():
+    conn = _connect()
+    with _lock:
+        for stmt in _SCHEMA:
+            conn.execute(stmt)
+    logger.info(f"SQLite database ready at {DB_PATH} (WAL)")
+
+
+def close():
+    global _conn
+    with _lock:
+        if _conn is not None:
+            _conn.close()
+            _conn = None
+
+
+def ensure_user(user_id: int, username: str | None = None):
+    conn = _connect()
+    with _lock:
+        conn.execute(_SQL_INSERT_USER, (user_id, username or ""))
+        if username:
+            conn.execute(_SQL_SET_USERNAME, (username, user_id, username))
+
+
+def get_user(user_id: int):
+    conn = _connect()
+    with _lock:
+        return conn.execute(_SQL_GET_USER, (user_id,)).fetchone()
+
+
+def change_balance(user_id: int, delta: int):
+    with _Transaction() as conn:
+        conn.execute(_SQL_INSERT_USER, (user_id, ""))
+        if delta < 0:
+            if conn.execute(_SQL_DEBIT, (-delta, user_id, -delta)).rowcount == 0:
+                return None
+        else:
+            conn.execute(_SQL_ADD_BALANCE, (delta, user_id))
+        return conn.execute(_SQL_GET_BALANCE, (user_id,)).fetchone()[0]
+
+
+def transfer(sender_id: int, recipient_id: int, amount: int) -> dict:
+    """See utils.firebase_db.transfer"""
+    failed = {"ok": False, "sender_balance": None, "recipient_balance": None}
+    if amount <= 0:
+        return failed
+    with _Transaction() as conn:
+        conn.execute(_SQL_INSERT_USER, (sender_id, ""))
+        conn.execute(_SQL_INSERT_USER, (recipient_id, ""))
+        if conn.execute(_SQL_DEBIT, (amount, sender_id, amount)).rowcount == 0:
+            return failed
+        conn.execute(_SQL_ADD_BALANCE, (amount, recipient_id))
+        return {
+            "ok": True,
+            "sender_balance": conn.execute(_SQL_GET_BALANCE, (sender_id,)).fetchone()[0],
+            "recipient_balance": conn.execute(_SQL_GET_BALANCE, (recipient_id,)).fetchone()[0],
+        }
+
+
+def settle_bet(user_id: int, bet: int, payout_fn) -> dict:
+    """See utils.firebase_db.settle_bet"""
+    if bet <= 0:
+        return {"ok": False, "balance": 0, "payout": 0}
+    with _Transaction() as conn:
+        conn.execute(_SQL_INSERT_USER, (user_id, ""))
+        balance = conn.execute(_SQL_GET_BALANCE, (user_id,)).fetchone()[0]
+        if balance < bet:
+            return {"ok": False, "balance": balance, "payout": 0}
+        payout = int(payout_fn(bet))
+        conn.execute(_SQL_ADD_BALANCE, (payout - bet, user_id))
+        return {"ok": True, "balance": balance - bet + payout, "payout": payout}
+
+
+def claim_daily(user_id: int, amount: int, now_ts: int) -> bool:
+    with _Transaction() as conn:
+        conn.execute(_SQL_INSERT_USER, (user_id, ""))
+        return conn.execute(_SQL_CLAIM_DAILY, (now_ts, amount, user_id, now_ts, DAY)).rowcount == 1
+
+
+def _set_field(sql: str, user_id: int, value: int):
+    with _Transaction() as conn:
+        conn.execute(_SQL_INSERT_USER, (user_id, ""))
+        conn.execute(sql, (value, user_id))
+
+
+def set_premium(user_id: int, premium: bool):
+    _set_field(_SQL_SET_PREMIUM, user_id, 1 if premium else 0)
+
+
+def is_premium(user_id: int) -> bool:
+    row = get_user(user_id)
+    return bool(row and row["is_premium"])
+
+
+def set_dead(user_id: int, dead: bool):
+    _set_field(_SQL_SET_DEAD, user_id, 1 if dead else 0)
+
+
+def set_protect(user_id: int, until_ts: int):
+    _set_field(_SQL_SET_PROTECT, user_id, int(until_ts))
+
+
+def set_last_daily(user_id: int, ts: int):
+    _set_field(_SQL_SET_LAST_DAILY, user_id, int(ts))
+
+
+def top_users(limit: int = 15):
+    """Rows of (user_id, username, balance, is_dead, is_premium), richest first"""
+    conn = _connect()
+    with _lock:
+        return conn.execute(_SQL_TOP_USERS, (limit,)).fetchall()
+
+
+# ═══════════════════════════════════════════════════════════════
+# GROUP MANAGEMENT FUNCTIONS
+# ═══════════════════════════════════════════════════════════════
+
+def register_group(group_id: int, group_name: str = None):
+    conn = _connect()
+    with _lock:
+        conn.execute(_SQL_REGISTER_GROUP, (group_id, group_name or f"Group_{group_id}", int(time.time())))
+
+
+def is_group_registered(group_id: int) -> bool:
+    conn = _connect()
+    with _lock:
+        row = conn.execute(_SQL_GROUP_ACTIVE, (group_id,)).fetchone()
+    return row is not None and row[0] == 1
+
+
+def unregister_group(group_id: int):
+    conn = _connect()
+    with _lock:
+        conn.execute(_SQL_UNREGISTER_GROUP, (group_id,))
+
+
+def get_all_registered_groups():
+    conn = _connect()
+    with _lock:
+        rows = conn.execute(_SQL_ACTIVE_GROUPS).fetchall()
+    return [{"group_id": r[0], "group_name": r[1]} for r in rows]
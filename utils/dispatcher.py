@@ -0,0 +1,86 @@
+"""
+Single command dispatcher for /, . and ! prefixes.
+
+Handlers register by name instead of each adding its own Pyrogram filter:
+
+    @commands.register("slots")
+    async def slots_cmd(client, message): ...
+
+One Pyrogram handler (filtered by `commands.filter`) then serves them all.
+Per message the text is looked at once: the first character must be a
+prefix and the second a letter, otherwise it is rejected immediately as
+chatter. The first word is split off, an @botname suffix is stripped
+(commands addressed to another bot are ignored), and the handler is a dict
+lookup. message.command is filled in as Pyrogram's own command filter would
+([name, *args]), so handlers are unchanged.
+"""
+import logging
+
+from pyrogram import filters
+from pyrogram.enums import ChatType
+
+logger = logging.getLogger(__name__)
+
+PREFIXES = frozenset("/.!")
+
+
+class CommandRegistry:
+    def __init__(self):
+        self._handlers = {}  # name -> (handler, private_only)
+        self.dispatched = 0
+        self.unknown = 0
+        # Pyrogram stores the callback as the filter class's __call__ and
+        # calls it as (filter, client, update), so it must not be bound here
+        self.filter = filters.create(self._match, "CommandFilter")
+
+    def register(self, *names: str, private_only: bool = False):
+        """Decorator registering a handler under one or more command names"""
+        def decorator(handler):
+            for name in names:
+                self._handlers[name.lower()] = (handler, private_only)
+            return handler
+        return decorator
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._handlers
+
+    def names(self) -> list:
+        return sorted(self._handlers)
+
+    @staticmethod
+    def parse(text: str, bot_username: str = None):
+        """(prefix, name, args) of a command message, or None for chatter"""
+        if not text or len(text) < 2 or text[0] not in PREFIXES or not text[1].isalpha():
+            return None
+        head, *args = text[1:].split()
+        name, _, target = head.partition("@")
+        if target and (not bot_username or target.lower() != bot_username.lower()):
+            return None  # addressed to another bot
+        return text[0], name.lower(), args
+
+    @staticmethod
+    async def _match(flt, client, message) -> bool:
+        me = getattr(client, "me", None)
+        parsed = CommandRegistry.parse(message.text, getattr(me, "username", None))
+        if parsed is None:
+            return False
+        prefix, name, args = parsed
+        message.command = [name] + args
+        message.command_prefix = prefix
+        return True
+
+    async def dispatch(self, client, message):
+        name = message.command[0]
+        entry = self._handlers.get(name)
+        if entry is None:
+            self.unknown += 1
+            return False
+        handler, private_only = entry
+        if private_only and message.chat.type != ChatType.PRIVATE:
+            return True
+        self.dispatched += 1
+        await handler(client, message)
+        return True
+
+    def stats(self) -> dict:
+        return {"commands": len(self._handlers), "dispatched": self.dispatched, "unknown": self.unknown}
@@ -1,6 +1,15 @@
 import os
+import copy
+import time
+import uuid
 import logging
+import threading
 from . import db as local_db  # Always import local db for fallback
+from .leaderboard import LeaderboardIndex
+from .user_cache import UserCache
+from .known_users import KnownUsers
+from .write_behind import WriteBehindBuffer
+from .group_registry import GroupRegistry
 
 logger = logging.getLogger(__name__)
 
@@ -30,6 +39,19 @@ FIREBASE_CONFIG = {
 
 FIREBASE_DB_URL = os.getenv("FIREBASE_DB_URL", "")
 
+# Balance-ordered index served by top_users(); warmed in init_db()
+_leaderboard = LeaderboardIndex()
+
+# Write-through cache of users/{id}; every mutator below keeps it current
+_user_cache = UserCache(
+    max_size=int(os.getenv("USER_CACHE_SIZE", "10000")),
+    ttl=float(os.getenv("USER_CACHE_TTL", "300")),
+)
+
+# Users already stored, with their last written username; lets ensure_user()
+# return without I/O for repeat visitors
+_known_users = KnownUsers()
+
 
 if FIREBASE_AVAILABLE:
     # Initialize Firebase only if credentials are available
@@ -39,30 +61,119 @@ if FIREBASE_AVAILABLE:
             firebase_admin.initialize_app(cred, {"databaseURL": FIREBASE_DB_URL})
             logger.info("Firebase initialized successfully")
         except Exception as e:
-            logger.error(f"Failed to initialize Firebase: {e}")
+            FIREBASE_AVAILABLE = False
+            logger.error(f"Failed to initialize Firebase: {e}; falling back to local sqlite DB")
     else:
-        logger.warning("Firebase credentials not fully configured. Set all environment variables.")
+        FIREBASE_AVAILABLE = False
+        logger.warning("Firebase credentials not fully configured; falling back to local sqlite DB via utils.db")
+
+
+# Active groups, loaded in init_db() and resynced in the background
+_groups = GroupRegistry()
+GROUP_RESYNC_SECONDS = float(os.getenv("GROUP_RESYNC_SECONDS", "600"))
+
+# Optional write-behind batching of balance deltas (see utils/write_behind.py)
+WRITE_BEHIND = os.getenv("WRITE_BEHIND", "0") == "1"
+_WB_SEQ_PATH = "meta/write_behind_seq"
+
+
+def _flush_deltas(deltas: dict, seq: int):
+    """Apply buffered deltas and the journal watermark in one multi-path update"""
+    update = {f"users/{uid}/balance": {".sv": {"increment": d}} for uid, d in deltas.items()}
+    update[_WB_SEQ_PATH] = seq
+    firebase_db.reference().update(update)
+
+
+_wb = None
+if FIREBASE_AVAILABLE and WRITE_BEHIND:
+    _wb = WriteBehindBuffer(
+        _flush_deltas,
+        os.getenv("WRITE_BEHIND_JOURNAL", "write_behind.journal"),
+        interval=int(os.getenv("WRITE_BEHIND_INTERVAL_MS", "500")) / 1000,
+        max_ops=int(os.getenv("WRITE_BEHIND_MAX_OPS", "200")),
+        fsync=os.getenv("WRITE_BEHIND_FSYNC", "1") == "1",
+        on_flushed=lambda uid: _user_cache.invalidate(uid),
+        read_seq=lambda: firebase_db.reference(_WB_SEQ_PATH).get() or 0,
+    )
+
+
+def _new_user(user_id: int, username: str | None = None) -> dict:
+    return {
+        "user_id": user_id,
+        "username": username or "",
+        "balance": 0,
+        "is_dead": 0,
+        "protect_until": 0,
+        "last_daily": 0,
+        "is_premium": 0,
+    }
+
+
+def _load_user(user_id: int):
+    """Return the users/{id} record from the cache, fetching it on a miss"""
+    user_data = _user_cache.get(user_id)
+    if user_data is None:
+        user_data = firebase_db.reference(f"users/{user_id}").get()
+        _user_cache.put(user_id, user_data)
+    return user_data
+
+
+def _update_user(user_id: int, fields: dict):
+    """Write fields to users/{id} and through to the cache"""
+    firebase_db.reference(f"users/{user_id}").update(fields)
+    _user_cache.update(user_id, fields)
+
+
+def invalidate_user(user_id: int = None):
+    """Drop a user (or every user when None) from the record cache"""
+    _user_cache.invalidate(user_id)
+
+
+def cache_stats() -> dict:
+    return _user_cache.stats()
+
+
+def write_behind_stats() -> dict:
+    return _wb.stats() if _wb is not None else {"enabled": False}
+
+
+def _buffered_change(user_id: int, delta_fn):
+    """Write-behind path shared by change_balance and settle_bet.
+
+    delta_fn(balance) returns the delta to apply or raises _TxnAbort. The
+    balance check and the buffered add happen atomically inside the buffer.
+    """
+    def _stored_balance():
+        user_data = _load_user(user_id)
+        if user_data is None:
+            ensure_user(user_id)
+            user_data = _load_user(user_id) or {}
+        return user_data.get("balance", 0)
+
+    new_balance = _wb.apply(user_id, delta_fn, _stored_balance)
+    _leaderboard.update(user_id, balance=new_balance)
+    return new_balance
 
 
 def ensure_user(user_id: int, username: str | None = None):
     if FIREBASE_AVAILABLE:
+        if _known_users.is_current(user_id, username):
+            return
         try:
-            user_ref = firebase_db.reference(f"users/{user_id}")
-            user_data = user_ref.get()
+            user_data = _load_user(user_id)
 
             if user_data is None:
-                user_ref.set({
-                    "user_id": user_id,
-                    "username": username or "",
-                    "balance": 0,
-                    "is_dead": 0,
-                    "protect_until": 0,
-                    "last_daily": 0,
-                    "is_premium": 0,
-                })
+                user_data = _new_user(user_id, username)
+                firebase_db.reference(f"users/{user_id}").set(user_data)
+                _user_cache.put(user_id, user_data)
+                _leaderboard.update(user_id, username=username or "", balance=0)
             elif username and user_data.get("username") != username:
-                user_ref.update({"username": username})
+                _update_user(user_id, {"username": username})
+                _leaderboard.update(user_id, username=username)
+            _known_users.add(user_id, username or user_data.get("username"))
         except Exception as e:
+            _user_cache.invalidate(user_id)
+            _known_users.discard(user_id)
             logger.error(f"Error in ensure_user (firebase): {e}")
     else:
         local_db.ensure_user(user_id, username)
@@ -71,10 +182,14 @@ def ensure_user(user_id: int, username: str | None = None):
 def get_user(user_id: int):
     if FIREBASE_AVAILABLE:
         try:
-            user_ref = firebase_db.reference(f"users/{user_id}")
-            data = user_ref.get()
+            data = _load_user(user_id)
             if data:
-                return {**data, "user_id": user_id}
+                data = {**data, "user_id": user_id}
+                if _wb is not None:
+                    shadow = _wb.balance(user_id)
+                    if shadow is not None:
+                        data["balance"] = shadow
+                return data
             return None
         except Exception as e:
             logger.error(f"Error in get_user (firebase): {e}")
@@ -87,81 +202,329 @@ def get_user(user_id: int):
         return {k: row[k] for k in row.keys()}
 
 
-def change_balance(user_id: int, delta: int):
-    if FIREBASE_AVAILABLE:
-        try:
-            user_ref = firebase_db.reference(f"users/{user_id}")
-            user_data = user_ref.get()
+# ═══════════════════════════════════════════════════════════════
+# OPTIMISTIC TRANSACTIONS
+# ═══════════════════════════════════════════════════════════════
+
+# Attempts per read-modify-write before giving up under contention
+TXN_MAX_RETRIES = int(os.getenv("FIREBASE_TXN_RETRIES", "8"))
+
+_txn_lock = threading.Lock()
+_txn_stats = {"committed": 0, "conflicts": 0, "aborted": 0, "exhausted": 0}
+
+
+class _TxnAbort(Exception):
+    """Raised by a transaction update function to stop without writing"""
 
-            if user_data is None:
-                ensure_user(user_id)
-                user_data = user_ref.get()
 
-            current_balance = user_data.get("balance", 0)
+class _TxnContention(Exception):
+    """A transaction lost every compare-and-set attempt"""
 
-            if delta < 0 and current_balance < -delta:
+
+def _count(name: str, n: int = 1):
+    with _txn_lock:
+        _txn_stats[name] += n
+
+
+def txn_stats() -> dict:
+    with _txn_lock:
+        stats = dict(_txn_stats)
+    stats["unfinished_transfers"] = len(_unfinished_transfers)
+    return stats
+
+
+def _transact(user_id: int, update_fn) -> dict:
+    """Optimistic read-modify-write of users/{id}.
+
+    update_fn(record) gets a private copy of the current record (a fresh
+    _new_user() if missing) and returns the record to store, or raises
+    _TxnAbort. The write is conditional on the ETag the record was read with;
+    on a conflict the server returns the current value and ETag, so each
+    retry costs one round trip. Starts from the cached record and ETag when
+    available, in which case the uncontended path is a single write.
+    """
+    if _wb is not None and _wb.balance(user_id) is not None:
+        # Buffered deltas must land before an absolute balance write
+        if not _wb.flush():
+            raise RuntimeError("write-behind flush failed")
+    ref = firebase_db.reference(f"users/{user_id}")
+    entry = _user_cache.get_entry(user_id)
+    if entry is not None and entry[1] is not None:
+        user_data, etag = entry
+    else:
+        user_data, etag = ref.get(etag=True)
+
+    for _ in range(TXN_MAX_RETRIES):
+        try:
+            new_data = update_fn(copy.deepcopy(user_data) if user_data else _new_user(user_id))
+        except _TxnAbort:
+            _count("aborted")
+            _user_cache.put(user_id, user_data, etag)
+            raise
+        ok, user_data, etag = ref.set_if_unchanged(etag, new_data)
+        if ok:
+            _count("committed")
+            _user_cache.put(user_id, user_data, etag)
+            return user_data
+        _count("conflicts")
+
+    _count("exhausted")
+    _user_cache.invalidate(user_id)
+    raise _TxnContention(f"users/{user_id}: gave up after {TXN_MAX_RETRIES} attempts")
+
+
+def change_balance(user_id: int, delta: int):
+    if FIREBASE_AVAILABLE:
+        if _wb is not None:
+            def _delta(balance):
+                if delta < 0 and balance < -delta:
+                    raise _TxnAbort()
+                return delta
+
+            try:
+                return _buffered_change(user_id, _delta)
+            except _TxnAbort:
+                return None
+            except Exception as e:
+                logger.error(f"Error in change_balance (write-behind): {e}")
                 return None
 
-            new_balance = current_balance + delta
-            user_ref.update({"balance": new_balance})
+        def _apply(user_data):
+            if delta < 0 and user_data.get("balance", 0) < -delta:
+                raise _TxnAbort()
+            user_data["balance"] = user_data.get("balance", 0) + delta
+            return user_data
+
+        try:
+            new_balance = _transact(user_id, _apply)["balance"]
+            _leaderboard.update(user_id, balance=new_balance)
             return new_balance
+        except _TxnAbort:
+            return None
         except Exception as e:
+            _user_cache.invalidate(user_id)
             logger.error(f"Error in change_balance (firebase): {e}")
             return None
     else:
         return local_db.change_balance(user_id, delta)
 
 
-def transfer(sender_id: int, recipient_id: int, amount: int) -> bool:
-    if FIREBASE_AVAILABLE:
-        if amount <= 0:
-            return False
+def _complete_transfer(sender_id, recipient_id, tid: str, amount: int):
+    """Credit the recipient of a debited transfer, idempotently, then clean up.
+
+    The recipient's applied_in/{tid} marker makes the credit safe to replay
+    after a crash; the sender's pending_out/{tid} is removed only once the
+    credit is durable. Returns the recipient's balance after the credit, or
+    None if an earlier attempt had already applied it.
+    """
+    def _credit(user_data):
+        applied = user_data.setdefault("applied_in", {})
+        if tid in applied:
+            raise _TxnAbort()
+        user_data["balance"] = user_data.get("balance", 0) + amount
+        applied[tid] = 1
+        return user_data
+
+    balance = None
+    try:
+        user_data = _transact(recipient_id, _credit)
+        balance = user_data.get("balance", 0)
+        _leaderboard.update(recipient_id, balance=balance)
+    except _TxnAbort:
+        pass  # already credited by an earlier attempt
+
+    firebase_db.reference(f"users/{sender_id}/pending_out/{tid}").delete()
+    _user_cache.invalidate(sender_id)
+    firebase_db.reference(f"users/{recipient_id}/applied_in/{tid}").delete()
+    _user_cache.invalidate(recipient_id)
+    return balance
+
+
+def _recover_transfers(all_users: dict):
+    """Finish transfers whose sender was debited but never saw completion"""
+    for uid, user in (all_users or {}).items():
+        pending = user.get("pending_out") if isinstance(user, dict) else None
+        for tid, item in (pending or {}).items():
+            try:
+                _complete_transfer(int(uid), item["to"], tid, item["amount"])
+                logger.info(f"Recovered pending transfer {tid} from {uid} to {item['to']}")
+            except Exception as e:
+                logger.error(f"Error recovering transfer {tid} (firebase): {e}")
+                with _unfinished_lock:
+                    _unfinished_transfers[tid] = (int(uid), item["to"], item["amount"])
+
+
+# Transfers whose credit failed after the debit committed. They are retried
+# in place, then every TRANSFER_RETRY_SECONDS on a daemon thread, so the
+# recipient is credited without waiting for a restart.
+TRANSFER_RETRY_SECONDS = float(os.getenv("TRANSFER_RETRY_SECONDS", "30"))
+_unfinished_transfers = {}  # tid -> (sender_id, recipient_id, amount)
+_unfinished_lock = threading.Lock()
+_transfer_retry_stop = threading.Event()
+_transfer_retry_thread = None
+
+
+def _finish_transfer(sender_id: int, recipient_id: int, tid: str, amount: int, attempts: int = 3):
+    """Complete a debited transfer, handing it to the retry pass on failure;
+    the recipient's new balance, or None if the credit was deferred"""
+    for attempt in range(attempts):
         try:
-            sender_ref = firebase_db.reference(f"users/{sender_id}")
-            recipient_ref = firebase_db.reference(f"users/{recipient_id}")
+            return _complete_transfer(sender_id, recipient_id, tid, amount)
+        except Exception as e:
+            logger.warning(f"Transfer {tid} credit attempt {attempt + 1} failed (firebase): {e}")
+            time.sleep(0.2 * (attempt + 1))
+    with _unfinished_lock:
+        _unfinished_transfers[tid] = (sender_id, recipient_id, amount)
+    return None
 
-            ensure_user(sender_id)
-            ensure_user(recipient_id)
 
-            sender_data = sender_ref.get()
-            sender_balance = sender_data.get("balance", 0) if sender_data else 0
+def _retry_unfinished_transfers():
+    with _unfinished_lock:
+        items = list(_unfinished_transfers.items())
+    for tid, (sender_id, recipient_id, amount) in items:
+        try:
+            _complete_transfer(sender_id, recipient_id, tid, amount)
+        except Exception as e:
+            logger.error(f"Error retrying transfer {tid} (firebase): {e}")
+            continue
+        with _unfinished_lock:
+            _unfinished_transfers.pop(tid, None)
+        logger.info(f"Completed deferred transfer {tid} from {sender_id} to {recipient_id}")
 
-            if sender_balance < amount:
-                return False
 
-            sender_ref.update({"balance": sender_balance - amount})
+def _start_transfer_retry():
+    global _transfer_retry_thread
+    if _transfer_retry_thread is not None or TRANSFER_RETRY_SECONDS <= 0:
+        return
 
-            recipient_data = recipient_ref.get()
-            recipient_balance = recipient_data.get("balance", 0) if recipient_data else 0
-            recipient_ref.update({"balance": recipient_balance + amount})
+    def _run():
+        while not _transfer_retry_stop.wait(TRANSFER_RETRY_SECONDS):
+            if _unfinished_transfers:
+                _retry_unfinished_transfers()
 
-            return True
+    _transfer_retry_thread = threading.Thread(target=_run, name="transfer-retry", daemon=True)
+    _transfer_retry_thread.start()
+
+
+def transfer(sender_id: int, recipient_id: int, amount: int) -> dict:
+    """Move coins from sender to recipient.
+
+    Returns {"ok": bool, "sender_balance", "recipient_balance"} with the
+    balances the transfer wrote; recipient_balance is None when the credit
+    was deferred to the retry pass.
+    """
+    failed = {"ok": False, "sender_balance": None, "recipient_balance": None}
+    if FIREBASE_AVAILABLE:
+        if amount <= 0:
+            return failed
+        tid = uuid.uuid4().hex
+
+        def _debit(user_data):
+            if user_data.get("balance", 0) < amount:
+                raise _TxnAbort()
+            user_data["balance"] = user_data.get("balance", 0) - amount
+            user_data.setdefault("pending_out", {})[tid] = {"to": recipient_id, "amount": amount}
+            return user_data
+
+        try:
+            ensure_user(sender_id)
+            ensure_user(recipient_id)
+
+            user_data = _transact(sender_id, _debit)
+        except _TxnAbort:
+            return failed
         except Exception as e:
+            _user_cache.invalidate(sender_id)
+            _user_cache.invalidate(recipient_id)
             logger.error(f"Error in transfer (firebase): {e}")
-            return False
+            return failed
+
+        # The debit is committed and recorded in pending_out, so the transfer
+        # will happen: report success even if the credit has to be finished
+        # by the retry pass (or _recover_transfers() after a crash)
+        sender_balance = user_data.get("balance", 0)
+        _leaderboard.update(sender_id, balance=sender_balance)
+        return {
+            "ok": True,
+            "sender_balance": sender_balance,
+            "recipient_balance": _finish_transfer(sender_id, recipient_id, tid, amount),
+        }
     else:
         return local_db.transfer(sender_id, recipient_id, amount)
 
 
-def claim_daily(user_id: int, amount: int, now_ts: int) -> bool:
+def settle_bet(user_id: int, bet: int, payout_fn) -> dict:
+    """Debit a bet, credit its payout and return the new balance atomically.
+
+    payout_fn(bet) returns the amount to credit back (0 for a loss). It is
+    called at most once, even if the transaction is retried.
+
+    Returns {"ok": bool, "balance": int, "payout": int}; when ok is False the
+    user could not cover the bet and nothing was written.
+    """
+    if bet <= 0:
+        return {"ok": False, "balance": 0, "payout": 0}
     if FIREBASE_AVAILABLE:
-        try:
-            user_ref = firebase_db.reference(f"users/{user_id}")
-            user_data = user_ref.get()
+        outcome = {"balance": 0, "payout": None}
+
+        if _wb is not None:
+            def _delta(balance):
+                outcome["balance"] = balance
+                if balance < bet:
+                    raise _TxnAbort()
+                outcome["payout"] = int(payout_fn(bet))
+                return outcome["payout"] - bet
+
+            try:
+                new_balance = _buffered_change(user_id, _delta)
+                return {"ok": True, "balance": new_balance, "payout": outcome["payout"]}
+            except _TxnAbort:
+                pass
+            except Exception as e:
+                logger.error(f"Error in settle_bet (write-behind): {e}")
+            return {"ok": False, "balance": outcome["balance"], "payout": 0}
+
+        def _apply(user_data):
+            balance = user_data.get("balance", 0)
+            outcome["balance"] = balance
+            if balance < bet:
+                raise _TxnAbort()
+            if outcome["payout"] is None:
+                outcome["payout"] = int(payout_fn(bet))
+            user_data["balance"] = balance - bet + outcome["payout"]
+            return user_data
 
-            if user_data is None:
-                ensure_user(user_id)
-                user_data = user_ref.get()
+        try:
+            user_data = _transact(user_id, _apply)
+            _leaderboard.update(user_id, balance=user_data.get("balance", 0))
+            return {"ok": True, "balance": user_data.get("balance", 0), "payout": outcome["payout"]}
+        except _TxnAbort:
+            pass
+        except Exception as e:
+            _user_cache.invalidate(user_id)
+            logger.error(f"Error in settle_bet (firebase): {e}")
+        return {"ok": False, "balance": outcome["balance"], "payout": 0}
+    else:
+        return local_db.settle_bet(user_id, bet, payout_fn)
 
-            last_daily = user_data.get("last_daily", 0)
 
-            if now_ts - last_daily < 24 * 3600:
-                return False
+def claim_daily(user_id: int, amount: int, now_ts: int) -> bool:
+    if FIREBASE_AVAILABLE:
+        def _apply(user_data):
+            if now_ts - user_data.get("last_daily", 0) < 24 * 3600:
+                raise _TxnAbort()
+            user_data["last_daily"] = now_ts
+            user_data["balance"] = user_data.get("balance", 0) + amount
+            return user_data
 
-            current_balance = user_data.get("balance", 0)
-            user_ref.update({"last_daily": now_ts, "balance": current_balance + amount})
+        try:
+            user_data = _transact(user_id, _apply)
+            _leaderboard.update(user_id, balance=user_data.get("balance", 0))
             return True
+        except _TxnAbort:
+            return False
         except Exception as e:
+            _user_cache.invalidate(user_id)
             logger.error(f"Error in claim_daily (firebase): {e}")
             return False
     else:
@@ -171,9 +534,9 @@ def claim_daily(user_id: int, amount: int, now_ts: int) -> bool:
 def set_premium(user_id: int, premium: bool):
     if FIREBASE_AVAILABLE:
         try:
-            user_ref = firebase_db.reference(f"users/{user_id}")
             ensure_user(user_id)
-            user_ref.update({"is_premium": 1 if premium else 0})
+            _update_user(user_id, {"is_premium": 1 if premium else 0})
+            _leaderboard.update(user_id, is_premium=1 if premium else 0)
         except Exception as e:
             logger.error(f"Error in set_premium (firebase): {e}")
     else:
@@ -197,9 +560,9 @@ def is_premium(user_id: int) -> bool:
 def set_dead(user_id: int, dead: bool):
     if FIREBASE_AVAILABLE:
         try:
-            user_ref = firebase_db.reference(f"users/{user_id}")
             ensure_user(user_id)
-            user_ref.update({"is_dead": 1 if dead else 0})
+            _update_user(user_id, {"is_dead": 1 if dead else 0})
+            _leaderboard.update(user_id, is_dead=1 if dead else 0)
         except Exception as e:
             logger.error(f"Error in set_dead (firebase): {e}")
     else:
@@ -209,9 +572,8 @@ def set_dead(user_id: int, dead: bool):
 def set_protect(user_id: int, until_ts: int):
     if FIREBASE_AVAILABLE:
         try:
-            user_ref = firebase_db.reference(f"users/{user_id}")
             ensure_user(user_id)
-            user_ref.update({"protect_until": int(until_ts)})
+            _update_user(user_id, {"protect_until": int(until_ts)})
         except Exception as e:
             logger.error(f"Error in set_protect (firebase): {e}")
     else:
@@ -221,9 +583,8 @@ def set_protect(user_id: int, until_ts: int):
 def set_last_daily(user_id: int, ts: int):
     if FIREBASE_AVAILABLE:
         try:
-            user_ref = firebase_db.reference(f"users/{user_id}")
             ensure_user(user_id)
-            user_ref.update({"last_daily": int(ts)})
+            _update_user(user_id, {"last_daily": int(ts)})
         except Exception as e:
             logger.error(f"Error in set_last_daily (firebase): {e}")
     else:
@@ -233,26 +594,11 @@ def set_last_daily(user_id: int, ts: int):
 def top_users(limit: int = 15):
     if FIREBASE_AVAILABLE:
         try:
-            users_ref = firebase_db.reference("users")
-            all_users = users_ref.get()
-
-            if not all_users:
-                return []
-
-            user_list = [
-                {
-                    "user_id": uid,
-                    "username": user.get("username", ""),
-                    "balance": user.get("balance", 0),
-                    "is_dead": user.get("is_dead", 0),
-                    "is_premium": user.get("is_premium", 0),
-                }
-                for uid, user in all_users.items()
-            ]
-
-            user_list.sort(key=lambda x: x["balance"], reverse=True)
-
-            return user_list[:limit]
+            if not _leaderboard.warm:
+                # Cold index (init_db not run or its scan failed): one full
+                # scan, after which mutators keep the index current
+                _leaderboard.load(firebase_db.reference("users").get())
+            return _leaderboard.top(limit)
         except Exception as e:
             logger.error(f"Error in top_users (firebase): {e}")
             return []
@@ -263,11 +609,48 @@ def top_users(limit: int = 15):
 
 
 def init_db():
+    global _wb
     if FIREBASE_AVAILABLE:
+        if _wb is not None:
+            # Replay unflushed journal entries before anything reads balances
+            try:
+                _wb.recover(firebase_db.reference(_WB_SEQ_PATH).get() or 0)
+                _wb.start()
+                logger.info("Write-behind balance batching enabled")
+            except Exception as e:
+                # The journal is left untouched for the next start to replay;
+                # until then balances are written through transactions
+                _wb = None
+                logger.error(f"Error recovering write-behind journal, batching disabled (firebase): {e}")
+        try:
+            all_users = firebase_db.reference("users").get()
+            _leaderboard.load(all_users)
+            _known_users.load(all_users)
+            _recover_transfers(all_users)
+            logger.info(f"Leaderboard index and user registry warmed with {len(_known_users)} users")
+        except Exception as e:
+            logger.error(f"Error warming user indexes (firebase): {e}")
+        try:
+            _groups.load(firebase_db.reference("groups").get())
+            logger.info(f"Group registry loaded with {len(_groups.all())} active groups")
+        except Exception as e:
+            logger.error(f"Error loading group registry (firebase): {e}")
+        _groups.start_resync(lambda: firebase_db.reference("groups").get(), GROUP_RESYNC_SECONDS)
+        _start_transfer_retry()
         logger.info("Firebase database initialized")
     else:
         local_db.init_db()
 
+
+def close():
+    _groups.stop()
+    _transfer_retry_stop.set()
+    if _wb is not None:
+        _wb.close()
+    if not FIREBASE_AVAILABLE:
+        local_db.close()
+
+
 # ═══════════════════════════════════════════════════════════════
 # GROUP MANAGEMENT FUNCTIONS
 # ═══════════════════════════════════════════════════════════════
@@ -283,6 +666,7 @@ def register_group(group_id: int, group_name: str = None):
                 "registered_at": int(time.time()),
                 "is_active": 1,
             })
+            _groups.add(group_id, group_name or f"Group_{group_id}")
         except Exception as e:
             logger.error(f"Error registering group (firebase): {e}")
             local_db.register_group(group_id, group_name)
@@ -293,6 +677,8 @@ def register_group(group_id: int, group_name: str = None):
 def is_group_registered(group_id: int) -> bool:
     """Check if group is registered"""
     if FIREBASE_AVAILABLE:
+        if _groups.loaded:
+            return group_id in _groups
         try:
             group_ref = firebase_db.reference(f"groups/{group_id}")
             data = group_ref.get()
@@ -310,6 +696,7 @@ def unregister_group(group_id: int):
         try:
             group_ref = firebase_db.reference(f"groups/{group_id}")
             group_ref.update({"is_active": 0})
+            _groups.remove(group_id)
         except Exception as e:
             logger.error(f"Error unregistering group (firebase): {e}")
             local_db.unregister_group(group_id)
@@ -321,21 +708,11 @@ def get_all_registered_groups():
     """Get all active groups"""
     if FIREBASE_AVAILABLE:
         try:
-            groups_ref = firebase_db.reference("groups")
-            all_groups = groups_ref.get()
-            if not all_groups:
-                return []
-            return [
-                {"group_id": int(gid), "group_name": g.get("group_name", f"Group_{gid}")}
-                for gid, g in all_groups.items()
-                if g.get("is_active", 0) == 1
-            ]
+            if not _groups.loaded:
+                _groups.load(firebase_db.reference("groups").get())
+            return _groups.all()
         except Exception as e:
             logger.error(f"Error getting groups (firebase): {e}")
             return local_db.get_all_registered_groups()
     else:
         return local_db.get_all_registered_groups()
-
-
-# Import time for timestamps
-import time
\ No newline at end of file
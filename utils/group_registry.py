@@ -0,0 +1,83 @@
+"""
+In-memory registry of active groups for the Firebase backend.
+
+Loaded once by init_db(), kept current by register_group()/unregister_group()
+and re-synchronised from the database in the background every
+GROUP_RESYNC_SECONDS, which picks up edits made outside the bot. Group-gating
+checks become a dict lookup instead of a network call.
+"""
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class GroupRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._groups = {}  # group_id -> group_name, active groups only
+        self._changes = None  # group_id -> name (None if removed) while a resync fetches
+        self.loaded = False
+        self.resyncs = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def load(self, groups: dict):
+        """Replace the registry with a full `groups` snapshot. Adds and
+        removes made while a resync was fetching it are reapplied on top,
+        since the snapshot may predate them."""
+        active = {}
+        for gid, g in (groups or {}).items():
+            if isinstance(g, dict) and g.get("is_active", 0) == 1:
+                active[int(gid)] = g.get("group_name", f"Group_{gid}")
+        with self._lock:
+            for gid, name in (self._changes or {}).items():
+                if name is None:
+                    active.pop(gid, None)
+                else:
+                    active[gid] = name
+            self._changes = None
+            self._groups = active
+            self.loaded = True
+
+    def add(self, group_id: int, group_name: str):
+        with self._lock:
+            self._groups[group_id] = group_name
+            if self._changes is not None:
+                self._changes[group_id] = group_name
+
+    def remove(self, group_id: int):
+        with self._lock:
+            self._groups.pop(group_id, None)
+            if self._changes is not None:
+                self._changes[group_id] = None
+
+    def __contains__(self, group_id: int) -> bool:
+        return group_id in self._groups
+
+    def all(self) -> list:
+        with self._lock:
+            return [{"group_id": gid, "group_name": name} for gid, name in self._groups.items()]
+
+    def start_resync(self, loader, interval: float):
+        """Reload from loader() every `interval` seconds on a daemon thread"""
+        if self._thread is not None or interval <= 0:
+            return
+
+        def _run():
+            while not self._stop.wait(interval):
+                with self._lock:
+                    self._changes = {}  # record local edits made during the fetch
+                try:
+                    self.load(loader())
+                    self.resyncs += 1
+                except Exception as e:
+                    with self._lock:
+                        self._changes = None
+                    logger.error(f"Group registry resync failed: {e}")
+
+        self._thread = threading.Thread(target=_run, name="group-resync", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
@@ -0,0 +1,55 @@
+"""
+Hedge timing for Groq requests.
+
+Keeps a sliding window of recent successful Groq latencies. When a request
+has not answered within the GROQ_HEDGE_PERCENTILE of that window, call_groq
+fires a second request (another key, or g4f) and takes whichever answers
+first. stream_groq keeps a second policy fed with time to first token and
+races on that. Until GROQ_HEDGE_MIN_SAMPLES latencies are known the delay is
+GROQ_HEDGE_DELAY; it is always clamped to [min_delay, max_delay].
+
+Hedging at p95 adds at most ~5% extra requests while cutting the p99 tail
+down to roughly p95 + the backup's latency.
+"""
+from collections import deque
+
+
+class HedgePolicy:
+    def __init__(self, percentile: float = 95.0, default_delay: float = 2.0,
+                 min_delay: float = 0.3, max_delay: float = 10.0,
+                 window: int = 200, min_samples: int = 20):
+        self.percentile = percentile
+        self.default_delay = default_delay
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.min_samples = min_samples
+        self._samples = deque(maxlen=window)
+        self._delay = default_delay
+        self._dirty = False
+        self.hedged = 0        # requests that fired a backup
+        self.hedge_wins = 0    # ...where the backup answered first
+        self.primary_wins = 0  # ...where the original still won
+
+    def observe(self, seconds: float):
+        self._samples.append(seconds)
+        self._dirty = True
+
+    def delay(self) -> float:
+        """Seconds to wait on the primary before hedging"""
+        if self._dirty:
+            self._dirty = False
+            if len(self._samples) >= self.min_samples:
+                ordered = sorted(self._samples)
+                rank = min(len(ordered) - 1, int(len(ordered) * self.percentile / 100))
+                self._delay = min(self.max_delay, max(self.min_delay, ordered[rank]))
+        return self._delay
+
+    def stats(self) -> dict:
+        return {
+            "percentile": self.percentile,
+            "delay_ms": round(self.delay() * 1000, 1),
+            "samples": len(self._samples),
+            "hedged": self.hedged,
+            "hedge_wins": self.hedge_wins,
+            "primary_wins": self.primary_wins,
+        }
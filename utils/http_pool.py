@@ -0,0 +1,150 @@
+"""
+Shared pooled HTTP client for the AI engine.
+
+One httpx.AsyncClient is created by start() in main() and reused for every
+Groq request, so replies ride warm keep-alive connections instead of paying a
+TCP + TLS handshake per message. HTTP/2 is used when the `h2` package is
+installed (httpx[http2]); requests to the same host are then multiplexed
+over a single connection.
+
+Connection reuse is measured with httpcore's trace extension: a request that
+did not open a TCP connection was served from the pool.
+
+Usage:
+    ai_http = PooledHTTP(max_connections=20, connect_timeout=5, read_timeout=30)
+    await ai_http.start()
+    resp = await ai_http.post(url, json=payload, headers=headers)
+    async with ai_http.stream(url, json=payload, headers=headers) as resp:
+        async for event in iter_sse(resp):
+            ...
+    await ai_http.close()
+"""
+from contextlib import asynccontextmanager
+import json
+import time
+import logging
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+try:
+    import h2  # noqa: F401
+    H2_AVAILABLE = True
+except Exception:
+    H2_AVAILABLE = False
+
+
+class PooledHTTP:
+    def __init__(self, max_connections: int = 20, max_keepalive: int = 10,
+                 keepalive_expiry: float = 60.0, connect_timeout: float = 5.0,
+                 read_timeout: float = 30.0, http2: bool = True):
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.timeout = httpx.Timeout(
+            connect=connect_timeout,
+            read=read_timeout,
+            write=connect_timeout,
+            pool=connect_timeout,
+        )
+        self.http2 = http2 and H2_AVAILABLE
+        self.client = None
+
+        self.requests = 0
+        self.new_connections = 0
+        self.http2_requests = 0
+        self.errors = 0
+        self.handshake_total = 0.0
+
+    async def start(self):
+        if self.client is None:
+            self.client = httpx.AsyncClient(limits=self.limits, timeout=self.timeout, http2=self.http2)
+            logger.info(f"AI HTTP pool started (http2={self.http2}, max={self.limits.max_connections})")
+
+    async def close(self):
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+    def _traced(self, kwargs: dict):
+        """Attach a trace hook to the request; returns the state it fills in"""
+        state = {}
+
+        async def trace(event: str, info: dict):
+            if event == "connection.connect_tcp.started":
+                state["connect"] = time.perf_counter()
+            elif event in ("connection.start_tls.complete", "connection.connect_tcp.complete") and "connect" in state:
+                state["handshake"] = time.perf_counter() - state["connect"]
+            elif event.startswith("http2.send_request_headers"):
+                state["http2"] = True
+
+        kwargs["extensions"] = dict(kwargs.get("extensions") or {}, trace=trace)
+        self.requests += 1
+        return state
+
+    def _account(self, state: dict):
+        if "connect" in state:
+            self.new_connections += 1
+            self.handshake_total += state.get("handshake", 0.0)
+        if state.get("http2"):
+            self.http2_requests += 1
+
+    async def post(self, url: str, **kwargs) -> httpx.Response:
+        if self.client is None:
+            await self.start()
+        state = self._traced(kwargs)
+        try:
+            return await self.client.post(url, **kwargs)
+        except Exception:
+            self.errors += 1
+            raise
+        finally:
+            self._account(state)
+
+    @asynccontextmanager
+    async def stream(self, url: str, **kwargs):
+        """POST and yield the response before its body has been read"""
+        if self.client is None:
+            await self.start()
+        state = self._traced(kwargs)
+        try:
+            async with self.client.stream("POST", url, **kwargs) as resp:
+                self._account(state)
+                state.clear()
+                yield resp
+        except Exception:
+            self.errors += 1
+            raise
+        finally:
+            self._account(state)
+
+    def stats(self) -> dict:
+        reused = self.requests - self.new_connections
+        return {
+            "http2": self.http2,
+            "requests": self.requests,
+            "new_connections": self.new_connections,
+            "reused": reused,
+            "reuse_ratio": round(reused / self.requests, 3) if self.requests else 0.0,
+            "http2_requests": self.http2_requests,
+            "errors": self.errors,
+            "handshake_avg_ms": round(self.handshake_total / self.new_connections * 1000, 3)
+            if self.new_connections else 0.0,
+        }
+
+
+async def iter_sse(resp: httpx.Response):
+    """Decoded JSON `data:` events of a server-sent-events response, until [DONE]"""
+    async for line in resp.aiter_lines():
+        if not line.startswith("data:"):
+            continue
+        data = line[5:].strip()
+        if data == "[DONE]":
+            return
+        try:
+            yield json.loads(data)
+        except ValueError:
+            continue
@@ -0,0 +1,166 @@
+"""
+Health-scored scheduler for Groq API keys.
+
+Replaces plain round robin. Every request reports back its key's outcome, and
+pick() returns the healthiest key that is currently usable:
+
+    cooldown   429 responses park a key until Retry-After (or
+               GROQ_COOLDOWN_SECONDS when the header is missing)
+    circuit    GROQ_BREAKER_FAILURES consecutive failures open the key's
+               circuit for GROQ_BREAKER_SECONDS, doubling on each re-open up to
+               16x; 401/403 open it straight away. Once the open period ends a
+               single probe request is let through (half-open): success closes
+               the circuit, failure re-opens it
+    score      EWMA latency weighted by EWMA error rate, plus in-flight
+               requests, so load spreads across equally healthy keys
+
+Everything runs on the event loop; no locking is needed.
+"""
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+class _KeyState:
+    __slots__ = ("key", "latency", "error_rate", "inflight", "cooldown_until",
+                 "failures", "state", "open_until", "opens", "probing",
+                 "requests", "errors", "rate_limited")
+
+    def __init__(self, key: str):
+        self.key = key
+        self.latency = 1.0  # seconds, optimistic prior
+        self.error_rate = 0.0
+        self.inflight = 0
+        self.cooldown_until = 0.0
+        self.failures = 0
+        self.state = CLOSED
+        self.open_until = 0.0
+        self.opens = 0
+        self.probing = False
+        self.requests = 0
+        self.errors = 0
+        self.rate_limited = 0
+
+
+class KeyScheduler:
+    def __init__(self, keys: list, failure_threshold: int = 3, open_seconds: float = 30.0,
+                 default_cooldown: float = 30.0, alpha: float = 0.3):
+        self._keys = [_KeyState(k) for k in keys]
+        self._by_key = {s.key: s for s in self._keys}
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self.default_cooldown = default_cooldown
+        self.alpha = alpha
+        self.exhausted = 0  # pick() calls that found no usable key
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def _usable(self, s: _KeyState, now: float) -> bool:
+        if s.cooldown_until > now:
+            return False
+        if s.state == OPEN:
+            if s.open_until > now:
+                return False
+            s.state = HALF_OPEN
+        if s.state == HALF_OPEN:
+            return not s.probing
+        return True
+
+    def pick(self, exclude=()):
+        """Best usable key not in `exclude`, or None; marks it in flight"""
+        now = time.monotonic()
+        best, best_score = None, None
+        for s in self._keys:
+            if s.key in exclude or not self._usable(s, now):
+                continue
+            score = s.latency * (1 + 4 * s.error_rate) * (1 + s.inflight)
+            if best is None or score < best_score:
+                best, best_score = s, score
+        if best is None:
+            self.exhausted += 1
+            return None
+        if best.state == HALF_OPEN:
+            best.probing = True
+        best.inflight += 1
+        best.requests += 1
+        return best.key
+
+    def _finish(self, s: _KeyState, ok: bool):
+        s.inflight = max(0, s.inflight - 1)
+        s.probing = False
+        s.error_rate += self.alpha * ((0.0 if ok else 1.0) - s.error_rate)
+
+    def success(self, key: str, latency: float):
+        s = self._by_key[key]
+        self._finish(s, True)
+        s.latency += self.alpha * (latency - s.latency)
+        s.failures = 0
+        if s.state != CLOSED:
+            logger.info(f"Groq key {_mask(key)} recovered; circuit closed")
+        s.state = CLOSED
+        s.opens = 0
+
+    def failure(self, key: str, status: int = None, retry_after: float = None):
+        """Report a failed request; status is the HTTP status, None for network errors"""
+        s = self._by_key[key]
+        self._finish(s, False)
+        s.errors += 1
+        now = time.monotonic()
+        if status == 429:
+            s.rate_limited += 1
+            s.cooldown_until = now + (retry_after if retry_after is not None else self.default_cooldown)
+            return
+        s.failures += 1
+        if status in (401, 403) or s.state == HALF_OPEN or s.failures >= self.failure_threshold:
+            s.opens += 1
+            s.state = OPEN
+            s.open_until = now + self.open_seconds * min(2 ** (s.opens - 1), 16)
+            logger.warning(f"Groq key {_mask(key)} circuit open for {s.open_until - now:.0f}s (status={status})")
+
+    def release(self, key: str):
+        """Drop the in-flight mark without judging the key (e.g. cancelled request)"""
+        s = self._by_key[key]
+        s.inflight = max(0, s.inflight - 1)
+        s.probing = False
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        keys = []
+        for s in self._keys:
+            self._usable(s, now)  # advance expired circuits to half-open
+            keys.append({
+                "key": _mask(s.key),
+                "state": s.state,
+                "latency_ms": round(s.latency * 1000, 1),
+                "error_rate": round(s.error_rate, 3),
+                "inflight": s.inflight,
+                "cooldown_s": round(max(0.0, s.cooldown_until - now), 1),
+                "open_s": round(max(0.0, s.open_until - now), 1) if s.state == OPEN else 0.0,
+                "requests": s.requests,
+                "errors": s.errors,
+                "rate_limited": s.rate_limited,
+            })
+        return {"exhausted": self.exhausted, "keys": keys}
+
+
+def _mask(key: str) -> str:
+    return f"{key[:4]}…{key[-4:]}" if len(key) > 8 else "…"
+
+
+def parse_retry_after(value):
+    """Seconds from a Retry-After header (delta-seconds or HTTP date), else None"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        from email.utils import parsedate_to_datetime
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except Exception:
+        return None
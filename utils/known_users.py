@@ -0,0 +1,51 @@
+"""
+Registry of users the bot has already stored.
+
+ensure_user() runs at the top of almost every command; once a user is known
+and their username has not changed there is nothing to write, so the
+Firebase backend consults this registry first and skips the round trip.
+
+It is a single user_id -> last seen username dict, warmed from the users scan
+done in init_db() and extended whenever ensure_user() has actually written a
+record. The database itself is the durable copy, so nothing is persisted
+separately; entries are only added after the write has succeeded.
+"""
+import threading
+
+
+class KnownUsers:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._names = {}  # user_id -> last seen username ("" if none)
+
+    def load(self, users: dict):
+        names = {}
+        for uid, user in (users or {}).items():
+            if not isinstance(user, dict):
+                continue
+            try:
+                uid = int(uid)
+            except (TypeError, ValueError):
+                continue
+            names[uid] = user.get("username") or ""
+        with self._lock:
+            self._names.update(names)
+
+    def is_current(self, user_id: int, username: str | None = None) -> bool:
+        """True if the user is stored and `username` adds nothing new"""
+        name = self._names.get(user_id)
+        if name is None:
+            return False
+        return not username or name == username
+
+    def add(self, user_id: int, username: str | None = None):
+        with self._lock:
+            if username or user_id not in self._names:
+                self._names[user_id] = username or ""
+
+    def discard(self, user_id: int):
+        with self._lock:
+            self._names.pop(user_id, None)
+
+    def __len__(self):
+        return len(self._names)
@@ -0,0 +1,79 @@
+"""
+Incrementally maintained leaderboard index.
+
+Keeps every known user ordered by balance so /leaderboard is an O(K) slice
+instead of downloading and sorting the whole `users` tree on each call. The
+index is loaded once from a full scan (utils.firebase_db.init_db) and then
+updated by every mutator that touches a balance, username or status flag.
+"""
+import bisect
+import threading
+
+
+class LeaderboardIndex:
+    """Balance-ordered index of users, safe to use from storage worker threads"""
+
+    FIELDS = ("username", "balance", "is_dead", "is_premium")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._order = []     # sorted (-balance, user_id)
+        self._entries = {}   # user_id -> {username, balance, is_dead, is_premium}
+        self.warm = False
+
+    @staticmethod
+    def _key(user_id):
+        try:
+            return int(user_id)
+        except (TypeError, ValueError):
+            return user_id
+
+    def load(self, users: dict):
+        """Replace the index with a full `users` snapshot"""
+        entries = {}
+        for uid, user in (users or {}).items():
+            if not isinstance(user, dict):
+                continue
+            entries[self._key(uid)] = {
+                "username": user.get("username", ""),
+                "balance": user.get("balance", 0),
+                "is_dead": user.get("is_dead", 0),
+                "is_premium": user.get("is_premium", 0),
+            }
+        order = sorted((-e["balance"], uid) for uid, e in entries.items())
+        with self._lock:
+            self._entries = entries
+            self._order = order
+            self.warm = True
+
+    def update(self, user_id, **fields):
+        """Apply changed fields for one user; unknown users are inserted"""
+        if not self.warm:
+            return
+        uid = self._key(user_id)
+        with self._lock:
+            entry = self._entries.get(uid)
+            if entry is None:
+                entry = {"username": "", "balance": 0, "is_dead": 0, "is_premium": 0}
+                self._entries[uid] = entry
+                bisect.insort(self._order, (0, uid))
+            for name, value in fields.items():
+                if name not in self.FIELDS or value is None:
+                    continue
+                if name == "balance" and value != entry["balance"]:
+                    old = (-entry["balance"], uid)
+                    i = bisect.bisect_left(self._order, old)
+                    if i < len(self._order) and self._order[i] == old:
+                        del self._order[i]
+                    bisect.insort(self._order, (-value, uid))
+                entry[name] = value
+
+    def top(self, limit: int = 15) -> list:
+        with self._lock:
+            return [
+                {"user_id": uid, **self._entries[uid]}
+                for _, uid in self._order[:limit]
+            ]
+
+    def __len__(self):
+        return len(self._entries)
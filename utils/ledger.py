@@ -0,0 +1,253 @@
+"""
+Append-only coin ledger.
+
+Every debit and credit made through utils.storage is appended here as one
+JSON line, so balances have an audit trail and can be recomputed or rolled
+back after a bad game payout.
+
+Layout under LEDGER_DIR:
+    segment-<first seq>.log     JSON lines, rotated at LEDGER_SEGMENT_BYTES
+    snapshot-<seq>.json         every user's last balance, entry count and
+                                recent entry offsets as of <seq>, written
+                                every LEDGER_SNAPSHOT_EVERY entries
+
+Entry: {"seq", "ts", "kind", "user_id", "delta", "balance", "ref"}
+    kind     daily | bet | transfer_out | transfer_in | kill | protect | adjust
+    balance  balance right after the entry
+    ref      links the two legs of a transfer
+
+An in-memory per-user index keeps the (segment, byte offset) of each user's
+last LEDGER_INDEX_DEPTH entries, so history() seeks straight to them; older
+pages fall back to a scan. open() and balances_at() start from the latest
+snapshot and only read the entries written after it.
+
+Blocking file I/O: call it off the event loop (utils.storage runs it on a
+single ledger thread, which also keeps appends in order).
+"""
+from collections import deque
+import os
+import json
+import time
+import glob
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class Ledger:
+    def __init__(self, directory: str, segment_bytes: int = 4 * 1024 * 1024,
+                 snapshot_every: int = 10000, index_depth: int = 200):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.snapshot_every = snapshot_every
+        self.index_depth = index_depth
+        self._lock = threading.Lock()
+        self._index = {}     # user_id -> deque of (segment name, offset), oldest first
+        self._counts = {}    # user_id -> number of entries
+        self._balances = {}  # user_id -> last recorded balance
+        self._seq = 0
+        self._since_snapshot = 0
+        self._segment = None
+        self._segment_path = None
+
+    # ── startup ──────────────────────────────────────────────────
+
+    def open(self):
+        """Restore the index from the latest snapshot, replay the entries
+        written after it and start appending"""
+        os.makedirs(self.directory, exist_ok=True)
+        self._repair_tail()
+        snapshot = self._latest_snapshot()
+        start = 0
+        if snapshot is not None:
+            start = snapshot["seq"]
+            self._seq = start
+            self._balances = {int(k): v for k, v in snapshot["balances"].items()}
+            self._counts = {int(k): v for k, v in snapshot["counts"].items()}
+            for uid, refs in snapshot["index"].items():
+                self._index[int(uid)] = deque(map(tuple, refs), maxlen=self.index_depth)
+        for entry, name, offset in self._entries_after(start):
+            self._track(entry, name, offset)
+        self._rotate()
+        logger.info(f"Ledger opened at seq {self._seq} with {len(self._counts)} users")
+
+    def _repair_tail(self):
+        """Cut a torn last line (a crash mid-append) off the newest segment,
+        so new entries are never appended behind it"""
+        segments = self._segments()
+        if not segments:
+            return
+        path = segments[-1]
+        good = 0
+        with open(path, "rb") as fh:
+            for raw in fh:
+                if self._decode(raw) is None:
+                    break
+                good += len(raw)
+        if good < os.path.getsize(path):
+            logger.warning(f"Truncating torn ledger tail in {os.path.basename(path)} at byte {good}")
+            with open(path, "r+b") as fh:
+                fh.truncate(good)
+
+    @staticmethod
+    def _decode(raw: bytes):
+        """The entry on one line, or None for a torn or partial line"""
+        if not raw.endswith(b"\n"):
+            return None
+        try:
+            return json.loads(raw)
+        except ValueError:
+            return None
+
+    def _segments(self) -> list:
+        return sorted(glob.glob(os.path.join(self.directory, "segment-*.log")))
+
+    def _snapshots(self) -> list:
+        return sorted(glob.glob(os.path.join(self.directory, "snapshot-*.json")))
+
+    def _latest_snapshot(self, at_most: int = None):
+        for path in reversed(self._snapshots()):
+            if at_most is not None and int(os.path.basename(path)[9:21]) > at_most:
+                continue
+            try:
+                with open(path, encoding="utf-8") as fh:
+                    return json.load(fh)
+            except ValueError:
+                logger.warning(f"Skipping unreadable ledger snapshot {path}")
+        return None
+
+    def _entries_after(self, seq: int):
+        """(entry, segment name, offset) for every entry newer than seq,
+        skipping the segments that end before it"""
+        segments = self._segments()
+        first = 0
+        for i, path in enumerate(segments):
+            if int(os.path.basename(path)[8:20]) <= seq + 1:
+                first = i
+        for path in segments[first:]:
+            name = os.path.basename(path)
+            with open(path, "rb") as fh:
+                offset = 0
+                for raw in fh:
+                    entry = self._decode(raw)
+                    if entry is not None and entry["seq"] > seq:
+                        yield entry, name, offset
+                    offset += len(raw)  # a torn line is skipped, not the rest of the file
+
+    def _track(self, entry: dict, name: str, offset: int):
+        uid = entry["user_id"]
+        refs = self._index.get(uid)
+        if refs is None:
+            refs = self._index[uid] = deque(maxlen=self.index_depth)
+        refs.append((name, offset))
+        self._counts[uid] = self._counts.get(uid, 0) + 1
+        if entry.get("balance") is not None:
+            self._balances[uid] = entry["balance"]
+        self._seq = max(self._seq, entry["seq"])
+
+    def _rotate(self):
+        if self._segment is not None:
+            self._segment.close()
+        self._segment_path = os.path.join(self.directory, f"segment-{self._seq + 1:012d}.log")
+        self._segment = open(self._segment_path, "ab")
+
+    # ── writing ──────────────────────────────────────────────────
+
+    def record(self, kind: str, user_id: int, delta: int, balance: int = None, ref: str = None) -> dict:
+        with self._lock:
+            if self._segment is None:
+                return {}
+            self._seq += 1
+            entry = {
+                "seq": self._seq,
+                "ts": int(time.time()),
+                "kind": kind,
+                "user_id": user_id,
+                "delta": delta,
+                "balance": balance,
+                "ref": ref,
+            }
+            raw = (json.dumps(entry, separators=(",", ":")) + "\n").encode("utf-8")
+            offset = self._segment.tell()
+            self._segment.write(raw)
+            self._segment.flush()
+            self._track(entry, os.path.basename(self._segment_path), offset)
+            if offset + len(raw) >= self.segment_bytes:
+                self._rotate()
+            self._since_snapshot += 1
+            if self._since_snapshot >= self.snapshot_every:
+                self._snapshot()
+            return entry
+
+    def _snapshot(self):
+        path = os.path.join(self.directory, f"snapshot-{self._seq:012d}.json")
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as fh:
+            json.dump({
+                "seq": self._seq,
+                "balances": self._balances,
+                "counts": self._counts,
+                "index": {uid: list(refs) for uid, refs in self._index.items()},
+            }, fh, separators=(",", ":"))
+        os.replace(tmp, path)
+        self._since_snapshot = 0
+
+    def close(self):
+        with self._lock:
+            if self._segment is not None:
+                self._segment.close()
+                self._segment = None
+
+    # ── reading ──────────────────────────────────────────────────
+
+    def history(self, user_id: int, limit: int = 10, offset: int = 0) -> list:
+        """A user's entries, newest first"""
+        with self._lock:
+            refs = list(self._index.get(user_id, ()))
+            total = self._counts.get(user_id, 0)
+        if offset + limit > len(refs) and total > len(refs):
+            return self._scan_history(user_id, limit, offset)
+        end = len(refs) - offset
+        picked = refs[max(0, end - limit):max(0, end)]
+        entries = []
+        for name, pos in reversed(picked):
+            with open(os.path.join(self.directory, name), "rb") as fh:
+                fh.seek(pos)
+                entries.append(json.loads(fh.readline()))
+        return entries
+
+    def _scan_history(self, user_id: int, limit: int, offset: int) -> list:
+        """Slow path for pages older than the index depth"""
+        keep = deque(maxlen=offset + limit)
+        for entry, _, _ in self._entries_after(0):
+            if entry["user_id"] == user_id:
+                keep.append(entry)
+        newest_first = list(reversed(keep))
+        return newest_first[offset:offset + limit]
+
+    def count(self, user_id: int) -> int:
+        return self._counts.get(user_id, 0)
+
+    def balances_at(self, seq: int = None) -> dict:
+        """Recorded balances as of `seq` (default: now), from the nearest
+        earlier snapshot plus the entries after it; for recovery and audits"""
+        target = seq if seq is not None else self._seq
+        balances, start = {}, 0
+        snapshot = self._latest_snapshot(at_most=target)
+        if snapshot is not None:
+            balances = {int(k): v for k, v in snapshot["balances"].items()}
+            start = snapshot["seq"]
+        for entry, _, _ in self._entries_after(start):
+            if entry["seq"] > target:
+                break
+            if entry.get("balance") is not None:
+                balances[entry["user_id"]] = entry["balance"]
+        return balances
+
+    def stats(self) -> dict:
+        return {
+            "seq": self._seq,
+            "users": len(self._counts),
+            "segment": os.path.basename(self._segment_path) if self._segment_path else None,
+        }
@@ -0,0 +1,88 @@
+"""
+Per-chat micro-batching of Hinata mentions.
+
+A mention in a quiet group is handed to `handler(chat_id, [message])` right
+away and opens a window of HINATA_BATCH_WINDOW_MS. Mentions arriving in that
+chat while the window is open are collected and handed over together when it
+closes (or once HINATA_BATCH_MAX have queued), after which a new window opens
+in case the burst goes on. A window that closes empty ends the burst, so the
+next mention is answered immediately again. Quiet chats pay no added
+latency; a burst of mentions costs one upstream call per window instead of
+one per mention.
+
+Runs on the event loop only; handlers run as tasks so a slow batch never
+delays the next window.
+"""
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class MentionBatcher:
+    def __init__(self, handler, window: float = 1.5, max_batch: int = 8):
+        self.handler = handler
+        self.window = window
+        self.max_batch = max_batch
+        self._pending = {}  # chat_id -> [messages, timer]
+        self._tasks = set()
+        self.immediate = 0  # mentions answered without waiting
+        self.batches = 0    # batches collected behind an open window
+        self.mentions = 0
+        self.largest = 0
+
+    def submit(self, chat_id: int, message) -> bool:
+        """Take a mention; True if it was dispatched at once (no window was
+        open), False if it joined the chat's pending batch"""
+        entry = self._pending.get(chat_id)
+        if entry is None:
+            self.immediate += 1
+            self._open(chat_id)
+            self._dispatch(chat_id, [message])
+            return True
+        entry[0].append(message)
+        if len(entry[0]) >= self.max_batch:
+            self._flush(chat_id)
+        return False
+
+    def _open(self, chat_id: int):
+        timer = asyncio.get_running_loop().call_later(self.window, self._flush, chat_id)
+        self._pending[chat_id] = [[], timer]
+
+    def _flush(self, chat_id: int):
+        entry = self._pending.pop(chat_id, None)
+        if entry is None:
+            return
+        messages, timer = entry
+        timer.cancel()
+        if not messages:
+            return  # burst over
+        self.batches += 1
+        self.largest = max(self.largest, len(messages))
+        self._dispatch(chat_id, messages)
+        self._open(chat_id)
+
+    def _dispatch(self, chat_id: int, messages: list):
+        self.mentions += len(messages)
+        task = asyncio.ensure_future(self._run(chat_id, messages))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, chat_id: int, messages: list):
+        try:
+            await self.handler(chat_id, messages)
+        except Exception as e:
+            logger.error(f"Mention batch for chat {chat_id} failed: {e}")
+
+    def stats(self) -> dict:
+        return {
+            "window_ms": round(self.window * 1000),
+            "max_batch": self.max_batch,
+            "immediate": self.immediate,
+            "batches": self.batches,
+            "mentions": self.mentions,
+            "avg_batch": round((self.mentions - self.immediate) / self.batches, 2) if self.batches else 0.0,
+            "largest": self.largest,
+            "pending_chats": len(self._pending),
+            "running": len(self._tasks),
+        }
@@ -1,18 +1,25 @@
 """
-Async MongoDB helper using Motor (optional). This module is added to satisfy the
-requirement to support Motor (async MongoDB). It exposes simple async functions
-that can be used by newer async handlers. If `MONGO_URI` is not set, callers
-should fall back to the existing sqlite firebase_db module.
+Async MongoDB backend using Motor (optional).
+
+Selected with DB_BACKEND=mongo; utils.storage then awaits these coroutines
+directly instead of running utils.firebase_db on its thread pool. Exposes the
+same function surface as utils.firebase_db.
 
 Usage (async):
-    from utils.motor_db import ensure_user, get_user, change_balance
-    await ensure_user(user_id, username)
-    user = await get_user(user_id)
+    from utils import motor_db
+    await motor_db.init_db()
+    await motor_db.ensure_user(user_id, username)
+    user = await motor_db.get_user(user_id)
 
-This file intentionally provides a minimal, production-ready async interface.
+One AsyncIOMotorClient is created by init_db() and reused for the life of the
+process; its connection pool is sized with MONGO_POOL_SIZE. Every
+check-then-write (debits, bets, daily claim, protect) is a single conditional
+update, so concurrent commands cannot race each other. With MONGO_COALESCE=1,
+concurrent balance credits are merged into one bulkWrite per short window.
 """
 from typing import Optional
 import os
+import time
 import asyncio
 import logging
 
@@ -20,63 +27,180 @@ logger = logging.getLogger(__name__)
 
 MONGO_URI = os.getenv("MONGO_URI", "")
 DB_NAME = os.getenv("MONGO_DBNAME", "gamebot")
+MONGO_POOL_SIZE = int(os.getenv("MONGO_POOL_SIZE", "50"))
+MONGO_COALESCE = os.getenv("MONGO_COALESCE", "0") == "1"
+MONGO_COALESCE_MS = float(os.getenv("MONGO_COALESCE_MS", "5"))
+MONGO_COALESCE_MAX = int(os.getenv("MONGO_COALESCE_MAX", "500"))
+
+DAY = 24 * 3600
 
 _client = None
 _db = None
+_init_lock = None
+_initialized = False
+_coalescer = None
+_init_error = None
 
 
 async def _connect():
-    global _client, _db
-    if _client is not None:
-        return
-    try:
-        from motor.motor_asyncio import AsyncIOMotorClient
-    except Exception as e:
-        logger.error("motor is not installed: %s", e)
+    """Create the shared client once; later calls return immediately"""
+    global _client, _db, _init_lock, _initialized, _coalescer, _init_error
+    if _initialized:
         return
+    if _init_lock is None:
+        _init_lock = asyncio.Lock()
+    async with _init_lock:
+        if _initialized:
+            return
+        _initialized = True
+        try:
+            from motor.motor_asyncio import AsyncIOMotorClient
+        except Exception as e:
+            _init_error = f"motor is not installed: {e}"
+            logger.error(_init_error)
+            return
+
+        if not MONGO_URI:
+            _init_error = "MONGO_URI is not set"
+            logger.error(_init_error)
+            return
+
+        client = AsyncIOMotorClient(MONGO_URI, maxPoolSize=MONGO_POOL_SIZE, retryWrites=True)
+        try:
+            # The client connects lazily; ping so a bad URI fails here, not
+            # as silently empty results later
+            await client.admin.command("ping")
+        except Exception as e:
+            client.close()
+            _init_error = f"cannot reach MongoDB: {e}"
+            logger.error(_init_error)
+            return
+        _client = client
+        _db = _client[DB_NAME]
+        try:
+            await _db.users.create_index("user_id", unique=True)
+            await _db.users.create_index([("balance", -1)])
+            await _db.groups.create_index("group_id", unique=True)
+        except Exception as e:
+            logger.warning("Could not ensure Mongo indexes: %s", e)
+        if MONGO_COALESCE:
+            _coalescer = _CreditCoalescer(_db.users, MONGO_COALESCE_MS / 1000, MONGO_COALESCE_MAX)
+
+
+async def init_db():
+    """Connect, raising if MongoDB is unusable: with DB_BACKEND=mongo there is
+    no fallback, and every other call would quietly do nothing"""
+    await _connect()
+    if _db is None:
+        raise RuntimeError(f"DB_BACKEND=mongo but MongoDB is unavailable: {_init_error}")
+    logger.info("MongoDB initialized (%s)", DB_NAME)
+
+
+async def close():
+    global _client, _db, _initialized, _init_error
+    if _client is not None:
+        _client.close()
+    _client = None
+    _db = None
+    _initialized = False
+    _init_error = None
+
+
+class _CreditCoalescer:
+    """Merge concurrent balance credits into one bulkWrite.
+
+    The first credit in a window schedules a flush MONGO_COALESCE_MS later
+    (or immediately once MONGO_COALESCE_MAX are queued). Credits for the same
+    user are summed; every caller then gets its user's balance from a single
+    follow-up find(), so N concurrent credits cost two round trips instead of N.
+    """
+
+    def __init__(self, users, window: float, max_batch: int):
+        self._users = users
+        self._window = window
+        self._max_batch = max_batch
+        self._queue = []  # (user_id, delta, future)
+        self._timer = None
+        self.batches = 0
+        self.merged = 0
+
+    async def credit(self, user_id: int, delta: int):
+        fut = asyncio.get_running_loop().create_future()
+        self._queue.append((user_id, delta, fut))
+        if len(self._queue) >= self._max_batch:
+            self._flush_now()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self._window, self._flush_now)
+        return await fut
+
+    def _flush_now(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._queue = self._queue, []
+        if batch:
+            asyncio.ensure_future(self._flush(batch))
+
+    async def _flush(self, batch):
+        from pymongo import UpdateOne
+
+        totals = {}
+        for user_id, delta, _ in batch:
+            totals[user_id] = totals.get(user_id, 0) + delta
+        try:
+            await self._users.bulk_write(
+                [UpdateOne({"user_id": uid}, {"$inc": {"balance": d}}) for uid, d in totals.items()],
+                ordered=False,
+            )
+            cursor = self._users.find({"user_id": {"$in": list(totals)}}, {"_id": 0, "user_id": 1, "balance": 1})
+            balances = {doc["user_id"]: doc.get("balance", 0) async for doc in cursor}
+            self.batches += 1
+            self.merged += len(batch)
+            for user_id, _, fut in batch:
+                if not fut.done():
+                    fut.set_result(balances.get(user_id))
+        except Exception as e:
+            for _, _, fut in batch:
+                if not fut.done():
+                    fut.set_exception(e)
 
-    if not MONGO_URI:
-        logger.info("MONGO_URI not set; motor not initialized")
-        return
 
-    _client = AsyncIOMotorClient(MONGO_URI)
-    _db = _client[DB_NAME]
-    # Ensure indexes
-    try:
-        await _db.users.create_index("user_id", unique=True)
-    except Exception:
-        pass
+def coalescer_stats() -> dict:
+    if _coalescer is None:
+        return {"enabled": False}
+    return {"enabled": True, "batches": _coalescer.batches, "credits": _coalescer.merged}
 
 
+# ═══════════════════════════════════════════════════════════════
+# USERS & ECONOMY
+# ═══════════════════════════════════════════════════════════════
+
 async def ensure_user(user_id: int, username: Optional[str] = None):
     await _connect()
     if _db is None:
         return
-    users = _db.users
-    await users.update_one(
-        {"user_id": user_id},
-        {
-            "$setOnInsert": {
-                "user_id": user_id,
-                "username": username or "",
-                "balance": 0,
-                "is_dead": False,
-                "protect_until": 0,
-                "last_daily": 0,
-                "is_premium": False,
-            }
-        },
-        upsert=True,
-    )
+    update = {
+        "$setOnInsert": {
+            "user_id": user_id,
+            "balance": 0,
+            "is_dead": 0,
+            "protect_until": 0,
+            "last_daily": 0,
+            "is_premium": 0,
+        }
+    }
+    if username:
+        update["$set"] = {"username": username}
+    else:
+        update["$setOnInsert"]["username"] = ""
+    await _db.users.update_one({"user_id": user_id}, update, upsert=True)
 
 
 async def get_user(user_id: int):
     await _connect()
     if _db is None:
         return None
-    users = _db.users
-    doc = await users.find_one({"user_id": user_id})
-    return doc
+    return await _db.users.find_one({"user_id": user_id}, {"_id": 0})
 
 
 async def change_balance(user_id: int, delta: int):
@@ -94,21 +218,24 @@ async def change_balance(user_id: int, delta: int):
         if res is None:
             return None
         return res.get("balance")
-    else:
-        res = await users.find_one_and_update(
-            {"user_id": user_id}, {"$inc": {"balance": delta}}, return_document=True
-        )
-        if res:
-            return res.get("balance")
-        return None
+    if _coalescer is not None:
+        return await _coalescer.credit(user_id, delta)
+    res = await users.find_one_and_update(
+        {"user_id": user_id}, {"$inc": {"balance": delta}}, return_document=True
+    )
+    if res:
+        return res.get("balance")
+    return None
 
 
-async def transfer(sender_id: int, recipient_id: int, amount: int) -> bool:
+async def transfer(sender_id: int, recipient_id: int, amount: int) -> dict:
+    """See utils.firebase_db.transfer"""
+    failed = {"ok": False, "sender_balance": None, "recipient_balance": None}
     if amount <= 0:
-        return False
+        return failed
     await _connect()
     if _db is None:
-        return False
+        return failed
     users = _db.users
     # ensure both
     await ensure_user(sender_id, None)
@@ -116,25 +243,95 @@ async def transfer(sender_id: int, recipient_id: int, amount: int) -> bool:
 
     async with await _client.start_session() as s:
         async with s.start_transaction():
-            sender = await users.find_one({"user_id": sender_id})
-            if not sender or sender.get("balance", 0) < amount:
-                return False
-            await users.update_one({"user_id": sender_id}, {"$inc": {"balance": -amount}})
-            await users.update_one({"user_id": recipient_id}, {"$inc": {"balance": amount}})
-            return True
+            sender = await users.find_one_and_update(
+                {"user_id": sender_id, "balance": {"$gte": amount}},
+                {"$inc": {"balance": -amount}},
+                return_document=True,
+                session=s,
+            )
+            if sender is None:
+                await s.abort_transaction()
+                return failed
+            recipient = await users.find_one_and_update(
+                {"user_id": recipient_id}, {"$inc": {"balance": amount}}, return_document=True, session=s
+            )
+            return {
+                "ok": True,
+                "sender_balance": sender.get("balance"),
+                "recipient_balance": recipient.get("balance") if recipient else None,
+            }
+
+
+async def settle_bet(user_id: int, bet: int, payout_fn) -> dict:
+    """Debit a bet and credit its payout in a single conditional update.
+
+    Returns {"ok": bool, "balance": int, "payout": int}; see
+    utils.firebase_db.settle_bet.
+    """
+    if bet <= 0:
+        return {"ok": False, "balance": 0, "payout": 0}
+    await _connect()
+    if _db is None:
+        return {"ok": False, "balance": 0, "payout": 0}
+    users = _db.users
+    payout = int(payout_fn(bet))
+    res = await users.find_one_and_update(
+        {"user_id": user_id, "balance": {"$gte": bet}},
+        {"$inc": {"balance": payout - bet}},
+        return_document=True,
+    )
+    if res is None:
+        # Rejected: only now pay for a read, to report the current balance
+        user = await users.find_one({"user_id": user_id}, {"balance": 1})
+        return {"ok": False, "balance": user.get("balance", 0) if user else 0, "payout": 0}
+    return {"ok": True, "balance": res.get("balance", 0), "payout": payout}
 
 
 async def claim_daily(user_id: int, amount: int, now_ts: int) -> bool:
     await _connect()
     if _db is None:
         return False
-    users = _db.users
-    user = await users.find_one({"user_id": user_id})
-    last = user.get("last_daily", 0) if user else 0
-    if now_ts - last < 24 * 3600:
+    # The cooldown check and the credit are one conditional update, so two
+    # concurrent /daily calls cannot both succeed
+    res = await _db.users.update_one(
+        {"user_id": user_id, "last_daily": {"$lte": now_ts - DAY}},
+        {"$set": {"last_daily": now_ts}, "$inc": {"balance": amount}},
+    )
+    return res.modified_count == 1
+
+
+async def _set_fields(user_id: int, update: dict):
+    await _connect()
+    if _db is None:
+        return
+    await ensure_user(user_id, None)
+    await _db.users.update_one({"user_id": user_id}, update)
+
+
+async def set_premium(user_id: int, premium: bool):
+    await _set_fields(user_id, {"$set": {"is_premium": 1 if premium else 0}})
+
+
+async def is_premium(user_id: int) -> bool:
+    await _connect()
+    if _db is None:
         return False
-    await users.update_one({"user_id": user_id}, {"$set": {"last_daily": now_ts}, "$inc": {"balance": amount}})
-    return True
+    doc = await _db.users.find_one({"user_id": user_id}, {"_id": 0, "is_premium": 1})
+    return bool(doc and doc.get("is_premium"))
+
+
+async def set_dead(user_id: int, dead: bool):
+    await _set_fields(user_id, {"$set": {"is_dead": 1 if dead else 0}})
+
+
+async def set_protect(user_id: int, until_ts: int):
+    # $max: a protection purchase never shortens an existing shield, even if
+    # two purchases race
+    await _set_fields(user_id, {"$max": {"protect_until": int(until_ts)}})
+
+
+async def set_last_daily(user_id: int, ts: int):
+    await _set_fields(user_id, {"$set": {"last_daily": int(ts)}})
 
 
 async def top_users(limit: int = 15):
@@ -142,5 +339,49 @@ async def top_users(limit: int = 15):
     if _db is None:
         return []
     users = _db.users
-    cursor = users.find({}, {"_id": 0}).sort("balance", -1).limit(limit)
+    cursor = users.find(
+        {}, {"_id": 0, "user_id": 1, "username": 1, "balance": 1, "is_dead": 1, "is_premium": 1}
+    ).sort("balance", -1).limit(limit)
+    return [doc async for doc in cursor]
+
+
+# ═══════════════════════════════════════════════════════════════
+# GROUP MANAGEMENT FUNCTIONS
+# ═══════════════════════════════════════════════════════════════
+
+async def register_group(group_id: int, group_name: str = None):
+    await _connect()
+    if _db is None:
+        return
+    await _db.groups.update_one(
+        {"group_id": group_id},
+        {"$set": {
+            "group_name": group_name or f"Group_{group_id}",
+            "registered_at": int(time.time()),
+            "is_active": 1,
+        }},
+        upsert=True,
+    )
+
+
+async def is_group_registered(group_id: int) -> bool:
+    await _connect()
+    if _db is None:
+        return False
+    doc = await _db.groups.find_one({"group_id": group_id, "is_active": 1}, {"_id": 1})
+    return doc is not None
+
+
+async def unregister_group(group_id: int):
+    await _connect()
+    if _db is None:
+        return
+    await _db.groups.update_one({"group_id": group_id}, {"$set": {"is_active": 0}})
+
+
+async def get_all_registered_groups():
+    await _connect()
+    if _db is None:
+        return []
+    cursor = _db.groups.find({"is_active": 1}, {"_id": 0, "group_id": 1, "group_name": 1})
     return [doc async for doc in cursor]
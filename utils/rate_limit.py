@@ -0,0 +1,103 @@
+"""
+Inbound rate limiting for incoming updates.
+
+Token buckets per user and per chat, checked by a handler in group -1 before
+any command touches storage or Groq. Each update costs tokens according to
+its class (AI chat is dearer than a game, a game dearer than a plain
+command); an update that either bucket cannot pay for is dropped.
+
+State per key is one small __slots__ object. A bucket idle long enough to
+have refilled completely is indistinguishable from a new one, so such
+buckets are swept out (at most once a second) once the table grows past
+`max_keys`.
+
+The first rejected update in a cooldown episode gets notify=True so the bot
+can send one notice; further rejections stay silent until the key is allowed
+through again.
+"""
+import time
+
+
+class _Bucket:
+    __slots__ = ("tokens", "updated", "notified")
+
+    def __init__(self, tokens: float, now: float):
+        self.tokens = tokens
+        self.updated = now
+        self.notified = False
+
+
+class _Buckets:
+    def __init__(self, capacity: float, per_minute: float, max_keys: int):
+        self.capacity = capacity
+        self.rate = per_minute / 60.0
+        self.max_keys = max_keys
+        self._data = {}
+        self._next_sweep = 0.0
+        self.evictions = 0
+
+    def _get(self, key, now: float) -> _Bucket:
+        bucket = self._data.get(key)
+        if bucket is None:
+            if len(self._data) >= self.max_keys and now >= self._next_sweep:
+                self._sweep(now)
+            bucket = self._data[key] = _Bucket(self.capacity, now)
+        else:
+            bucket.tokens = min(self.capacity, bucket.tokens + (now - bucket.updated) * self.rate)
+            bucket.updated = now
+        return bucket
+
+    def _sweep(self, now: float):
+        self._next_sweep = now + 1.0  # at most one O(n) sweep per second
+        full_after = self.capacity / self.rate if self.rate else float("inf")
+        idle = [k for k, b in self._data.items() if now - b.updated >= full_after]
+        for k in idle:
+            del self._data[k]
+        self.evictions += len(idle)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class InboundLimiter:
+    def __init__(self, costs: dict, user_burst: float = 20, user_per_minute: float = 30,
+                 chat_burst: float = 60, chat_per_minute: float = 120, max_keys: int = 50000):
+        self.costs = costs
+        self._users = _Buckets(user_burst, user_per_minute, max_keys)
+        self._chats = _Buckets(chat_burst, chat_per_minute, max_keys)
+        self.allowed = 0
+        self.dropped = 0
+        self.notices = 0
+
+    def check(self, user_id: int, chat_id: int, kind: str):
+        """(allowed, notify, retry_after_seconds) for one update of class `kind`"""
+        cost = self.costs.get(kind, 1)
+        now = time.monotonic()
+        user = self._users._get(user_id, now)
+        chat = self._chats._get(chat_id, now) if chat_id != user_id else None
+        if user.tokens >= cost and (chat is None or chat.tokens >= cost):
+            user.tokens -= cost
+            user.notified = False
+            if chat is not None:
+                chat.tokens -= cost
+            self.allowed += 1
+            return True, False, 0.0
+
+        self.dropped += 1
+        short = max((cost - user.tokens) / self._users.rate if user.tokens < cost else 0.0,
+                    (cost - chat.tokens) / self._chats.rate if chat is not None and chat.tokens < cost else 0.0)
+        notify = not user.notified
+        user.notified = True
+        if notify:
+            self.notices += 1
+        return False, notify, short
+
+    def stats(self) -> dict:
+        return {
+            "allowed": self.allowed,
+            "dropped": self.dropped,
+            "notices": self.notices,
+            "users": len(self._users),
+            "chats": len(self._chats),
+            "evictions": self._users.evictions + self._chats.evictions,
+        }
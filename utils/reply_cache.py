@@ -0,0 +1,106 @@
+"""
+Reply cache with single-flight merging for Hinata AI replies.
+
+Keyed on the normalized user text ("Hi!!", "hi", "@gamebot hi" all map to
+"hi"). Only short messages (up to REPLY_CACHE_MAX_WORDS words) are cached:
+greetings repeat constantly, while anything longer is a real conversation
+whose reply depends on context.
+
+    hit          served from a bounded LRU with a per-entry TTL
+    in flight    identical prompts already waiting on the upstream call share
+                 that call instead of starting their own
+    miss         the fetch runs as its own task, so a cancelled caller does
+                 not cancel the other waiters
+
+Runs on the event loop only.
+"""
+from collections import OrderedDict
+import asyncio
+import re
+import time
+
+_MENTION = re.compile(r"@\w+")
+_NON_WORD = re.compile(r"[^\w\s]+")
+_SPACES = re.compile(r"\s+")
+
+
+def normalize(text: str) -> str:
+    text = _MENTION.sub(" ", (text or "").lower())
+    text = _NON_WORD.sub(" ", text)
+    return _SPACES.sub(" ", text).strip()
+
+
+class ReplyCache:
+    def __init__(self, max_size: int = 1000, ttl: float = 600.0, max_words: int = 4):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.max_words = max_words
+        self._data = OrderedDict()  # key -> (expires_at, reply)
+        self._inflight = {}         # key -> asyncio.Task
+        self.hits = 0
+        self.misses = 0
+        self.merged = 0
+        self.evictions = 0
+
+    def key(self, text: str):
+        """Cache key for `text`, or None if it should not be cached"""
+        norm = normalize(text)
+        if not norm or len(norm.split()) > self.max_words:
+            return None
+        return norm
+
+    def get(self, key: str):
+        item = self._data.get(key)
+        if item is None or item[0] < time.monotonic():
+            if item is not None:
+                del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return item[1]
+
+    def put(self, key: str, reply: str):
+        self._data[key] = (time.monotonic() + self.ttl, reply)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    async def get_or_fetch(self, key: str, fetch, cache_if=None) -> str:
+        """Cached reply for `key`, else await fetch() once for all concurrent
+        callers; the result is stored only when cache_if(result) is true"""
+        reply = self.get(key)
+        if reply is not None:
+            self.hits += 1
+            return reply
+
+        task = self._inflight.get(key)
+        if task is not None:
+            self.merged += 1
+        else:
+            self.misses += 1
+            task = asyncio.ensure_future(fetch())
+            self._inflight[key] = task
+
+            def _done(t):
+                self._inflight.pop(key, None)
+                if not t.cancelled() and t.exception() is None:
+                    result = t.result()
+                    if result and (cache_if is None or cache_if(result)):
+                        self.put(key, result)
+
+            task.add_done_callback(_done)
+        return await asyncio.shield(task)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses + self.merged
+        return {
+            "size": len(self._data),
+            "max_size": self.max_size,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "merged": self.merged,
+            "inflight": len(self._inflight),
+            "evictions": self.evictions,
+            "hit_rate": round((self.hits + self.merged) / lookups, 4) if lookups else 0.0,
+        }
@@ -0,0 +1,238 @@
+"""
+Central outbound queue for Telegram sends.
+
+Every reply, sticker and edit goes through SendQueue.send(), which runs it on
+a small pool of sender tasks under two token buckets:
+
+    global     SEND_GLOBAL_RATE messages/s across the bot (Telegram allows ~30)
+    per chat   SEND_CHAT_RATE messages/s with bursts of SEND_CHAT_BURST
+
+Jobs are served by lane: LANE_GAME (game results, economy) before
+LANE_COMMAND before LANE_CHAT (Hinata), FIFO within a lane. A job whose chat
+has no tokens is parked on that chat's backlog, which is released one job at
+a time as tokens come back, so a throttled chat keeps its order without
+blocking other chats.
+
+A FloodWait pauses that chat for the requested time and the job is retried
+(up to SEND_MAX_RETRIES, and only for waits up to SEND_MAX_FLOOD_WAIT);
+callers that handle FloodWait themselves pass retry=False.
+
+Usage:
+    msg = await send_queue.send(chat_id, lambda: message.reply_text(text), LANE_GAME)
+"""
+from collections import deque
+import asyncio
+import bisect
+import itertools
+import time
+import logging
+
+from pyrogram.errors import FloodWait
+
+logger = logging.getLogger(__name__)
+
+LANE_GAME, LANE_COMMAND, LANE_CHAT = 0, 1, 2
+LANE_NAMES = {LANE_GAME: "game", LANE_COMMAND: "command", LANE_CHAT: "chat"}
+
+
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "updated", "blocked_until")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def wait_time(self, now: float) -> float:
+        """Seconds until a token is available (0 if one is now)"""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.blocked_until > now:
+            return self.blocked_until - now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+
+class _Chat(TokenBucket):
+    __slots__ = ("backlog", "timer")
+
+    def __init__(self, rate: float, capacity: float):
+        super().__init__(rate, capacity)
+        self.backlog = []  # parked jobs, ordered by (lane, seq)
+        self.timer = None
+
+
+class _Job:
+    __slots__ = ("chat_id", "factory", "lane", "seq", "retry", "future", "queued_at", "attempts", "released")
+
+    def __init__(self, chat_id, factory, lane, seq, retry, future):
+        self.chat_id = chat_id
+        self.factory = factory
+        self.lane = lane
+        self.seq = seq
+        self.retry = retry
+        self.future = future
+        self.queued_at = time.monotonic()
+        self.attempts = 0
+        self.released = False
+
+    def __lt__(self, other):
+        return (self.lane, self.seq) < (other.lane, other.seq)
+
+
+class SendQueue:
+    def __init__(self, workers: int = 4, global_rate: float = 25.0, chat_rate: float = 1.0,
+                 chat_burst: int = 3, max_retries: int = 3, max_flood_wait: float = 60.0,
+                 max_chats: int = 10000, idle_seconds: float = 300.0):
+        self.workers = workers
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.max_flood_wait = max_flood_wait
+        self.max_chats = max_chats
+        self.idle_seconds = idle_seconds
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chats = {}  # chat_id -> _Chat
+        self._queue = None
+        self._tasks = []
+        self._seq = itertools.count()
+        self._depth = {lane: 0 for lane in LANE_NAMES}
+        self._parked = 0
+        self._latencies = deque(maxlen=500)
+
+        self.enqueued = 0
+        self.sent = 0
+        self.retries = 0
+        self.flood_waits = 0
+        self.failed = 0
+
+    async def start(self):
+        if self._queue is None:
+            self._queue = asyncio.PriorityQueue()
+            self._tasks = [asyncio.ensure_future(self._worker()) for _ in range(self.workers)]
+            logger.info(f"Send queue started with {self.workers} senders")
+
+    async def close(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._queue = None
+
+    async def send(self, chat_id: int, factory, lane: int = LANE_COMMAND, retry: bool = True):
+        """Run factory() (a coroutine function doing one send) under the
+        rate limits; returns its result or raises its exception"""
+        if self._queue is None:
+            return await factory()
+        future = asyncio.get_running_loop().create_future()
+        self.enqueued += 1
+        self._put(_Job(chat_id, factory, lane, next(self._seq), retry, future))
+        return await future
+
+    def _put(self, job: _Job):
+        self._depth[job.lane] += 1
+        self._queue.put_nowait((job.lane, job.seq, job))
+
+    def _park(self, chat: _Chat, job: _Job, delay: float = None):
+        """Add job to the chat's backlog and make sure a release is scheduled"""
+        bisect.insort(chat.backlog, job)
+        self._parked += 1
+        if delay is not None and chat.timer is not None:
+            chat.timer.cancel()
+            chat.timer = None
+        if chat.timer is None:
+            if delay is None:
+                delay = chat.wait_time(time.monotonic())
+            chat.timer = asyncio.get_running_loop().call_later(delay, self._release, job.chat_id)
+
+    def _release(self, chat_id: int):
+        """Hand the chat's oldest parked job back to the senders"""
+        chat = self._chats.get(chat_id)
+        if chat is None:
+            return
+        chat.timer = None
+        if chat.backlog and self._queue is not None:
+            job = chat.backlog.pop(0)
+            self._parked -= 1
+            job.released = True
+            self._put(job)
+
+    def _chat(self, chat_id: int, now: float) -> _Chat:
+        chat = self._chats.get(chat_id)
+        if chat is None:
+            if len(self._chats) >= self.max_chats:
+                idle = [cid for cid, c in self._chats.items()
+                        if c.updated + self.idle_seconds < now and c.blocked_until < now
+                        and not c.backlog and c.timer is None]
+                for cid in idle:
+                    del self._chats[cid]
+            chat = self._chats[chat_id] = _Chat(self.chat_rate, self.chat_burst)
+        return chat
+
+    async def _worker(self):
+        while True:
+            _, _, job = await self._queue.get()
+            self._depth[job.lane] -= 1
+            if job.future.done():
+                if job.released and job.chat_id in self._chats and self._chats[job.chat_id].timer is None:
+                    self._release(job.chat_id)
+                continue  # caller gave up
+
+            now = time.monotonic()
+            chat = self._chat(job.chat_id, now)
+            if (chat.backlog and not job.released) or chat.wait_time(now) > 0:
+                self._park(chat, job)
+                continue
+            job.released = False
+            wait = self._global.wait_time(now)
+            if wait > 0:
+                await asyncio.sleep(wait)
+                self._global.wait_time(time.monotonic())
+            self._global.take()
+            chat.take()
+
+            try:
+                result = await job.factory()
+            except FloodWait as e:
+                self.flood_waits += 1
+                chat.blocked_until = time.monotonic() + e.value
+                if job.retry and job.attempts < self.max_retries and e.value <= self.max_flood_wait:
+                    job.attempts += 1
+                    self.retries += 1
+                    self._park(chat, job, e.value)
+                    continue
+                self.failed += 1
+                if not job.future.done():
+                    job.future.set_exception(e)
+            except Exception as e:
+                self.failed += 1
+                if not job.future.done():
+                    job.future.set_exception(e)
+            else:
+                self.sent += 1
+                self._latencies.append(time.monotonic() - job.queued_at)
+                if not job.future.done():
+                    job.future.set_result(result)
+            if chat.backlog and chat.timer is None:
+                chat.timer = asyncio.get_running_loop().call_later(
+                    chat.wait_time(time.monotonic()), self._release, job.chat_id
+                )
+
+    def stats(self) -> dict:
+        latencies = sorted(self._latencies)
+        return {
+            "depth": {LANE_NAMES[lane]: n for lane, n in self._depth.items()},
+            "parked": self._parked,
+            "enqueued": self.enqueued,
+            "sent": self.sent,
+            "retries": self.retries,
+            "flood_waits": self.flood_waits,
+            "failed": self.failed,
+            "chats": len(self._chats),
+            "latency_avg_ms": round(sum(latencies) / len(latencies) * 1000, 1) if latencies else 0.0,
+            "latency_p95_ms": round(latencies[int(len(latencies) * 0.95)] * 1000, 1) if latencies else 0.0,
+        }
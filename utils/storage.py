@@ -0,0 +1,251 @@
+"""
+Async storage facade used by the bot handlers.
+
+utils/firebase_db.py (and its sqlite fallback) is synchronous: every call is a
+blocking network or disk round trip. Calling it straight from a Pyrogram
+handler stalls the event loop, so one slow Firebase request freezes every chat
+the bot serves. This module exposes the same operations as coroutines and runs
+the blocking calls on a bounded thread pool instead.
+
+DB_BACKEND picks the backend:
+    firebase (default)  utils.firebase_db, which falls back to the local
+                        sqlite utils.db when Firebase is not configured
+    mongo               utils.motor_db, awaited natively (no thread pool)
+
+Whatever the backend, every successful debit/credit is also appended to the
+coin ledger (utils/ledger.py) for auditing and /history.
+
+Usage (async):
+    from utils.storage import ensure_user, get_user, change_balance
+    await ensure_user(user_id, username)
+    user = await get_user(user_id)
+"""
+from typing import Optional
+import os
+import uuid
+import asyncio
+import functools
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from .ledger import Ledger
+
+logger = logging.getLogger(__name__)
+
+DB_BACKEND = os.getenv("DB_BACKEND", "firebase").lower()
+USE_MONGO = DB_BACKEND == "mongo"
+
+if USE_MONGO:
+    from . import motor_db as backend
+else:
+    from . import firebase_db as backend
+
+# Upper bound on concurrent blocking storage calls. Extra calls queue up in the
+# executor instead of spawning more threads.
+DB_WORKERS = int(os.getenv("DB_WORKERS", "8"))
+
+_executor = ThreadPoolExecutor(max_workers=DB_WORKERS, thread_name_prefix="storage")
+
+# Append-only coin ledger; set LEDGER_DIR empty to disable
+LEDGER_DIR = os.getenv("LEDGER_DIR", "ledger")
+_ledger = Ledger(
+    LEDGER_DIR,
+    segment_bytes=int(os.getenv("LEDGER_SEGMENT_BYTES", str(4 * 1024 * 1024))),
+    snapshot_every=int(os.getenv("LEDGER_SNAPSHOT_EVERY", "10000")),
+    index_depth=int(os.getenv("LEDGER_INDEX_DEPTH", "200")),
+) if LEDGER_DIR else None
+
+# One thread owns the ledger file: appends stay in order and never block the loop
+_ledger_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ledger")
+
+
+async def _run(fn, *args):
+    """Run a blocking backend call on the storage pool"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, functools.partial(fn, *args))
+
+
+async def _ledger_run(fn, *args):
+    """Run a blocking ledger call on the ledger thread, after queued appends"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_ledger_executor, functools.partial(fn, *args))
+
+
+async def _call(name: str, *args):
+    """Dispatch to the selected backend: awaited directly for Motor,
+    on the storage pool for the blocking backends"""
+    fn = getattr(backend, name)
+    if USE_MONGO:
+        return await fn(*args)
+    return await _run(fn, *args)
+
+
+def _append(kind: str, user_id: int, delta: int, balance: int, ref: str):
+    try:
+        _ledger.record(kind, user_id, delta, balance, ref)
+    except Exception as e:
+        logger.error(f"Ledger append failed: {e}")
+
+
+def _record(kind: str, user_id: int, delta: int, balance: int, ref: str = None):
+    """Queue a ledger entry on the ledger thread (fire and forget)"""
+    if _ledger is not None:
+        _ledger_executor.submit(_append, kind, user_id, delta, balance, ref)
+
+
+async def _balance_of(user_id: int):
+    """Balance right after an operation whose backend call reports only
+    success; economy commands hold the user's lock, so it is that op's result"""
+    try:
+        user = await _call("get_user", user_id)
+    except Exception as e:
+        logger.error(f"Could not read balance for the ledger: {e}")
+        return None
+    return user["balance"] if user else None
+
+
+async def init_db():
+    await _call("init_db")
+    if _ledger is not None:
+        await _ledger_run(_ledger.open)
+    logger.info(f"Storage backend: {DB_BACKEND}")
+
+
+def cache_stats() -> dict:
+    """User record cache counters; in-memory, so safe to call on the loop"""
+    return {} if USE_MONGO else backend.cache_stats()
+
+
+def txn_stats() -> dict:
+    """Optimistic transaction counters (commits, conflicts, aborts, give-ups)"""
+    if USE_MONGO:
+        return {"credit_coalescer": backend.coalescer_stats()}
+    return backend.txn_stats()
+
+
+def write_behind_stats() -> dict:
+    return {"enabled": False} if USE_MONGO else backend.write_behind_stats()
+
+
+def ledger_stats() -> dict:
+    return _ledger.stats() if _ledger is not None else {"enabled": False}
+
+
+def invalidate_user(user_id: int = None):
+    if not USE_MONGO:
+        backend.invalidate_user(user_id)
+
+
+async def shutdown():
+    """Wait for queued storage calls and release the worker threads"""
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, functools.partial(_executor.shutdown, wait=True))
+    if USE_MONGO:
+        await backend.close()
+    else:
+        backend.close()
+    if _ledger is not None:
+        await loop.run_in_executor(None, functools.partial(_ledger_executor.shutdown, wait=True))
+        _ledger.close()
+
+
+# ═══════════════════════════════════════════════════════════════
+# USERS & ECONOMY
+# ═══════════════════════════════════════════════════════════════
+
+async def ensure_user(user_id: int, username: Optional[str] = None):
+    await _call("ensure_user", user_id, username)
+
+
+async def get_user(user_id: int):
+    return await _call("get_user", user_id)
+
+
+async def change_balance(user_id: int, delta: int, reason: str = "adjust"):
+    """reason is the ledger kind for this change (e.g. "kill", "protect")"""
+    new_balance = await _call("change_balance", user_id, delta)
+    if new_balance is not None:
+        _record(reason, user_id, delta, new_balance)
+    return new_balance
+
+
+async def transfer(sender_id: int, recipient_id: int, amount: int) -> bool:
+    moved = await _call("transfer", sender_id, recipient_id, amount)
+    if moved["ok"]:
+        # Balances as the transfer wrote them; a deferred credit records None
+        ref = uuid.uuid4().hex
+        _record("transfer_out", sender_id, -amount, moved["sender_balance"], ref)
+        _record("transfer_in", recipient_id, amount, moved["recipient_balance"], ref)
+    return moved["ok"]
+
+
+async def settle_bet(user_id: int, bet: int, payout_fn) -> dict:
+    settled = await _call("settle_bet", user_id, bet, payout_fn)
+    if settled["ok"]:
+        _record("bet", user_id, settled["payout"] - bet, settled["balance"])
+    return settled
+
+
+async def claim_daily(user_id: int, amount: int, now_ts: int) -> bool:
+    ok = await _call("claim_daily", user_id, amount, now_ts)
+    if ok and _ledger is not None:
+        _record("daily", user_id, amount, await _balance_of(user_id))
+    return ok
+
+
+async def history(user_id: int, limit: int = 10, offset: int = 0) -> list:
+    """A user's ledger entries, newest first"""
+    if _ledger is None:
+        return []
+    return await _ledger_run(_ledger.history, user_id, limit, offset)
+
+
+async def history_count(user_id: int) -> int:
+    """Number of ledger entries for a user, read on the ledger thread like history()"""
+    if _ledger is None:
+        return 0
+    return await _ledger_run(_ledger.count, user_id)
+
+
+async def set_premium(user_id: int, premium: bool):
+    await _call("set_premium", user_id, premium)
+
+
+async def is_premium(user_id: int) -> bool:
+    return await _call("is_premium", user_id)
+
+
+async def set_dead(user_id: int, dead: bool):
+    await _call("set_dead", user_id, dead)
+
+
+async def set_protect(user_id: int, until_ts: int):
+    await _call("set_protect", user_id, until_ts)
+
+
+async def set_last_daily(user_id: int, ts: int):
+    await _call("set_last_daily", user_id, ts)
+
+
+async def top_users(limit: int = 15):
+    return await _call("top_users", limit)
+
+
+# ═══════════════════════════════════════════════════════════════
+# GROUP MANAGEMENT
+# ═══════════════════════════════════════════════════════════════
+
+async def register_group(group_id: int, group_name: str = None):
+    await _call("register_group", group_id, group_name)
+
+
+async def is_group_registered(group_id: int) -> bool:
+    return await _call("is_group_registered", group_id)
+
+
+async def unregister_group(group_id: int):
+    await _call("unregister_group", group_id)
+
+
+async def get_all_registered_groups():
+    return await _call("get_all_registered_groups")
@@ -0,0 +1,88 @@
+"""
+Progressive Telegram replies for streamed AI text.
+
+The first chunk is sent as a normal reply as soon as it arrives; later text
+is applied by editing that message at most once every `interval` seconds.
+A FloodWait on an edit does not block the stream: intermediate edits are
+skipped until the wait has passed, and only the final edit sleeps it out so
+the complete reply always lands.
+
+Usage:
+    live = ProgressiveReply(message, interval=1.0)
+    async for chunk in stream:
+        await live.push(chunk)
+    await live.finish()
+"""
+import asyncio
+import time
+import logging
+
+from pyrogram.errors import FloodWait, MessageNotModified
+
+logger = logging.getLogger(__name__)
+
+
+class ProgressiveReply:
+    def __init__(self, message, interval: float = 1.0, render=None, max_flood_wait: float = 30.0, send=None):
+        """render(text) turns the accumulated raw text into what is displayed;
+        send(factory, retry) runs one Telegram call, e.g. through a SendQueue"""
+        self.message = message
+        self.interval = interval
+        self.render = render or (lambda text: text)
+        self.send = send or (lambda factory, retry: factory())
+        self.max_flood_wait = max_flood_wait
+        self.text = ""
+        self.sent = None
+        self._shown = ""
+        self._next_edit = 0.0
+        self.edits = 0
+        self.skipped = 0
+
+    async def push(self, chunk: str):
+        self.text += chunk
+        if not self.text.strip():
+            return
+        if self.sent is None:
+            await self._send()
+        elif time.monotonic() >= self._next_edit:
+            await self._edit(final=False)
+        else:
+            self.skipped += 1
+
+    async def finish(self, suffix: str = ""):
+        """Show the complete text (plus `suffix`); returns the sent message"""
+        self.text += suffix
+        if self.sent is None:
+            await self._send()
+        else:
+            await self._edit(final=True)
+        return self.sent
+
+    async def _send(self):
+        self._shown = self.render(self.text)
+        shown = self._shown
+        self.sent = await self.send(lambda: self.message.reply_text(shown), True)
+        self._next_edit = time.monotonic() + self.interval
+
+    async def _edit(self, final: bool):
+        shown = self.render(self.text)
+        if shown == self._shown:
+            return
+        if final:
+            wait = self._next_edit - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(min(wait, self.max_flood_wait))
+        try:
+            await self.send(lambda: self.sent.edit_text(shown), False)
+        except MessageNotModified:
+            pass
+        except FloodWait as e:
+            self._next_edit = time.monotonic() + e.value
+            if not final or e.value > self.max_flood_wait:
+                logger.warning(f"FloodWait {e.value}s while streaming a reply")
+                return
+            await asyncio.sleep(e.value)
+            await self.send(lambda: self.sent.edit_text(shown), True)
+        self._shown = shown
+        self.edits += 1
+        self._next_edit = max(self._next_edit, time.monotonic() + self.interval)
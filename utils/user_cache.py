@@ -0,0 +1,85 @@
+"""
+In-process cache of `users/{id}` records for the Firebase backend.
+
+Bounded LRU with a per-entry TTL. utils.firebase_db writes through it on every
+mutation, so repeated reads within one command (and across commands) are
+served from memory; the TTL only matters if something else edits the
+database behind the bot's back.
+
+Entries may also carry the ETag the record was read or written with, which
+lets optimistic transactions skip their initial read on a cache hit.
+"""
+from collections import OrderedDict
+import threading
+import time
+
+
+class UserCache:
+    """Thread-safe LRU/TTL cache of user records keyed by user_id"""
+
+    def __init__(self, max_size: int = 10000, ttl: float = 300.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict()  # user_id -> [expires_at, record, etag]
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, user_id: int):
+        """Return a copy of the cached record, or None on miss/expiry"""
+        entry = self.get_entry(user_id)
+        return entry[0] if entry else None
+
+    def get_entry(self, user_id: int):
+        """Return (record copy, etag) or None on miss/expiry"""
+        now = time.monotonic()
+        with self._lock:
+            item = self._data.get(user_id)
+            if item is None or item[0] < now:
+                if item is not None:
+                    del self._data[user_id]
+                self.misses += 1
+                return None
+            self._data.move_to_end(user_id)
+            self.hits += 1
+            return dict(item[1]), item[2]
+
+    def put(self, user_id: int, record: dict, etag: str = None):
+        if record is None:
+            return
+        with self._lock:
+            self._data[user_id] = [time.monotonic() + self.ttl, dict(record), etag]
+            self._data.move_to_end(user_id)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def update(self, user_id: int, fields: dict):
+        """Write-through a partial update; a no-op if the user is not cached"""
+        with self._lock:
+            item = self._data.get(user_id)
+            if item is not None:
+                item[1].update(fields)
+                item[2] = None  # server-side ETag is no longer known
+
+    def invalidate(self, user_id: int = None):
+        """Drop one user, or everything when user_id is None"""
+        with self._lock:
+            if user_id is None:
+                self._data.clear()
+            else:
+                self._data.pop(user_id, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "max_size": self.max_size,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
@@ -0,0 +1,66 @@
+"""
+Striped per-user locks for economy mutations.
+
+A fixed table of asyncio locks; user_id hashes to a stripe. Commands from the
+same user therefore run one at a time (so two concurrent /slots cannot both
+pass the balance check), while different users mostly land on different
+stripes and proceed in parallel. Memory stays constant however many users
+the bot sees.
+
+Multi-user operations (send, kill) lock every involved stripe in ascending
+stripe order, so two handlers locking the same pair in opposite roles cannot
+deadlock.
+
+Usage:
+    async with user_locks.hold(sender.id, recipient.id):
+        ...
+"""
+from contextlib import asynccontextmanager
+import asyncio
+import time
+
+
+class StripedLocks:
+    def __init__(self, stripes: int = 64):
+        self.stripes = stripes
+        self._locks = [asyncio.Lock() for _ in range(stripes)]
+        self.acquired = 0
+        self.contended = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def stripe(self, user_id: int) -> int:
+        return hash(user_id) % self.stripes
+
+    @asynccontextmanager
+    async def hold(self, *user_ids: int):
+        """Hold the stripes of all user_ids for the duration of the block"""
+        order = sorted({self.stripe(uid) for uid in user_ids})
+        started = time.perf_counter()
+        contended = False
+        held = []
+        try:
+            for i in order:
+                lock = self._locks[i]
+                contended = contended or lock.locked()
+                await lock.acquire()
+                held.append(lock)
+            waited = time.perf_counter() - started
+            self.acquired += 1
+            self.contended += contended
+            self.wait_total += waited
+            self.wait_max = max(self.wait_max, waited)
+            yield
+        finally:
+            for lock in reversed(held):
+                lock.release()
+
+    def stats(self) -> dict:
+        return {
+            "stripes": self.stripes,
+            "acquired": self.acquired,
+            "contended": self.contended,
+            "wait_avg_ms": round(self.wait_total / self.acquired * 1000, 3) if self.acquired else 0.0,
+            "wait_max_ms": round(self.wait_max * 1000, 3),
+            "held": sum(lock.locked() for lock in self._locks),
+        }
@@ -0,0 +1,248 @@
+"""
+Write-behind batching of balance deltas.
+
+Optional mode for utils.firebase_db (WRITE_BEHIND=1). Instead of one Firebase
+write per spin, balance changes are applied to an in-memory shadow balance,
+appended to a local journal and flushed as a single multi-path update every
+WRITE_BEHIND_INTERVAL_MS, or sooner once WRITE_BEHIND_MAX_OPS changes are
+waiting.
+
+Durability: every change is appended (and fsynced) to the journal before it
+is acknowledged. Each flush writes the highest journal sequence number it
+covers in the same atomic update as the deltas, so on startup recover() can
+replay exactly the entries that never reached the database, without double
+applying ones that did. The same watermark settles a flush that failed
+ambiguously: the batch is re-sent only if the stored seq is still below it.
+
+While a user has a shadow balance it is authoritative: this process must be
+the only writer of that user's balance, which holds for the single-instance
+deployment. Operations that write a balance by other means flush first.
+"""
+import os
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBehindBuffer:
+    def __init__(self, flush_fn, journal_path: str, interval: float = 0.5,
+                 max_ops: int = 200, fsync: bool = True, on_flushed=None, read_seq=None):
+        """flush_fn(deltas: {user_id: delta}, seq: int) must apply all deltas
+        and record seq atomically, raising on failure. read_seq() returns the
+        last recorded seq; it decides whether a failed flush landed anyway.
+        on_flushed(user_id) is called once a user's shadow balance has been
+        dropped."""
+        self._flush_fn = flush_fn
+        self._read_seq = read_seq
+        self._on_flushed = on_flushed
+        self.journal_path = journal_path
+        self.interval = interval
+        self.max_ops = max_ops
+        self.fsync = fsync
+
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+        self._shadow = {}   # user_id -> authoritative balance
+        self._pending = {}  # user_id -> unflushed delta
+        self._ops = 0       # changes since the last flush started
+        self._seq = 0
+        self._journal = None
+        self._unconfirmed = None  # (batch, seq) whose flush failed; in the .flushing journal
+
+        self.flushes = 0
+        self.flushed_ops = 0
+        self.failures = 0
+        self.last_flush_ms = 0.0
+
+    # ── journal ──────────────────────────────────────────────────
+
+    @property
+    def _flushing_path(self) -> str:
+        return self.journal_path + ".flushing"
+
+    def _open_journal(self):
+        self._journal = open(self.journal_path, "a", encoding="utf-8")
+
+    def _append(self, line: str):
+        self._journal.write(line)
+        self._journal.flush()
+        if self.fsync:
+            os.fsync(self._journal.fileno())
+
+    def _read_entries(self):
+        entries = []
+        for path in (self._flushing_path, self.journal_path):
+            if not os.path.exists(path):
+                continue
+            with open(path, encoding="utf-8") as fh:
+                for line in fh:
+                    parts = line.split()
+                    if len(parts) == 3:  # a torn last line is simply skipped
+                        entries.append((int(parts[0]), int(parts[1]), int(parts[2])))
+        return entries
+
+    def recover(self, flushed_seq: int):
+        """Replay journal entries newer than flushed_seq, then start clean"""
+        entries = self._read_entries()
+        deltas = {}
+        for seq, user_id, delta in entries:
+            if seq > flushed_seq:
+                deltas[user_id] = deltas.get(user_id, 0) + delta
+        last_seq = max([flushed_seq] + [e[0] for e in entries])
+        deltas = {uid: d for uid, d in deltas.items() if d}
+        if deltas:
+            self._flush_fn(deltas, last_seq)
+            logger.info(f"Write-behind: replayed journal deltas for {len(deltas)} users")
+        for path in (self._flushing_path, self.journal_path):
+            if os.path.exists(path):
+                os.remove(path)
+        self._seq = last_seq
+        self._open_journal()
+
+    # ── buffer ───────────────────────────────────────────────────
+
+    def balance(self, user_id: int):
+        """Shadow balance, or None if the user has nothing buffered"""
+        with self._lock:
+            return self._shadow.get(user_id)
+
+    def apply(self, user_id: int, delta_fn, load_balance) -> int:
+        """Buffer one change atomically; returns the new balance.
+
+        delta_fn(balance) returns the delta to apply, or raises to abort with
+        nothing written. The balance check, the journal line and the buffered
+        add happen under one hold of the lock, so the flusher cannot drop the
+        shadow balance in between. For a user without one, load_balance()
+        supplies the stored balance (called outside the lock).
+        """
+        seed = None
+        while True:
+            with self._lock:
+                balance = self._shadow.get(user_id, seed)
+                if balance is not None:
+                    delta = delta_fn(balance)
+                    seq = self._seq + 1
+                    # Only in-memory updates follow the journal line, so a
+                    # journalled change is always applied
+                    self._append(f"{seq} {user_id} {delta}\n")
+                    self._seq = seq
+                    self._shadow[user_id] = balance + delta
+                    self._pending[user_id] = self._pending.get(user_id, 0) + delta
+                    self._ops += 1
+                    if self._ops >= self.max_ops:
+                        self._wake.set()
+                    return balance + delta
+            # Not tracked (or just dropped by a flush): the stored value is current
+            seed = load_balance()
+
+    def flush(self) -> bool:
+        """Push every buffered delta in one update; True if nothing is left"""
+        with self._flush_lock:
+            if self._unconfirmed is not None and not self._resolve():
+                return False
+            with self._lock:
+                self._ops = 0
+                if not self._pending:
+                    return True
+                batch, self._pending = self._pending, {}
+                seq = self._seq
+                self._journal.close()
+                os.replace(self.journal_path, self._flushing_path)
+                self._open_journal()
+            self._unconfirmed = (batch, seq)
+            return self._send()
+
+    def _send(self) -> bool:
+        batch, seq = self._unconfirmed
+        started = time.perf_counter()
+        try:
+            self._flush_fn({uid: d for uid, d in batch.items() if d}, seq)
+        except Exception as e:
+            # The update may still have been applied (timeout, lost response),
+            # so the batch is kept aside and checked before it is sent again
+            logger.error(f"Write-behind flush of seq {seq} failed, will verify and retry: {e}")
+            with self._lock:
+                self.failures += 1
+            return False
+        self._confirmed(time.perf_counter() - started)
+        return True
+
+    def _resolve(self) -> bool:
+        """Settle a batch whose flush failed: drop it if the stored watermark
+        shows it was applied after all, otherwise send it again (same seq)"""
+        batch, seq = self._unconfirmed
+        if self._read_seq is not None:
+            try:
+                stored = self._read_seq()
+            except Exception as e:
+                logger.error(f"Write-behind cannot read the flushed seq, will retry: {e}")
+                return False
+            if stored >= seq:
+                logger.warning(f"Write-behind batch {seq} was applied despite the error")
+                self._confirmed(None)
+                return True
+        return self._send()
+
+    def _confirmed(self, elapsed):
+        batch, _ = self._unconfirmed
+        with self._lock:
+            self._unconfirmed = None
+            os.remove(self._flushing_path)
+            self.flushes += 1
+            self.flushed_ops += len(batch)
+            if elapsed is not None:
+                self.last_flush_ms = round(elapsed * 1000, 3)
+            dropped = [uid for uid in batch if uid not in self._pending]
+            for uid in dropped:
+                self._shadow.pop(uid, None)
+                if self._on_flushed:
+                    self._on_flushed(uid)
+
+    # ── background flusher ───────────────────────────────────────
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Write-behind flusher error: {e}")
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+            self._thread.start()
+
+    def close(self):
+        """Stop the flusher and push whatever is still buffered"""
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+        with self._lock:
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "tracked_users": len(self._shadow),
+                "pending_users": len(self._pending),
+                "pending_ops": self._ops,
+                "seq": self._seq,
+                "unconfirmed_seq": self._unconfirmed[1] if self._unconfirmed else None,
+                "flushes": self.flushes,
+                "flushed_user_deltas": self.flushed_ops,
+                "failures": self.failures,
+                "last_flush_ms": self.last_flush_ms,
+            }